@@ -0,0 +1,140 @@
+import os
+import json
+from dotenv import load_dotenv
+
+# some important enviroment variables
+load_dotenv()
+OUTPUTS_PATH = os.getenv("OUTPUTS_PATH")
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", f"{OUTPUTS_PATH}checkpoints/")
+
+
+class Checkpoint:
+
+    """
+        This class is an append-only journal of the analyses completed during a report run, so an
+        interrupted run can be resumed without analyzing again what was already done.
+        Every completed file or directory is written as a json line and flushed to disk right away,
+        so at most the analyses in flight are lost. A line cut by a crash is skipped when the journal is read.
+
+        Records are {"type": "file", "id": ..., "dependencies": ..., "explanation": ...} for the files
+        and {"type": "directory", "path": ..., "explanation": ...} for the directories.
+
+        Attributes:
+            path: The path of the journal of the project.
+            records: The records read from the journal, by (type, id or path).
+            file: The journal open for appending, while the run goes on.
+
+        Methods:
+            open: Opens the journal, starting it over or resuming it.
+            load: Reads the records of the journal.
+            record: Appends a record to the journal.
+            close: Closes the journal.
+            remove: Removes the journal once the report is saved.
+    """
+
+    def __init__(self, project_name: str, checkpoint_path: str = CHECKPOINT_PATH) -> None:
+        self.path : str = os.path.join(checkpoint_path, f"{project_name}.jsonl")
+        self.records : dict[tuple, dict] = {}
+        self.file = None
+
+        os.makedirs(checkpoint_path, exist_ok=True)
+
+    def open(self, resume: bool = False) -> None:
+        """
+            Opens the journal. When resuming, the records of the previous run are loaded and the new ones
+            are appended after them, otherwise the journal is started over.
+
+            Args:
+            ----------
+            resume: bool
+                Whether to resume the previous run.
+
+            Returns:
+            ----------
+            None
+        """
+        if not resume:
+            self.file = open(self.path, "w")
+            return
+
+        self.load()
+        self.file = open(self.path, "a")
+        # a crash may have cut the last line, the next record must start in a line of its own
+        if self.file.tell() > 0:
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self.file.write("\n")
+
+    def load(self) -> None:
+        """
+            Reads the records of the journal, if it exists. The lines that are not valid json are skipped.
+
+            Args:
+            ----------
+            None
+
+            Returns:
+            ----------
+            None
+        """
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                key = record["id"] if record["type"] == "file" else record["path"]
+                self.records[(record["type"], key)] = record
+
+    def record(self, record: dict) -> None:
+        """
+            Appends a record to the journal and forces it to disk.
+
+            Args:
+            ----------
+            record: dict
+                The record of a completed file or directory.
+
+            Returns:
+            ----------
+            None
+        """
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+        """
+            Closes the journal.
+
+            Args:
+            ----------
+            None
+
+            Returns:
+            ----------
+            None
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def remove(self) -> None:
+        """
+            Closes and removes the journal, once the report it was protecting is saved.
+
+            Args:
+            ----------
+            None
+
+            Returns:
+            ----------
+            None
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,155 @@
+import os
+import ast
+from PathIndex import PathIndex
+
+
+class DependencyResolver:
+
+    """
+        This class finds the dependencies of a python file statically, by parsing its imports with
+        the ast module and resolving them against the python modules of the project, looked up in
+        the path index of the project.
+
+        Internal dependencies are written as 'int/<module>' taking as reference the root of the project,
+        for example 'int/lib/sub_lib/module', packages are written as their '__init__' module, for example
+        'int/lib/__init__'. External dependencies are written as 'ext/<top level package>', for example 'ext/numpy'.
+
+        Attributes:
+            project_path: The path of the project.
+            path_index: The index of the modules of the project.
+
+        Methods:
+            load_modules: Indexes all the files of the project.
+            lookup: Returns the python module of a module path or package folder.
+            resolve: Returns the dependencies of a python file.
+            resolve_module: Returns the dependency for an imported module.
+    """
+
+    def __init__(self, project_path: str, path_index: PathIndex = None) -> None:
+        self.project_path : str = project_path
+        self.path_index : PathIndex = path_index
+        if self.path_index is None:
+            self.load_modules()
+
+    def load_modules(self) -> None:
+        """
+            Indexes all the files of the project, walking it. This is only needed when the
+            index of the project scan is not given.
+
+            Args:
+            ----------
+            None
+
+            Returns:
+            ----------
+            None
+        """
+        files = []
+        for root, _, filenames in os.walk(self.project_path):
+            folder = os.path.relpath(root, self.project_path).replace(os.sep, "/")
+            files.extend(filename if folder == "." else f"{folder}/{filename}" for filename in filenames)
+        self.path_index = PathIndex(files)
+
+    def lookup(self, candidate: str) -> str:
+        """
+            Returns the python module of a module path or a package folder, or None if it is not one.
+
+            Args:
+            ----------
+            candidate: str
+                The module path or package folder, relative to the project root, like 'lib/module'.
+
+            Returns:
+            ----------
+            str
+                The module, like 'lib/module' or 'lib/__init__', or None.
+        """
+        module = self.path_index.modules.get(candidate)
+        if module is None or not self.path_index.paths[module].endswith(".py"):
+            return None
+        return module
+
+    def resolve(self, file_full_path: str, code: str) -> list[str]:
+        """
+            Returns the dependencies of a python file, in the order they are imported and without
+            repetitions. If the code can't be parsed returns None.
+
+            Args:
+            ----------
+            file_full_path: str
+                The path of the file, starting with the name of the project root folder.
+            code: str
+                The code of the file.
+
+            Returns:
+            ----------
+            list[str]
+                The dependencies of the file.
+        """
+        try:
+            tree = ast.parse(code)
+        except (SyntaxError, ValueError):
+            return None
+
+        # the folder of the file relative to the project root, the first part of the path is the root itself
+        folder = file_full_path.split("/")[1:-1]
+
+        imports = [node for node in ast.walk(tree) if isinstance(node, (ast.Import, ast.ImportFrom))]
+        imports.sort(key=lambda node: (node.lineno, node.col_offset))
+
+        dependencies = []
+        for node in imports:
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    dependencies.append(self.resolve_module(alias.name.split("."), folder))
+            elif node.module == "__future__":
+                continue
+            else:
+                module = node.module.split(".") if node.module else []
+                for alias in node.names:
+                    # 'from lib import name' may import the submodule 'lib/name' or just an attribute of 'lib'
+                    names = [] if alias.name == "*" else [alias.name]
+                    dependencies.append(self.resolve_module(module + names, folder, node.level))
+
+        return [dependency for dependency in dict.fromkeys(dependencies) if dependency is not None]
+
+    def resolve_module(self, parts: list[str], folder: list[str], level: int = 0) -> str:
+        """
+            Returns the dependency for an imported module. Absolute imports are looked up from the folder of
+            the file (like python does for scripts) and then from the project root, relative imports are looked
+            up from the package given by their level. The longest part of the import that is a module of the
+            project is the dependency, if there is none the import is external. A relative import that is not
+            a module nor a package of the project has no dependency.
+
+            Args:
+            ----------
+            parts: list[str]
+                The parts of the imported module, for example ['lib', 'sub_lib', 'module'].
+            folder: list[str]
+                The parts of the folder of the file that imports the module, relative to the project root.
+            level: int
+                The level of a relative import, 0 for absolute imports.
+
+            Returns:
+            ----------
+            str
+                The dependency, as 'int/<path>' or 'ext/<package>', or None.
+        """
+        if level > 0:
+            if level - 1 > len(folder):
+                return None
+            bases = [folder[:len(folder) - (level - 1)]]
+        else:
+            bases = [folder, []] if folder else [[]]
+
+        for base in bases:
+            # 'from . import name' may import just an attribute of the package, so the package itself is tried last
+            last = len(base) - 1 if level > 0 and base else len(base)
+            for end in range(len(base + parts), last, -1):
+                module = self.lookup("/".join((base + parts)[:end]))
+                if module is not None:
+                    return f"int/{module}"
+
+        if level > 0:
+            return None
+        return f"ext/{parts[0]}"
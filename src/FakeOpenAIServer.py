@@ -0,0 +1,275 @@
+import json
+import time
+import random
+import threading
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOpenAIServer:
+
+    """
+        This class is a local OpenAI compatible server that answers every request with a canned response,
+        so the pipeline can be run end to end without paying OpenAI, for example by the benchmark.
+        It serves the '/v1/completions' and '/v1/chat/completions' endpoints, pointing OPENAI_API_BASE
+        to it (http://localhost:<port>/v1) is enough. It also serves the '/completion' endpoint of a llama.cpp
+        server, for LLAMACPP_SERVER_URL (http://localhost:<port>), which honours the grammar: with a grammar
+        the completion is the bare json, without one the json comes wrapped in text, like a chatty model.
+
+        The latency of every response is drawn from a log-normal distribution with the given median and
+        spread, and a share of the requests can be answered with rate limit (429, with a 'retry-after')
+        or unavailable (503) errors. The latency, the errors and the canned response of a request are drawn
+        from the hash of the seed, its prompt and how many times that prompt was sent before, not from the
+        order the requests arrive in, so with the same seed the same requests (and their retries) get the
+        same answers even when they are sent concurrently.
+
+        The canned responses are picked by the hash of the prompt, by default there is a single one, a json
+        that follows the schema of every template (file analysis, cohesion and coupling), padded to about the
+        given number of tokens.
+
+        Attributes:
+            host: The host the server listens on.
+            port: The port the server listens on, 0 picks a free one.
+            latency: The median latency of the responses in seconds.
+            latency_spread: The sigma of the log-normal latency, 0 makes the latency constant.
+            rate_limit_rate: The share of the requests answered with a rate limit error.
+            error_rate: The share of the requests answered with an unavailable error.
+            retry_after: The seconds to wait asked by the rate limit errors.
+            responses: The canned responses, by default a json of about completion_tokens tokens.
+            seed: The seed of the draws.
+            stats: The counts of requests, responses, errors and tokens served.
+            attempts: How many times every prompt was sent, by the hash of the seed and the prompt.
+            last_request: The json body of the last request.
+            lock: The lock guarding the attempts and the stats.
+            server: The HTTP server, while it runs.
+
+        Methods:
+            start: Starts the server in a background thread.
+            stop: Stops the server.
+            url: Returns the base url to use as OPENAI_API_BASE.
+            llamacpp_url: Returns the url to use as LLAMACPP_SERVER_URL.
+            reset_stats: Resets the stats and the attempts.
+            answer: Returns the status, headers and body of the answer to a request.
+    """
+
+    default_explanation = ("This file defines the main classes and functions of its module, "
+                           "they are used by the rest of the project to process the data. ")
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.05, latency_spread: float = 0.5,
+                 rate_limit_rate: float = 0, error_rate: float = 0, retry_after: float = 0.1,
+                 responses: list[str] = None, completion_tokens: int = 200, seed: int = 0) -> None:
+        self.host : str = host
+        self.port : int = port
+        self.latency : float = latency
+        self.latency_spread : float = latency_spread
+        self.rate_limit_rate : float = rate_limit_rate
+        self.error_rate : float = error_rate
+        self.retry_after : float = retry_after
+        self.responses : list[str] = responses or [self.default_response(completion_tokens)]
+        self.seed : int = seed
+        self.stats : dict = {}
+        self.attempts : dict[str, int] = {}
+        self.lock : threading.Lock = threading.Lock()
+        self.server : ThreadingHTTPServer = None
+        self.last_request : dict = None
+        self.reset_stats()
+
+    @staticmethod
+    def default_response(completion_tokens: int) -> str:
+        """
+            Returns a json response valid for every template, with an explanation of about the given tokens.
+
+            Args:
+            ----------
+            completion_tokens: int
+                The approximate number of tokens of the response.
+
+            Returns:
+            ----------
+            str
+                The response.
+        """
+        # the sentence is about 25 tokens long
+        explanation = FakeOpenAIServer.default_explanation * max(1, completion_tokens // 25)
+        return json.dumps({"dependencies": [], "explanation": explanation.strip(),
+                           "coupling": "low", "cohesion": "high"})
+
+    def start(self) -> None:
+        """
+            Starts the server in a background thread.
+
+            Args:
+            ----------
+            None
+
+            Returns:
+            ----------
+            None
+        """
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, like the OpenAI API
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status, headers, answer = fake.answer(self.path, json.loads(body or b"{}"))
+                payload = json.dumps(answer).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for header, value in headers.items():
+                    self.send_header(header, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        """
+            Stops the server.
+
+            Args:
+            ----------
+            None
+
+            Returns:
+            ----------
+            None
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def url(self) -> str:
+        """
+            Returns the base url of the server, to use as OPENAI_API_BASE.
+
+            Args:
+            ----------
+            None
+
+            Returns:
+            ----------
+            str
+                The base url.
+        """
+        return f"http://{self.host}:{self.port}/v1"
+
+    def llamacpp_url(self) -> str:
+        """
+            Returns the url of the server, to use as LLAMACPP_SERVER_URL.
+
+            Args:
+            ----------
+            None
+
+            Returns:
+            ----------
+            str
+                The url.
+        """
+        return f"http://{self.host}:{self.port}"
+
+    def reset_stats(self) -> None:
+        """
+            Resets the counts of requests, responses, errors and tokens served, and the attempts of the prompts,
+            so the next requests are answered as in a new run.
+
+            Args:
+            ----------
+            None
+
+            Returns:
+            ----------
+            None
+        """
+        with self.lock:
+            self.stats = {"requests": 0, "responses": 0, "rate_limited": 0, "errors": 0,
+                          "prompt_tokens": 0, "completion_tokens": 0}
+            self.attempts = {}
+
+    def answer(self, path: str, request: dict) -> tuple:
+        """
+            Returns the answer to a request after the simulated latency: an injected error,
+            or a completion with the canned responses. The tokens are estimated as a token
+            every 4 characters.
+
+            Args:
+            ----------
+            path: str
+                The path of the request.
+            request: dict
+                The json body of the request.
+
+            Returns:
+            ----------
+            tuple
+                The status, the headers and the json body of the answer.
+        """
+        llamacpp = path.rstrip("/") == "/completion"
+        chat = path.rstrip("/").endswith("/chat/completions")
+        if chat:
+            prompts = ["".join(str(message.get("content", "")) for message in request.get("messages", []))]
+        else:
+            prompts = request.get("prompt", "")
+            prompts = prompts if isinstance(prompts, list) else [prompts]
+
+        digest = sha256(json.dumps([self.seed, prompts]).encode("utf-8")).hexdigest()
+        with self.lock:
+            self.stats["requests"] += 1
+            self.last_request = request
+            attempt = self.attempts.get(digest, 0)
+            self.attempts[digest] = attempt + 1
+
+        generator = random.Random(f"{digest}:{attempt}")
+        draw = generator.random()
+        latency = self.latency * generator.lognormvariate(0, self.latency_spread) if self.latency_spread else self.latency
+        time.sleep(latency)
+
+        if draw < self.rate_limit_rate:
+            with self.lock:
+                self.stats["rate_limited"] += 1
+            return 429, {"retry-after": str(self.retry_after)}, {
+                "error": {"message": "Rate limit reached (fake server)", "type": "requests", "code": "rate_limit_exceeded"}}
+        if draw < self.rate_limit_rate + self.error_rate:
+            with self.lock:
+                self.stats["errors"] += 1
+            return 503, {}, {"error": {"message": "The server is overloaded (fake server)", "type": "server_error"}}
+
+        texts = [self.responses[int(sha256(f"{self.seed}:{prompt}".encode("utf-8")).hexdigest(), 16) % len(self.responses)]
+                 for prompt in prompts]
+        with self.lock:
+            self.stats["responses"] += 1
+            response_id = self.stats["responses"]
+            prompt_tokens = sum(len(prompt) for prompt in prompts) // 4
+            completion_tokens = sum(len(text) for text in texts) // 4
+            self.stats["prompt_tokens"] += prompt_tokens
+            self.stats["completion_tokens"] += completion_tokens
+
+        if llamacpp:
+            text = texts[0] if request.get("grammar") else f"Sure! This is the analysis of the file:\n{texts[0]}\nHope it helps."
+            return 200, {}, {"content": text, "stop": True, "tokens_evaluated": prompt_tokens,
+                             "tokens_predicted": completion_tokens}
+        if chat:
+            choices = [{"index": 0, "message": {"role": "assistant", "content": texts[0]}, "finish_reason": "stop"}]
+        else:
+            choices = [{"index": index, "text": text, "logprobs": None, "finish_reason": "stop"}
+                       for index, text in enumerate(texts)]
+        return 200, {}, {
+            "id": f"fake-{response_id}",
+            "object": "chat.completion" if chat else "text_completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": choices,
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
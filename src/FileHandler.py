@@ -1,6 +1,9 @@
+import ast
 import json
 import os
 import logging
+import tiktoken
+from functools import lru_cache
 from typing import List
 from dotenv import load_dotenv
 from langchain.text_splitter import (RecursiveCharacterTextSplitter, Language)
@@ -20,9 +23,12 @@ class FileHandler:
         It will be in charge of reading the files, chunking them, and retrieving the chunks.
 
 
-        Attributes:
+        Class Attributes:
         ----------
-        - None 
+        - extensions_to_lang: dict
+            The languages of the source code files, by file extension.
+        - interpreters_to_lang: dict
+            The languages of the scripts without extension, by the interpreter in their shebang.
         
         Methods:
         ----------
@@ -33,12 +39,44 @@ class FileHandler:
             chunk size, this does not guarantee that they all have the same size, but they should be close.
             Also considers the chunk overlap, which allows to have a bit of the previous information available.
         
+        - chunk_python_document: List[Document]
+            This function chunks python code at the boundaries of its top level definitions, packing whole
+            definitions into each chunk, and adds to every chunk a skeleton of the file (imports and signatures).
+
         - from_filename_to_lang: Language
             This function is supposed to take the filename and infer the language by taking the last part of the name
             and then return the Language it corresponds to if any (in the dict of supported LangChain languages)
             If it does not find it, it will return None.
+
+        - get_splitter: RecursiveCharacterTextSplitter
+            This function returns the text splitter for a language and chunk size, splitters are built once and reused.
     """
 
+    extensions_to_lang = {
+        ".py": Language.PYTHON, ".pyw": Language.PYTHON, ".pyi": Language.PYTHON,
+        ".js": Language.JS, ".jsx": Language.JS, ".mjs": Language.JS, ".cjs": Language.JS,
+        ".ts": Language.JS, ".tsx": Language.JS,
+        ".go": Language.GO,
+        ".java": Language.JAVA,
+        ".c": Language.CPP, ".h": Language.CPP, ".cc": Language.CPP, ".cpp": Language.CPP, ".cxx": Language.CPP,
+        ".hh": Language.CPP, ".hpp": Language.CPP,
+        ".php": Language.PHP,
+        ".proto": Language.PROTO,
+        ".rb": Language.RUBY,
+        ".rs": Language.RUST,
+        ".scala": Language.SCALA,
+        ".swift": Language.SWIFT,
+        ".sol": Language.SOL,
+    }
+
+    interpreters_to_lang = {
+        "python": Language.PYTHON,
+        "node": Language.JS,
+        "deno": Language.JS,
+        "ruby": Language.RUBY,
+        "php": Language.PHP,
+    }
+
     def __init__(self) -> None:
         """
             The constructor for the FileHandler class.
@@ -47,31 +85,98 @@ class FileHandler:
 
 
     @staticmethod
-    def from_filename_to_lang(filename: str):
+    def from_filename_to_lang(filename: str, first_line: str = None):
         """
             This function is supposed to take the filename and infer the language by taking the last part of the name
             and then return the Language it corresponds to if any (in the dict of supported LangChain languages)
+            Files without extension are recognized by the interpreter of their shebang, if the first line is given.
             If it does not find it, it will return None
 
             Args:
             ----------
             filename: str
                 The filename to infer the language from
+            first_line: str
+                The first line of the file, used for the files without extension.
             
             Returns:
             ----------
             Language
                 The language that corresponds to the filename, if any.
         """
-        return Language.PYTHON
+        root, extension = os.path.splitext(filename)
+        if extension:
+            return FileHandler.extensions_to_lang.get(extension.lower())
+
+        if first_line is None or not first_line.startswith("#!"):
+            return None
+
+        # '#!/usr/bin/python3', '#!/usr/bin/env python3' or '#!/usr/bin/env -S node --flag'
+        for word in first_line[2:].split():
+            interpreter = word.split("/")[-1].rstrip("0123456789.")
+            if interpreter in FileHandler.interpreters_to_lang:
+                return FileHandler.interpreters_to_lang[interpreter]
+        return None
+
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def get_splitter(lang: Language, chunk_size: int, chunk_overlap: int = 0,
+                     encoding: tiktoken.Encoding = None) -> RecursiveCharacterTextSplitter:
+        """
+            This function returns the recursive text splitter for the given language and chunk size,
+            splitters are built once and then reused for every file with the same language and chunk size.
+
+            Args:
+            ----------
+            lang: Language
+                The language of the code.
+            chunk_size: int
+                The size of the chunks to create.
+            chunk_overlap: int
+                The overlap between chunks.
+            encoding: tiktoken.Encoding
+                The encoding used to measure the chunks in tokens, if any.
+
+            Returns:
+            ----------
+            RecursiveCharacterTextSplitter
+                The splitter.
+        """
+        return RecursiveCharacterTextSplitter.from_language(chunk_size=chunk_size,
+                                                            chunk_overlap=chunk_overlap,
+                                                            length_function=FileHandler.length_function(encoding),
+                                                            language=lang, )
 
     @staticmethod
-    def chunk_document(filename_full_path: str, code: str, chunk_size: int, chunk_overlap: int = 0) -> List[Document]:
+    def length_function(encoding: tiktoken.Encoding = None):
+        """
+            This function returns the function measuring the size of the chunks, in tokens of the
+            given encoding or in characters if there is no encoding.
+
+            Args:
+            ----------
+            encoding: tiktoken.Encoding
+                The encoding used to measure the chunks in tokens, if any.
+
+            Returns:
+            ----------
+            Callable[[str], int]
+                The function measuring the size of the chunks.
+        """
+        if encoding is None:
+            return len
+        return lambda text: len(encoding.encode(text))
+
+    @staticmethod
+    def chunk_document(filename_full_path: str, code: str, chunk_size: int, chunk_overlap: int = 0,
+                       encoding: tiktoken.Encoding = None) -> List[Document]:
         """
             This function chunks a given block of code taking into account the semantic categories given in a language
             by considering it's syntax, from it recursively tries to divide each chunk into one or many of the desired
             chunk size, this does not guarantee that they all have the same size, but they should be close.
             Also considers the chunk overlap, which allows to have a bit of the previous information available.
+            When an encoding is given the chunk size and overlap are measured in tokens of that encoding,
+            otherwise they are measured in characters.
 
             Args:
             ----------
@@ -83,6 +188,8 @@ class FileHandler:
                 The size of the chunks to create.
             chunk_overlap: int
                 The overlap between chunks.
+            encoding: tiktoken.Encoding
+                The encoding used to measure the chunks in tokens, if any.
             
             Returns:
             ----------
@@ -91,9 +198,180 @@ class FileHandler:
         """
 
         filename = filename_full_path.split("/")[-1]
-        lang = FileHandler.from_filename_to_lang(filename)
-        python_splitter = RecursiveCharacterTextSplitter.from_language(chunk_size=chunk_size,
-                                                                       chunk_overlap=chunk_overlap,
-                                                                       language=lang, )
-        docs = python_splitter.create_documents([code])
-        return docs
\ No newline at end of file
+        lang = FileHandler.from_filename_to_lang(filename, code.split("\n", 1)[0])
+
+        docs = None
+        if lang == Language.PYTHON:
+            docs = FileHandler.chunk_python_document(code, chunk_size, encoding)
+
+        # the code can't be parsed, or it's not python
+        if docs is None:
+            docs = FileHandler.split_text(code, chunk_size, chunk_overlap, lang, encoding)
+
+        return docs or [Document(page_content=code)]
+
+    @staticmethod
+    def split_text(code: str, chunk_size: int, chunk_overlap: int, lang: Language,
+                   encoding: tiktoken.Encoding = None) -> List[Document]:
+        """
+            This function splits the code with the recursive text splitter of the given language.
+            Code in languages without a splitter (or unknown) is split as plain text.
+
+            Args:
+            ----------
+            code: str
+                The code to split.
+            chunk_size: int
+                The size of the chunks to create.
+            chunk_overlap: int
+                The overlap between chunks.
+            lang: Language
+                The language of the code.
+            encoding: tiktoken.Encoding
+                The encoding used to measure the chunks in tokens, if any.
+
+            Returns:
+            ----------
+            List[Document]
+                The list of documents created from the splitting.
+        """
+        if lang is None:
+            splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                                                      length_function=FileHandler.length_function(encoding))
+        else:
+            splitter = FileHandler.get_splitter(lang, chunk_size, chunk_overlap, encoding)
+        return splitter.create_documents([code])
+
+    @staticmethod
+    def chunk_python_document(code: str, chunk_size: int, encoding: tiktoken.Encoding = None) -> List[Document]:
+        """
+            This function chunks python code at the boundaries of its top level statements (classes, functions,
+            imports...), packing as many whole statements as fit into each chunk, the comments before a statement
+            go with it. Classes that don't fit in a chunk are chunked at the boundaries of their methods.
+            When the code needs more than one chunk, every chunk starts with a compact skeleton of the file
+            (its imports and the signatures of its classes and functions) so each chunk keeps the context of
+            the whole file. A single statement bigger than a chunk is split with the text splitter.
+            If the code can't be parsed it returns None.
+
+            Args:
+            ----------
+            code: str
+                The python code to chunk.
+            chunk_size: int
+                The size of the chunks to create.
+            encoding: tiktoken.Encoding
+                The encoding used to measure the chunks in tokens, if any.
+
+            Returns:
+            ----------
+            List[Document]
+                The list of documents created from the chunking, with the first and last line of each chunk as metadata.
+        """
+        try:
+            tree = ast.parse(code)
+        except (SyntaxError, ValueError):
+            return None
+
+        length_function = FileHandler.length_function(encoding)
+        if length_function(code) <= chunk_size or not tree.body:
+            return [Document(page_content=code, metadata={"start_line": 1, "end_line": code.count("\n") + 1})]
+
+        lines = code.splitlines(keepends=True)
+
+        header = FileHandler.python_skeleton(tree, lines, chunk_size // 4, length_function)
+        budget = chunk_size - length_function(header)
+
+        # every segment is a top level statement with the comments and blank lines before it,
+        # the classes that don't fit in a chunk are segmented by the statements of their body
+        segments = []
+        start = 0
+        for node in tree.body:
+            text = "".join(lines[start:node.end_lineno])
+            if isinstance(node, ast.ClassDef) and length_function(text) > budget:
+                for child in node.body:
+                    segments.append((start + 1, child.end_lineno, "".join(lines[start:child.end_lineno])))
+                    start = child.end_lineno
+                continue
+            segments.append((start + 1, node.end_lineno, text))
+            start = node.end_lineno
+        if start < len(lines):
+            first_line, _, text = segments.pop()
+            segments.append((first_line, len(lines), text + "".join(lines[start:])))
+
+        docs = []
+        chunk = []
+
+        def flush():
+            if chunk:
+                docs.append(Document(page_content=header + "".join(text for _, _, text in chunk),
+                                     metadata={"start_line": chunk[0][0], "end_line": chunk[-1][1]}))
+                chunk.clear()
+
+        chunk_length = 0
+        for first_line, last_line, text in segments:
+            length = length_function(text)
+            if length > budget:
+                flush()
+                chunk_length = 0
+                for doc in FileHandler.split_text(text, budget, 0, Language.PYTHON, encoding):
+                    docs.append(Document(page_content=header + doc.page_content,
+                                         metadata={"start_line": first_line, "end_line": last_line}))
+                continue
+
+            if chunk_length + length > budget:
+                flush()
+                chunk_length = 0
+            chunk.append((first_line, last_line, text))
+            chunk_length += length
+        flush()
+
+        return docs
+
+    @staticmethod
+    def python_skeleton(tree: ast.Module, lines: List[str], max_size: int, length_function) -> str:
+        """
+            This function builds the skeleton of a python file: its imports and the signatures of its
+            top level functions, classes and methods. If the skeleton is bigger than max_size only the
+            imports are kept, and if they don't fit either the skeleton is empty.
+
+            Args:
+            ----------
+            tree: ast.Module
+                The parsed code.
+            lines: List[str]
+                The lines of the code.
+            max_size: int
+                The maximum size of the skeleton.
+            length_function: Callable[[str], int]
+                The function measuring the size of the skeleton.
+
+            Returns:
+            ----------
+            str
+                The skeleton, as a header ready to be put before the code of a chunk.
+        """
+
+        def signature(node) -> str:
+            # the lines from the decorators until the body starts
+            first_line = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+            return "".join(lines[first_line - 1:max(node.body[0].lineno - 1, node.lineno)]).rstrip()
+
+        imports = []
+        signatures = []
+        for node in tree.body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                imports.append("".join(lines[node.lineno - 1:node.end_lineno]).rstrip())
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                signatures.append(signature(node))
+            elif isinstance(node, ast.ClassDef):
+                signatures.append(signature(node))
+                signatures.extend(signature(child) for child in node.body
+                                  if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)))
+
+        for parts in (imports + signatures, imports):
+            if not parts:
+                continue
+            header = "# skeleton of the whole file:\n" + "\n".join(parts) + "\n# code of this chunk:\n"
+            if length_function(header) <= max_size:
+                return header
+        return ""
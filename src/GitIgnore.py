@@ -0,0 +1,186 @@
+import re
+
+
+class GitIgnore:
+
+    """
+        This class is the compiled matcher of the patterns of a .gitignore file, following the rules of git:
+        a pattern without a slash matches a name at any depth below the folder of the file, a pattern with a
+        slash is anchored to that folder, a trailing slash only matches directories, '!' negates a pattern
+        and the last pattern that matches a path decides whether it is ignored.
+
+        All the patterns are also compiled together into a single regex, so the paths that don't match
+        any pattern (most of them) are discarded with one search.
+
+        Attributes:
+            base: The folder of the .gitignore file, relative to the project root ('' for the root).
+            rules: The compiled patterns, as (regex, negated, directories only) tuples, in file order.
+            any_rule: The regex matching a path when any of the patterns matches it.
+
+        Methods:
+            from_file: Reads and compiles a .gitignore file.
+            compile_pattern: Translates a gitignore pattern into a regex.
+            match: Returns whether a path is ignored, not ignored, or not matched by any pattern.
+            is_ignored: Returns whether a path is ignored by a stack of .gitignore files.
+    """
+
+    def __init__(self, lines: list[str], base: str = "") -> None:
+        self.base : str = base
+        self.rules : list[tuple] = []
+
+        for line in lines:
+            line = line.rstrip("\n")
+            # trailing spaces are ignored unless escaped
+            line = re.sub(r"(?<!\\) +$", "", line)
+            if not line or line.startswith("#"):
+                continue
+
+            negated = line.startswith("!")
+            if negated:
+                line = line[1:]
+            elif line.startswith("\\"):
+                line = line[1:]
+
+            directories_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            self.rules.append((re.compile(self.compile_pattern(line)), negated, directories_only))
+
+        self.any_rule = re.compile("|".join(f"(?:{rule.pattern})" for rule, _, _ in self.rules)) if self.rules else None
+
+    @classmethod
+    def from_file(cls, gitignore_path: str, base: str = "") -> "GitIgnore":
+        """
+            Reads and compiles a .gitignore file, if it can't be read returns None.
+
+            Args:
+            ----------
+            gitignore_path: str
+                The path of the .gitignore file.
+            base: str
+                The folder of the .gitignore file, relative to the project root.
+
+            Returns:
+            ----------
+            GitIgnore
+                The matcher of the file, or None.
+        """
+        try:
+            with open(gitignore_path, "r", errors="replace") as f:
+                return cls(f.readlines(), base)
+        except OSError:
+            return None
+
+    @staticmethod
+    def compile_pattern(pattern: str) -> str:
+        """
+            Translates a gitignore pattern into a regex matching the paths relative to the folder of the
+            .gitignore file. A pattern without a slash (other than a trailing one) can match at any depth.
+
+            Args:
+            ----------
+            pattern: str
+                The gitignore pattern, without the '!' and the trailing slash.
+
+            Returns:
+            ----------
+            str
+                The regex.
+        """
+        if "/" not in pattern:
+            pattern = "**/" + pattern
+        pattern = pattern.lstrip("/")
+
+        regex = ""
+        i = 0
+        while i < len(pattern):
+            char = pattern[i]
+            if pattern.startswith("**/", i):
+                regex += "(?:.*/)?"
+                i += 3
+            elif pattern.startswith("/**", i) and i + 3 == len(pattern):
+                regex += "/.*"
+                i += 3
+            elif pattern.startswith("**", i):
+                regex += ".*"
+                i += 2
+            elif char == "*":
+                regex += "[^/]*"
+                i += 1
+            elif char == "?":
+                regex += "[^/]"
+                i += 1
+            elif char == "[" and "]" in pattern[i + 2:]:
+                end = pattern.index("]", i + 2)
+                char_class = pattern[i + 1:end].replace("\\", "\\\\")
+                if char_class.startswith("!"):
+                    char_class = "^" + char_class[1:]
+                regex += "[" + char_class + "]"
+                i = end + 1
+            elif char == "\\" and i + 1 < len(pattern):
+                regex += re.escape(pattern[i + 1])
+                i += 2
+            else:
+                regex += re.escape(char)
+                i += 1
+        return f"^{regex}$"
+
+    def match(self, path: str, is_dir: bool) -> bool:
+        """
+            Returns True if the path is ignored by the patterns of the file, False if it is explicitly
+            not ignored (by a negated pattern), and None if no pattern matches it.
+
+            Args:
+            ----------
+            path: str
+                The path, relative to the project root.
+            is_dir: bool
+                Whether the path is a directory.
+
+            Returns:
+            ----------
+            bool
+                Whether the path is ignored, or None.
+        """
+        if self.any_rule is None:
+            return None
+        if self.base:
+            if not path.startswith(self.base + "/"):
+                return None
+            path = path[len(self.base) + 1:]
+        if not self.any_rule.search(path):
+            return None
+
+        for rule, negated, directories_only in reversed(self.rules):
+            if directories_only and not is_dir:
+                continue
+            if rule.match(path):
+                return not negated
+        return None
+
+    @staticmethod
+    def is_ignored(gitignores: list, path: str, is_dir: bool) -> bool:
+        """
+            Returns whether a path is ignored by a stack of .gitignore files, from the root to the deepest
+            folder. The deepest file with a pattern matching the path decides.
+
+            Args:
+            ----------
+            gitignores: list
+                The matchers of the .gitignore files that apply to the path.
+            path: str
+                The path, relative to the project root, with '/' separators.
+            is_dir: bool
+                Whether the path is a directory.
+
+            Returns:
+            ----------
+            bool
+                Whether the path is ignored.
+        """
+        for gitignore in reversed(gitignores):
+            ignored = gitignore.match(path, is_dir)
+            if ignored is not None:
+                return ignored
+        return False
@@ -1,27 +1,226 @@
-import json
 import os
+import time
+import threading
+import openai
+import requests
+from typing import Any, Callable
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from langchain.llms.openai import OpenAI
 from langchain import PromptTemplate, LLMChain
 from langchain.chains import ConversationChain
 from langchain.memory import ConversationKGMemory
 from langchain.callbacks.manager import CallbackManager
-from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
 
 from FileHandler import FileHandler
 from prompt_handler import PromptHandler
+from ResponseCache import ResponseCache
+from ResponseValidator import ResponseValidator
+from LlamaCppServer import LlamaCppServer
+from LlamaCppModel import LlamaCppModel
+from MetricsHandler import MetricsHandler
+from Profiler import profiler
 
 # some important enviroment variables
 load_dotenv()
 PROJECTS_PATH = os.getenv("PROJECTS_PATH")
 OPEN_AI_API_KEY = os.getenv("OPEN_AI_API_KEY")
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE")
+MODEL_PATH = os.getenv("MODEL_PATH")
+LLAMACPP_N_CTX = int(os.getenv("LLAMACPP_N_CTX", 4096))
+LLAMACPP_N_THREADS = int(os.getenv("LLAMACPP_N_THREADS", 0)) or None
+LLAMACPP_N_SEQ = int(os.getenv("LLAMACPP_N_SEQ", 4))
 OUTPUTS_PATH = os.getenv("OUTPUTS_PATH")
 DEFAULT_LLM = os.getenv("DEFAULT_LLM")
+REQUESTS_PER_MINUTE = int(os.getenv("REQUESTS_PER_MINUTE", 3500))
+TOKENS_PER_MINUTE = int(os.getenv("TOKENS_PER_MINUTE", 90000))
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+LLAMACPP_SERVER_URL = os.getenv("LLAMACPP_SERVER_URL", "http://localhost:8080")
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "false").lower() == "true"
+GRAMMAR_PATH = os.getenv("GRAMMAR_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "config", "json.gbnf"))
 
 import warnings
 warnings.filterwarnings("ignore")
 
 
+class RequestScheduler:
+
+    """
+        This class meters every request sent to the model against a requests per minute
+        and a tokens per minute budget, so concurrent callers can use the whole quota
+        without being rejected by the API.
+
+        Both budgets are token buckets that refill continuously and only hold a few seconds
+        worth of budget, so requests are spread along the minute instead of being sent in bursts.
+        When the API still answers with a rate limit error, every caller waits for the
+        'retry-after' time given by the API before sending new requests.
+
+        Attributes:
+            requests_per_minute: The requests per minute budget.
+            tokens_per_minute: The tokens per minute budget.
+            burst_seconds: How many seconds worth of budget the buckets can hold.
+            max_retries: How many times a failed request is retried.
+            on_retry: Called every time a request is retried, if given.
+            buckets: The available requests and tokens, and the time they were last refilled.
+            paused_until: The time until which no request can be sent after a rate limit error.
+            lock: The lock guarding the buckets.
+
+        Methods:
+            acquire: Blocks until a request with the given tokens fits in the budgets.
+            run: Runs a request through the budgets, retrying it on rate limit and transient errors.
+            retry_after: Returns how long to wait before retrying a failed request.
+    """
+
+    retryable_errors = (
+        openai.error.RateLimitError,
+        openai.error.ServiceUnavailableError,
+        openai.error.APIConnectionError,
+        openai.error.Timeout,
+        openai.error.APIError,
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+    )
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int,
+                 burst_seconds: float = 10, max_retries: int = 6, on_retry: Callable[[], None] = None) -> None:
+        self.requests_per_minute : int = requests_per_minute
+        self.tokens_per_minute : int = tokens_per_minute
+        self.burst_seconds : float = burst_seconds
+        self.max_retries : int = max_retries
+        self.on_retry : Callable[[], None] = on_retry
+        self.buckets : dict[str, float] = {
+            "requests": self.capacity(requests_per_minute),
+            "tokens": self.capacity(tokens_per_minute),
+            "refilled_at": time.monotonic(),
+        }
+        self.paused_until : float = 0
+        self.lock : threading.Lock = threading.Lock()
+
+    def capacity(self, budget_per_minute: int) -> float:
+        """
+            Returns the capacity of the bucket for the given budget, this is the
+            budget for burst_seconds, but always at least one request.
+
+            Args:
+            ----------
+            budget_per_minute: int
+                The budget per minute.
+
+            Returns:
+            ----------
+            float
+                The capacity of the bucket.
+        """
+        return max(budget_per_minute * self.burst_seconds / 60, 1)
+
+    def acquire(self, tokens: int) -> None:
+        """
+            Blocks until a request with the given (estimated) number of tokens fits
+            in both budgets, then takes it from them.
+
+            Args:
+            ----------
+            tokens: int
+                The estimated prompt plus completion tokens of the request.
+
+            Returns:
+            ----------
+            None
+        """
+        # a request bigger than the bucket would never fit, so it just takes the whole bucket
+        tokens = min(tokens, self.capacity(self.tokens_per_minute))
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                elapsed = now - self.buckets["refilled_at"]
+                self.buckets["requests"] = min(self.buckets["requests"] + elapsed * self.requests_per_minute / 60,
+                                               self.capacity(self.requests_per_minute))
+                self.buckets["tokens"] = min(self.buckets["tokens"] + elapsed * self.tokens_per_minute / 60,
+                                             self.capacity(self.tokens_per_minute))
+                self.buckets["refilled_at"] = now
+
+                wait = max(self.paused_until - now,
+                           (1 - self.buckets["requests"]) * 60 / self.requests_per_minute,
+                           (tokens - self.buckets["tokens"]) * 60 / self.tokens_per_minute)
+                if wait <= 0:
+                    self.buckets["requests"] -= 1
+                    self.buckets["tokens"] -= tokens
+                    return
+
+            time.sleep(wait)
+
+    def run(self, request: Callable[[], Any], tokens: int) -> Any:
+        """
+            Runs the request once it fits in the budgets. If the request fails because of a
+            rate limit or a transient error it is retried, rate limit errors also pause
+            every other request for the time asked by the API.
+
+            Args:
+            ----------
+            request: Callable[[], Any]
+                The request to run, for example running a chain over an input.
+            tokens: int
+                The estimated prompt plus completion tokens of the request.
+
+            Returns:
+            ----------
+            Any
+                The output of the request.
+        """
+        for attempt in range(self.max_retries + 1):
+            with profiler.span("rate limit wait", "wait"):
+                self.acquire(tokens)
+            try:
+                with profiler.span("request", "network", attempt=attempt):
+                    return request()
+            except self.retryable_errors as error:
+                if attempt == self.max_retries:
+                    raise
+                if self.on_retry is not None:
+                    self.on_retry()
+
+                wait = self.retry_after(error, attempt)
+                if isinstance(error, openai.error.RateLimitError):
+                    with self.lock:
+                        self.paused_until = max(self.paused_until, time.monotonic() + wait)
+                else:
+                    with profiler.span("retry backoff", "wait"):
+                        time.sleep(wait)
+
+    @staticmethod
+    def retry_after(error: openai.error.OpenAIError, attempt: int) -> float:
+        """
+            Returns how long to wait before retrying a failed request, this is the
+            'retry-after' header of the response if the API sent one, otherwise an
+            exponential backoff.
+
+            Args:
+            ----------
+            error: openai.error.OpenAIError
+                The error of the failed request.
+            attempt: int
+                The number of the failed attempt, starting at 0.
+
+            Returns:
+            ----------
+            float
+                The seconds to wait.
+        """
+        headers = error.headers or {}
+        for header in ("retry-after-ms", "retry-after"):
+            value = headers.get(header)
+            if value is None:
+                continue
+            try:
+                seconds = float(value)
+            except ValueError:
+                continue
+            return seconds / 1000 if header == "retry-after-ms" else seconds
+
+        return min(2 ** attempt, 60)
+
+
 class LLM:
 
     """
@@ -38,15 +237,36 @@ class LLM:
         Attributes:
             model: The langchain model used to generate the explainations.
             llm_chain: The langchain chain used to generate the explainations.
+            models: The registry of the langchain models already built, by (model name, json output).
+            chains: The registry of the langchain chains already built, by (template, model name).
             context_window_size: The size of the context window used to generate the explainations.
             options: The options used to initialize the langchain model.
             prompt_handler: The prompt handler used to generate the prompts for the langchain model.
             file_handler: The file handler used to handle the files in the project.
+            cache: The on-disk cache of the analyses already generated for the files.
+            scheduler: The scheduler every request to the model goes through.
+            backend: The backend of the model, one of 'backends'.
+            pool_size: The maximum number of requests of a batch sent concurrently by backends that don't batch them.
+            structured_output: Whether the templates asking for json constrain the output of the model to json,
+                               with the GBNF grammar for llama.cpp or with the json mode for OpenAI.
+            grammar: The GBNF grammar used to constrain the output of llama.cpp to json.
+
+        Class Attributes:
+            backends: The supported backends: 'openai', 'llamacpp-server' (a llama.cpp server)
+                      and 'llamacpp' (a local GGUF model run in process, for offline use).
+            llamacpp_backends: The llama.cpp backends, they take the GBNF grammar and get all the chunks of a file
+                               in a single call: the server decodes them in parallel in its slots, the in-process
+                               model decodes them together as sequences of its context.
         
         Methods:
             load_model: Loads the langchain model.
+            build_model: Builds the langchain model for the backend.
             load_chain: Loads the langchain chain.
+            run_chain: Runs a chain through the request scheduler.
+            run_batch: Runs a chain over several inputs through the request scheduler.
             generate_response: Generates an explaination for a file.
+            merge_responses: Merges the responses of the chunks of a file.
+            group_responses: Packs responses in groups that fit in a number of tokens.
             generate_explaination_for_directory: Generates an explaination for a directory.
             generate_cohesion_coupling_analysis: Generates a cohesion and coupling analysis for a project.
             set_context_window_size: Sets the context window size for the langchain model.
@@ -54,19 +274,48 @@ class LLM:
     """
 
     projects_path = ''
+    backends = ("openai", "llamacpp-server", "llamacpp")
+    llamacpp_backends = ("llamacpp-server", "llamacpp")
+
+    def __init__(self, projects_path: str, options: dict, pool_size: int = 10,
+                 backend: str = "openai", structured_output: bool = False) -> None:
+        if backend not in LLM.backends:
+            raise ValueError(f"Unknown backend '{backend}', the supported backends are {LLM.backends}")
 
-    def __init__(self, projects_path: str, options: dict) -> None:
         self.model : OpenAI = None
         self.llm_chain : LLMChain = None
+        self.backend : str = backend
+        self.pool_size : int = pool_size
+        self.structured_output : bool = structured_output
+        self.grammar : str = None
+        self.models : dict[tuple[str, bool], OpenAI] = {}
+        self.chains : dict[tuple[int, str], LLMChain] = {}
+        self.registry_lock : threading.RLock = threading.RLock()
         self.context_window_size : int = None
-        self.options : dict = options
+        # copied, so the callbacks and model changes of this LLM don't leak into the options of the caller
+        self.options : dict = dict(options)
         self.prompt_handler : PromptHandler = PromptHandler(model_name=self.options["model_name"])
+        self.metrics : MetricsHandler = MetricsHandler(self.prompt_handler.get_prompt_token_lenght)
+        # every model reports its calls to the metrics, on top of the callbacks given by the caller
+        callback_manager = self.options.get("callback_manager")
+        self.options["callback_manager"] = CallbackManager(
+            (list(callback_manager.handlers) if callback_manager is not None else []) + [self.metrics],
+            inheritable_handlers=list(callback_manager.inheritable_handlers) if callback_manager is not None else None,
+        )
         
         self.prompt_handler.set_projects_path(projects_path)
         self.set_projects_path(projects_path)
+        self.set_http_session(pool_size)
+
+        if self.backend in LLM.llamacpp_backends and self.structured_output:
+            with open(GRAMMAR_PATH, "r") as f:
+                self.grammar = f.read()
 
         self.load_model()
         self.file_handler : FileHandler = FileHandler()
+        self.cache : ResponseCache = ResponseCache()
+        self.scheduler : RequestScheduler = RequestScheduler(REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE,
+                                                             on_retry=lambda: self.metrics.record_event("retry"))
 
     @staticmethod
     def set_projects_path(projects_path: str) -> None:
@@ -75,6 +324,29 @@ class LLM:
         """
         LLM.projects_path = projects_path
 
+    @staticmethod
+    def set_http_session(pool_size: int) -> None:
+        """
+            Sets a single keep-alive HTTP session for all the requests to the OpenAI API,
+            so TCP/TLS connections are reused across calls and threads instead of being
+            reopened by every thread.
+
+            Args:
+            ----------
+            pool_size: int
+                The maximum number of connections kept open, this should be at least
+                the number of requests in flight.
+
+            Returns:
+            ----------
+            None
+        """
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        openai.requestssession = session
+
     def set_context_window_size(self, context_window_size: int) -> None:
         """
             Sets the context window size for the langchain model.
@@ -90,56 +362,197 @@ class LLM:
         """
         self.context_window_size = context_window_size
 
-    def load_model(self) -> None:
+    def load_model(self, json_output: bool = False) -> OpenAI:
         """
-            Loads the OpenAI langchain model.
+            Loads the langchain model for the current model name, models are built
+            once per (model name, json output) and then reused from the registry.
+            The model is also returned, since the shared model attribute may be
+            swapped by a concurrent call as soon as the registry lock is released.
             
             Args:
             ----------
-            None
+            json_output: bool
+                Whether the output of the model must be constrained to json.
 
             Returns:
             ----------
-            None
+            OpenAI | LlamaCppServer | LlamaCppModel
+                The loaded model.
         """
-        model = OpenAI(**self.options)
-        self.prompt_handler.set_model(model_name=self.options["model_name"])
-        self.model = model
+        model_name = self.options["model_name"]
+        json_output = json_output and self.structured_output
+        with self.registry_lock:
+            if (model_name, json_output) not in self.models:
+                self.models[(model_name, json_output)] = self.build_model(json_output)
+            if self.prompt_handler.model_name != model_name:
+                self.prompt_handler.set_model(model_name=model_name)
+            self.model = self.models[(model_name, json_output)]
+            return self.model
+
+    def build_model(self, json_output: bool) -> OpenAI:
+        """
+            Builds the langchain model for the backend. When the output must be json, llama.cpp
+            constrains the decoding to the GBNF grammar and OpenAI uses its json mode.
+            The local GGUF model is loaded only once and shared by all the models of the 'llamacpp' backend.
 
-    def load_chain(self, template: dict[str, any], requires_memory: bool = False) -> None:
+            Args:
+            ----------
+            json_output: bool
+                Whether the output of the model must be constrained to json.
+
+            Returns:
+            ----------
+            OpenAI | LlamaCppServer | LlamaCppModel
+                The langchain model.
         """
-            Loads the langchain chain.
+        if self.backend == "llamacpp":
+            return LlamaCppModel(
+                model_path=MODEL_PATH,
+                grammar=self.grammar if json_output else None,
+                temperature=self.options["temperature"],
+                max_tokens=self.options["max_tokens"],
+                n_ctx=LLAMACPP_N_CTX,
+                n_threads=LLAMACPP_N_THREADS,
+                n_seq=LLAMACPP_N_SEQ,
+                callback_manager=self.options["callback_manager"],
+            )
+
+        if self.backend == "llamacpp-server":
+            return LlamaCppServer(
+                server_url=LLAMACPP_SERVER_URL,
+                grammar=self.grammar if json_output else None,
+                temperature=self.options["temperature"],
+                max_tokens=self.options["max_tokens"],
+                session=openai.requestssession,
+                callback_manager=self.options["callback_manager"],
+            )
+
+        options = dict(self.options)
+        if json_output:
+            options["model_kwargs"] = {**options.get("model_kwargs", {}), "response_format": {"type": "json_object"}}
+        return OpenAI(**options)
+
+    def load_chain(self, template: int, requires_memory: bool = False) -> LLMChain:
+        """
+            Loads the langchain chain, chains are built once per (template, model name)
+            and then reused from the registry. The chain is also returned so callers running
+            concurrently don't depend on the shared llm_chain attribute.
 
             Args:
             ----------
-            template: dict[str, any]
-                The template to use for the langchain chain.
+            template: int
+                The number of the template to use for the langchain chain.
             requires_memory: bool
                 Whether the langchain chain requires memory or not.
             
             Returns:
             ----------
-            None
-            
+            LLMChain
+                The loaded chain.
         """
-        
-        self.load_model()
-        prompt: PromptTemplate = PromptTemplate(
-            input_variables=template["input_variables"],
-            template=template["template"]
-        )
 
-        llm_chain: LLMChain = LLMChain(
-            llm=self.model,
-            prompt=prompt,
-            verbose=self.options["verbose"]
-        )
+        raw_template = self.prompt_handler.get_raw_template(template=template)
+        with self.registry_lock:
+            # the chain is built with the model loaded for it, in the same critical section,
+            # a concurrent call of another template could load the model without the grammar meanwhile
+            model = self.load_model(json_output=raw_template["json_output"])
+            key = (template, self.options["model_name"])
+            if key not in self.chains:
+                prompt: PromptTemplate = PromptTemplate(
+                    input_variables=raw_template["input_variables"],
+                    template=raw_template["template"]
+                )
+
+                self.chains[key] = LLMChain(
+                    llm=model,
+                    prompt=prompt,
+                    verbose=self.options["verbose"]
+                )
+
+            llm_chain: LLMChain = self.chains[key]
 
         self.llm_chain = llm_chain
+        return llm_chain
+
+    def run_chain(self, llm_chain: LLMChain, template: int, text: str, **inputs) -> str:
+        """
+            Runs the chain through the request scheduler, the tokens of the request are estimated
+            as the tokens of the template, plus the tokens of the inputs, plus the max tokens of the completion.
+
+            Args:
+            ----------
+            llm_chain: LLMChain
+                The chain to run.
+            template: int
+                The number of the template the chain was loaded with.
+            text: str
+                The main input of the chain, this is the first input variable of the template.
+            **inputs:
+                The other input variables of the template, if any.
+
+            Returns:
+            ----------
+            str
+                The output of the chain.
+        """
+        tokens = (self.prompt_handler.get_raw_template(template=template)["prompt_token_lenght"]
+                  + sum(self.prompt_handler.get_prompt_token_lenght(str(value)) for value in (text, *inputs.values()))
+                  + self.options["max_tokens"])
+        input_key = self.prompt_handler.get_raw_template(template=template)["input_variables"][0]
+        with profiler.span("llm call", "llm", template=template, tokens=tokens), \
+                self.metrics.scope(template=template, model=self.options["model_name"]):
+            return self.scheduler.run(lambda: llm_chain.run(**{input_key: text}, **inputs), tokens)
+
+    def run_batch(self, llm_chain: LLMChain, template: int, texts: list[str], **inputs) -> list[str]:
+        """
+            Runs the chain over several inputs through the request scheduler. The llama.cpp backends
+            get all the inputs in a single call: a llama.cpp server decodes them in parallel in its slots,
+            and the in-process model decodes them together with the prompts of the other files in flight.
+            The other backends run the inputs concurrently.
 
-    def generate_response(self, file_full_path: str, code: str) -> str:
+            Args:
+            ----------
+            llm_chain: LLMChain
+                The chain to run.
+            template: int
+                The number of the template the chain was loaded with.
+            texts: list[str]
+                The main inputs of the chain, one per request.
+            **inputs:
+                The other input variables of the template, shared by all the requests.
+
+            Returns:
+            ----------
+            list[str]
+                The outputs of the chain, in the same order as the inputs.
+        """
+        if self.backend not in LLM.llamacpp_backends:
+            # the worker threads make the calls in the metrics scope of the caller
+            scope = self.metrics.current_scope()
+
+            def run(text: str) -> str:
+                with self.metrics.scope(**scope):
+                    return self.run_chain(llm_chain, template, text, **inputs)
+
+            with ThreadPoolExecutor(max_workers=min(self.pool_size, len(texts)) or 1) as executor:
+                return list(executor.map(run, texts))
+
+        template_tokens = (self.prompt_handler.get_raw_template(template=template)["prompt_token_lenght"]
+                           + sum(self.prompt_handler.get_prompt_token_lenght(str(value)) for value in inputs.values()))
+        tokens = sum(template_tokens + self.prompt_handler.get_prompt_token_lenght(str(text)) + self.options["max_tokens"]
+                     for text in texts)
+        input_key = self.prompt_handler.get_raw_template(template=template)["input_variables"][0]
+
+        with profiler.span("llm call", "llm", template=template, tokens=tokens, batch=len(texts)), \
+                self.metrics.scope(template=template, model=self.options["model_name"]):
+            outputs = self.scheduler.run(lambda: llm_chain.apply([{input_key: text, **inputs} for text in texts]), tokens)
+        return [output[llm_chain.output_key] for output in outputs]
+
+    def generate_response(self, file_full_path: str, code: str, dependencies: list = None) -> str:
         """
             Generates an explaination for a file.
+            If the same code was already analyzed with the same model and templates,
+            the analysis is taken from the cache instead.
 
             Args:
             ----------
@@ -147,6 +560,10 @@ class LLM:
                 The full path to the file.
             code: str
                 The code to generate the explaination for.
+            dependencies: list
+                The dependencies of the file if they were found statically, they are used to choose the
+                tree context of the file. When they are not given, the dependencies given by the model
+                must be checked with the template 4.
             
             Returns:
             ----------
@@ -154,84 +571,190 @@ class LLM:
                 The explaination for the file.
         """
 
-        # estimate the number of tokens for the code
-        code_token_size = (self.context_window_size - self.prompt_handler.longest_prompt_lenght)
-
-        # chunk the document based on the estimated number of tokens available for the code
-        docs = self.file_handler.chunk_document(file_full_path, code, code_token_size)
+        check_dependencies = dependencies is None
+
+        # the file analysis ends with the template 4 check when the dependencies are checked,
+        # so that is the template of the cached response, otherwise it ends with the template 0.
+        # The tree context only matters for the dependencies given by the model, the static ones don't
+        # depend on it, and as it lists the whole root folder it changes with every new file of the project,
+        # so the key only includes the listing of the folder of the file when the model gives the dependencies
+        context = self.prompt_handler.get_folder_listing(file_full_path) if check_dependencies else ""
+        cache_key = self.prompt_handler.get_cache_key(code, template=4 if check_dependencies else 0, context=context)
+        cached_response = self.cache.get(cache_key)
+        self.metrics.record_event("cache_miss" if cached_response is None else "cache_hit")
+        if cached_response is not None:
+            return cached_response
+
+        with profiler.span("tree context", "tokenization"):
+            # only the part of the project tree relevant to the file is sent as context
+            tree = self.prompt_handler.get_tree_context(file_full_path, dependencies)
+
+        with profiler.span("prepare prompt", "tokenization"):
+            # estimate the number of tokens for the code, the completion also takes max_tokens of the context window
+            code_token_size = int(self.context_window_size - self.prompt_handler.longest_prompt_lenght
+                                  - self.prompt_handler.tree_context_max_tokens - self.options["max_tokens"])
+
+            # chunk the document based on the estimated number of tokens available for the code
+            docs = self.file_handler.chunk_document(file_full_path, code, code_token_size,
+                                                    encoding=self.prompt_handler.encoding)
 
         # define the response
         response = None
 
         # if the document is too small, just run it
         if len(docs) == 1:
-            template = self.prompt_handler.get_raw_template(template=0)
-            self.load_chain(template=template)
-            response = self.llm_chain.run(docs[0].page_content)
+            llm_chain = self.load_chain(template=0)
+            response = self.run_chain(llm_chain, 0, docs[0].page_content, tree=tree)
 
         # if the document is too big, chunk it and run it
         elif len(docs) > 1:
-            template = self.prompt_handler.get_raw_template(template=1)
-            self.load_chain(template=template, requires_memory=True)
+            llm_chain = self.load_chain(template=1, requires_memory=True)
 
-            responses = []
-
-            for doc in docs:
-                response = self.llm_chain.run(doc.page_content)
-                responses.append(response)
+            responses = self.run_batch(llm_chain, 1, [doc.page_content for doc in docs], tree=tree)
 
             # combine the responses and save them
-            template = self.prompt_handler.get_raw_template(template=2)
-            self.load_chain(template=template, requires_memory=True)
-
-            response = self.llm_chain.run(responses)
+            response = self.merge_responses(responses)
 
         # print(response)
-        
-        return self._check_response(response)
+
+        if check_dependencies:
+            response = self._check_response(response, tree=tree)
+        else:
+            response = ResponseValidator.check(response) or self._check_response(response, local=False, tree=tree)
+
+        self.cache.set(cache_key, response)
+        return response
     
-    def _check_response(self, response: str) -> str:
+    def merge_responses(self, responses: list[str]) -> str:
+        """
+            Merges the responses of the chunks of a file into a single response with the template 2.
+            The responses are merged as a tree: every round packs them in groups that fit the context
+            window and merges the groups in parallel, until a single response is left. So the merge
+            prompts are bounded in size and a file with n chunks takes O(log n) rounds.
+
+            Args:
+            ----------
+            responses: list[str]
+                The responses of the chunks of the file, in order.
+
+            Returns:
+            ----------
+            str
+                The merged response.
+        """
+        llm_chain = self.load_chain(template=2, requires_memory=True)
+
+        # the tokens of the context window left for the responses of a group
+        group_token_size = (self.context_window_size - self.prompt_handler.get_raw_template(template=2)["prompt_token_lenght"]
+                            - self.options["max_tokens"])
+
+        while len(responses) > 1:
+            groups = self.group_responses(responses, group_token_size)
+            merged = self.run_batch(llm_chain, 2, [str(group) for group in groups if len(group) > 1])
+
+            # a group with a single response goes to the next round as it is
+            merged = iter(merged)
+            responses = [next(merged) if len(group) > 1 else group[0] for group in groups]
+
+        return responses[0]
+
+    def group_responses(self, responses: list[str], group_token_size: int) -> list[list[str]]:
+        """
+            Packs consecutive responses in groups that fit in the given number of tokens. A group always
+            takes at least two responses, so every round of the merge reduces the number of responses.
+
+            Args:
+            ----------
+            responses: list[str]
+                The responses to group.
+            group_token_size: int
+                The maximum number of tokens of the responses of a group.
+
+            Returns:
+            ----------
+            list[list[str]]
+                The groups of responses, in order.
+        """
+        groups = []
+        group = []
+        group_tokens = 0
+        for response in responses:
+            # the responses are sent as a python list, count a few tokens for the quotes and separators
+            tokens = self.prompt_handler.get_prompt_token_lenght(response) + 4
+            if len(group) > 1 and group_tokens + tokens > group_token_size:
+                groups.append(group)
+                group = []
+                group_tokens = 0
+            group.append(response)
+            group_tokens += tokens
+        if group:
+            groups.append(group)
+        return groups
+
+    def _check_response(self, response: str, local: bool = True, tree: str = None) -> dict:
 
         """
             Checks the response of the langchain model.
+            The response is validated and repaired locally first, only if that fails it is sent to the
+            model to be fixed with the template 4. If the model can't fix it either, the raw response
+            is kept as the explanation so the run can go on.
 
             Args:
             ----------
             response: str
                 The response to check.
+            local: bool
+                Whether to try to validate and repair the response locally before asking the model.
+            tree: str
+                The tree context of the file, by default the whole project tree.
             
             Returns:
             ----------
-            str
+            dict
                 The checked response.
         """
 
-        template = self.prompt_handler.get_raw_template(template=4)
-        self.load_chain(template=template)
-        response = self.llm_chain.run(response)
+        if local:
+            response_json = ResponseValidator.check(response)
+            if response_json is not None:
+                return response_json
+
+        llm_chain = self.load_chain(template=4)
+        if tree is None:
+            tree = self.prompt_handler.initial_files_report
+        checked_response = self.run_chain(llm_chain, 4, response, tree=tree)
 
-        response_json = json.loads(response)
+        response_json = ResponseValidator.check(checked_response)
+        if response_json is None:
+            print("WARNING: the response of the model is not a valid json, keeping it as the explanation")
+            response_json = {"dependencies": [], "explanation": response.strip()}
         return response_json
 
 
-    def generate_explaination_for_directory(self, directory_contents: str) -> str:
+    def generate_explaination_for_directory(self, directory_contents: list) -> str:
         """
             Generates an explaination for a directory.
             It is used to generate explainations for the folders in the project.
+            Only the names and the explanations of the contents are sent, truncated to fit
+            the directory context budget and the context window.
 
             Args:
             ----------
-            directory_contents: str
-                The contents of the directory.
+            directory_contents: list
+                The files and subdirectories of the directory, as dicts with 'name', 'type' and 'explanation'.
             
             Returns:
             ----------
             str
                 The explaination for the directory.
         """
-        template = self.prompt_handler.get_raw_template(template=5)
-        self.load_chain(template=template)
-        response = self.llm_chain.run(directory_contents)
+        max_tokens = min(self.prompt_handler.directory_context_max_tokens,
+                         self.context_window_size - self.prompt_handler.get_raw_template(template=5)["prompt_token_lenght"]
+                         - self.options["max_tokens"])
+        directory_json = self.prompt_handler.compact_directory(directory_contents, max_tokens)
+
+        llm_chain = self.load_chain(template=5)
+        response = self.run_chain(llm_chain, 5, directory_json)
 
         # print(response)
         return response
@@ -254,43 +777,38 @@ class LLM:
                 The cohesion and coupling analysis for the project.
         """
 
-        template = self.prompt_handler.get_raw_template(template=3)
-        prompt = self.prompt_handler.get_prompt(template=3, json_reports=json_report)
-        prompt_len = self.prompt_handler.get_prompt_token_lenght(prompt)
-
-        # if the prompt is really big (bigger than the context window size) then load 
-        # the gpt which has a bigger context window size
+        model_name = self.options["model_name"]
+        context_window_size = self.context_window_size
+        report_text = str(json_report)
 
-        if prompt_len > self.context_window_size:
-            # print("prompt is too big, loading gpt-3.5-turbo-16k")
+        if self.backend == "openai":
+            # the whole report is sent, so the model with the biggest context window is loaded
             self.options["model_name"] = "gpt-3.5-turbo-16k"
             self.load_model()
             self.set_context_window_size(16e3)
-
-            self.load_chain(template=template)
-            response = self.llm_chain.run(prompt)
-        
         else:
-            # print("prompt is not too big, loading gpt-3.5-turbo-16k")
-            self.options["model_name"] = "gpt-3.5-turbo-16k"
-            self.load_model()
-            self.set_context_window_size(16e3)
+            # the local models keep the context window they are loaded with, the report is cut to fit in it
+            report_budget = int(self.context_window_size - self.options["max_tokens"]
+                                - self.prompt_handler.get_raw_template(template=3)["prompt_token_lenght"])
+            report_text = self.prompt_handler.truncate(report_text, report_budget)
 
-            self.load_chain(template=template)
-            response = self.llm_chain.run(prompt)
-        
-        #before returning the response, go back to the original cheaper model
-        self.options["model_name"] = "gpt-3.5-turbo-16k"
-        self.set_context_window_size(16e3)
+        self.load_chain(template=3)
+        response = self.run_chain(self.llm_chain, 3, report_text)
 
+        # before returning the response, go back to the original model
+        self.options["model_name"] = model_name
+        self.set_context_window_size(context_window_size)
         self.load_model()
 
-        response_json = json.loads(response)
+        response_json = ResponseValidator.parse(response)
+        if not isinstance(response_json, dict):
+            print("WARNING: the cohesion and coupling analysis is not a valid json, keeping it as the explanation")
+            response_json = {"coupling": "", "cohesion": "", "explanation": response.strip()}
         return response_json
         
 
 
-def default_llm(projects_path : str):
+def default_llm(projects_path : str, pool_size: int = 10):
     """
         Returns the default langchain model.
         It is used to generate explainations for the files in the project.
@@ -299,6 +817,8 @@ def default_llm(projects_path : str):
         ----------
         projects_path: str
             The path to the projects.
+        pool_size: int
+            The maximum number of HTTP connections kept open to the API.
         
         Returns:
         ----------
@@ -313,19 +833,32 @@ def default_llm(projects_path : str):
 
     model_name = DEFAULT_LLM
 
+    options = {
+        "openai_api_key": OPEN_AI_API_KEY,
+        "model_name": model_name,
+        "temperature": 0,
+        "max_tokens": max_tokens,
+        "presence_penalty": 2,
+        # retries are handled by the request scheduler, which also honours the 'retry-after' of rate limit errors
+        "max_retries": 0,
+        "verbose": False
+    }
+
+    # allows pointing the model to any OpenAI compatible server, like a local fake completion server
+    if OPENAI_API_BASE:
+        options["openai_api_base"] = OPENAI_API_BASE
+
     llm = LLM(
         projects_path=projects_path,
-        options={
-            "openai_api_key": OPEN_AI_API_KEY,
-            "model_name": model_name,
-            "temperature": 0,
-            "max_tokens": max_tokens,
-            "presence_penalty": 2,
-            "callback_manager": CallbackManager([StreamingStdOutCallbackHandler()]),
-            "verbose": False
-        },
-
+        options=options,
+        pool_size=pool_size,
+        backend=LLM_BACKEND,
+        structured_output=STRUCTURED_OUTPUT,
     )
 
+    # the llama.cpp models are limited by the context size they are loaded with
+    if LLM_BACKEND in LLM.llamacpp_backends:
+        context_window_size = LLAMACPP_N_CTX
+
     llm.set_context_window_size(context_window_size)
     return llm
\ No newline at end of file
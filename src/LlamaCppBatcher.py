@@ -0,0 +1,316 @@
+import threading
+from typing import Any, List, Optional
+
+import numpy as np
+
+try:
+    import llama_cpp
+    from llama_cpp import LlamaGrammar
+    from llama_cpp._internals import _LlamaBatch, _LlamaTokenDataArray
+except ImportError:
+    llama_cpp = None
+    LlamaGrammar = None
+
+
+class LlamaCppBatcher:
+
+    """
+        This class decodes several prompts together with a llama.cpp model loaded in process. Every prompt is
+        a sequence of the same context, and each forward pass evaluates the next token of all the sequences in
+        flight, so reading the weights from memory, which bounds the speed of the decoding on the CPU, is shared
+        by all of them instead of being paid by every prompt.
+
+        The prompts are submitted from any thread and wait for their completion. A decoding thread admits them
+        as soon as there is a free sequence and room in the context for the prompt and its completion, and
+        releases them as soon as they finish, like the slots of a llama.cpp server (continuous batching), so the
+        prompts of the files analyzed concurrently are decoded together. The context is shared by the sequences:
+        a prompt that needs the whole context is decoded alone.
+        The prompt tokens of the new sequences are evaluated in the same forward passes as the next tokens of the
+        sequences already generating, up to n_batch tokens per pass.
+
+        Attributes:
+            model: The llama.cpp model, it must only be used by the batcher while it has sequences in flight.
+            lock: The lock serializing the use of the model, held during every forward pass.
+            n_seq: The maximum number of sequences decoded together.
+            n_ctx: The context size of the model, shared by the sequences.
+            n_batch: The maximum number of tokens evaluated in each forward pass.
+            waiting: The requests waiting for a sequence.
+            active: The requests being decoded, by sequence id.
+            reserved: The context reserved by the active requests, their prompt and maximum completion.
+            condition: The condition guarding the waiting and active requests, notified when one is submitted.
+            thread: The decoding thread, started with the first request.
+            batch: The llama.cpp batch of every forward pass.
+            candidates: The candidate tokens the grammars are applied to.
+            generator: The random generator of the sampling with temperature.
+
+        Methods:
+            submit: Decodes a prompt with the other prompts in flight and returns its completion.
+            run: The loop of the decoding thread.
+            admit: Gives a sequence to the waiting requests that fit in the context.
+            step: Runs a forward pass over the sequences in flight and samples their next tokens.
+            sample: Samples the next token of a sequence.
+            stop_index: Returns where the first stop string of a request starts in its completion.
+            finish: Releases the sequence of a request and returns it its completion or error.
+    """
+
+    def __init__(self, model: Any, lock: threading.Lock, n_seq: int, seed: int = 0) -> None:
+        if llama_cpp is None:
+            raise ImportError("The 'llamacpp' backend needs llama-cpp-python, install it with 'pip install llama-cpp-python'")
+
+        self.model : Any = model
+        self.lock : threading.Lock = lock
+        self.n_seq : int = n_seq
+        self.n_ctx : int = model.n_ctx()
+        self.n_batch : int = model.n_batch
+        self.waiting : list[dict] = []
+        self.active : dict[int, dict] = {}
+        self.reserved : int = 0
+        self.condition : threading.Condition = threading.Condition()
+        self.thread : threading.Thread = None
+        self.batch : Any = _LlamaBatch(n_tokens=self.n_batch, embd=0, n_seq_max=1, verbose=False)
+        self.candidates : Any = _LlamaTokenDataArray(n_vocab=model.n_vocab())
+        self.generator : np.random.Generator = np.random.default_rng(seed)
+
+    def submit(self, prompt: str, max_tokens: int, temperature: float = 0,
+               stop: Optional[List[str]] = None, grammar: Optional[str] = None) -> str:
+        """
+            Decodes a prompt with the other prompts in flight and returns its completion, it blocks until
+            the completion is done. It can be called from any thread.
+
+            Args:
+            ----------
+            prompt: str
+                The prompt to complete.
+            max_tokens: int
+                The maximum number of tokens to generate.
+            temperature: float
+                The sampling temperature, 0 takes the most likely token.
+            stop: List[str]
+                The strings that stop the generation, if any.
+            grammar: str
+                The GBNF grammar the completion must follow, if any.
+
+            Returns:
+            ----------
+            str
+                The completion.
+        """
+        tokens = self.model.tokenize(prompt.encode("utf-8"), special=True)
+        if len(tokens) + max_tokens > self.n_ctx:
+            # like llama.cpp, the prompt and the completion must fit in the context
+            max_tokens = self.n_ctx - len(tokens)
+            if max_tokens <= 0:
+                raise ValueError(f"Requested tokens ({len(tokens)}) exceed context window of {self.n_ctx}")
+
+        request = {
+            "pending": tokens,
+            "position": 0,
+            "generated": [],
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stop": stop or [],
+            # every sequence needs its own grammar, as the grammar keeps the state of the parsing
+            "grammar": LlamaGrammar.from_string(grammar, verbose=False) if grammar is not None else None,
+            "size": len(tokens) + max_tokens,
+            "done": threading.Event(),
+        }
+        with self.condition:
+            self.waiting.append(request)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="llamacpp-batcher", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+        request["done"].wait()
+        if "error" in request:
+            raise request["error"]
+        return request["completion"]
+
+    def run(self) -> None:
+        """
+            The loop of the decoding thread: it waits for requests, admits them and decodes the sequences in flight.
+            If a forward pass fails, the requests in flight get the error and the context is cleared.
+
+            Args:
+            ----------
+            None
+
+            Returns:
+            ----------
+            None
+        """
+        while True:
+            with self.condition:
+                while not self.waiting and not self.active:
+                    self.condition.wait()
+                self.admit()
+            try:
+                self.step()
+            except Exception as error:
+                with self.lock:
+                    self.model._ctx.kv_cache_clear()
+                for request in list(self.active.values()):
+                    self.finish(request, error)
+
+    def admit(self) -> None:
+        """
+            Gives a sequence to the waiting requests, in the order they were submitted, while there are free
+            sequences and their prompt and completion fit in the context left. A request is always admitted when
+            there are no others in flight. The caller must hold the condition.
+
+            Args:
+            ----------
+            None
+
+            Returns:
+            ----------
+            None
+        """
+        while self.waiting and len(self.active) < self.n_seq:
+            request = self.waiting[0]
+            if self.active and self.reserved + request["size"] > self.n_ctx:
+                return
+            self.waiting.pop(0)
+            request["sequence"] = min(set(range(self.n_seq)) - set(self.active))
+            self.active[request["sequence"]] = request
+            self.reserved += request["size"]
+
+    def step(self) -> None:
+        """
+            Runs a forward pass over the sequences in flight: the last token sampled by every generating sequence
+            and as many prompt tokens of the new sequences as fit in the batch. Then the sequences whose tokens
+            were all evaluated sample their next token, and the finished ones are released.
+
+            Args:
+            ----------
+            None
+
+            Returns:
+            ----------
+            None
+        """
+        batch = self.batch.batch
+        outputs = []
+        n_tokens = 0
+        # the generating sequences go first, they only have one token pending
+        for request in sorted(self.active.values(), key=lambda request: len(request["pending"])):
+            tokens = request["pending"][:self.n_batch - n_tokens]
+            if not tokens:
+                continue
+            for token in tokens:
+                batch.token[n_tokens] = token
+                batch.pos[n_tokens] = request["position"]
+                batch.n_seq_id[n_tokens] = 1
+                batch.seq_id[n_tokens][0] = request["sequence"]
+                batch.logits[n_tokens] = False
+                request["position"] += 1
+                n_tokens += 1
+            request["pending"] = request["pending"][len(tokens):]
+            if not request["pending"]:
+                # only the last token of a sequence gives the logits of the next one
+                batch.logits[n_tokens - 1] = True
+                outputs.append((request, n_tokens - 1))
+            if n_tokens == self.n_batch:
+                break
+        batch.n_tokens = n_tokens
+
+        with self.lock:
+            # the batcher changes the context, the prompt llama-cpp-python keeps to reuse it is no longer there
+            self.model.reset()
+            self.model._ctx.decode(self.batch)
+            tokens = []
+            for request, index in outputs:
+                token = self.sample(request, index)
+                end = llama_cpp.llama_token_is_eog(self.model._model.model, token)
+                if not end and request["grammar"] is not None:
+                    self.model._ctx.grammar_accept_token(request["grammar"], token)
+                tokens.append((request, token, end))
+
+        for request, token, end in tokens:
+            if not end:
+                request["generated"].append(token)
+            if end or len(request["generated"]) >= request["max_tokens"] or self.stop_index(request) is not None:
+                self.finish(request)
+            else:
+                request["pending"] = [token]
+
+    def sample(self, request: dict, index: int) -> int:
+        """
+            Samples the next token of a sequence from the logits of its last token in the batch, constrained by
+            its grammar if it has one. The caller must hold the lock.
+
+            Args:
+            ----------
+            request: dict
+                The request of the sequence.
+            index: int
+                The index in the batch of the last token of the sequence.
+
+            Returns:
+            ----------
+            int
+                The token.
+        """
+        logits = np.ctypeslib.as_array(self.model._ctx.get_logits_ith(index), shape=(self.candidates.n_vocab,))
+        if request["grammar"] is not None:
+            self.candidates.copy_logits(logits)
+            self.model._ctx.sample_grammar(self.candidates, request["grammar"])
+            logits = self.candidates.candidates_data.logit
+        if request["temperature"] <= 0:
+            return int(np.argmax(logits))
+
+        probabilities = np.exp((logits - np.max(logits)) / request["temperature"])
+        return int(self.generator.choice(len(probabilities), p=probabilities / probabilities.sum()))
+
+    def stop_index(self, request: dict) -> Optional[int]:
+        """
+            Returns where the first stop string of a request starts in its completion, or None if there is none.
+
+            Args:
+            ----------
+            request: dict
+                The request.
+
+            Returns:
+            ----------
+            int
+                The index of the stop string in the completion, or None.
+        """
+        if not request["stop"]:
+            return None
+        text = self.model.detokenize(request["generated"]).decode("utf-8", errors="ignore")
+        indexes = [text.find(stop) for stop in request["stop"] if stop in text]
+        return min(indexes) if indexes else None
+
+    def finish(self, request: dict, error: Exception = None) -> None:
+        """
+            Releases the sequence of a request, removing its tokens from the context, and returns the request
+            its completion, cut at the first stop string, or the error that stopped it.
+
+            Args:
+            ----------
+            request: dict
+                The request.
+            error: Exception
+                The error that stopped the request, if any.
+
+            Returns:
+            ----------
+            None
+        """
+        if error is not None:
+            request["error"] = error
+        else:
+            completion = self.model.detokenize(request["generated"]).decode("utf-8", errors="ignore")
+            stop_index = self.stop_index(request)
+            request["completion"] = completion if stop_index is None else completion[:stop_index]
+            with self.lock:
+                self.model._ctx.kv_cache_seq_rm(request["sequence"], -1, -1)
+                # the tokens of a forward pass go to contiguous cells of the context, so the cells left free
+                # between the other sequences are compacted before the next forward pass
+                llama_cpp.llama_kv_cache_defrag(self.model._ctx.ctx)
+
+        with self.condition:
+            self.active.pop(request["sequence"], None)
+            self.reserved -= request["size"]
+        request["done"].set()
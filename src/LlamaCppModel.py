@@ -0,0 +1,167 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, ClassVar, List, Optional
+from langchain.llms.base import LLM as BaseLLM
+from langchain.callbacks.manager import CallbackManagerForLLMRun
+from langchain.schema.output import Generation, LLMResult
+from LlamaCppBatcher import LlamaCppBatcher
+
+try:
+    from llama_cpp import Llama, LlamaGrammar
+except ImportError:
+    Llama = None
+    LlamaGrammar = None
+
+
+class LlamaCppModel(BaseLLM):
+
+    """
+        This class is a langchain model for a local GGUF model run in process with llama.cpp on the CPU,
+        it doesn't need any network access.
+
+        Loading a model is expensive, so every model file is loaded once and kept resident in the class
+        attribute 'loaded_models', shared by all the instances using it (for example the instance that
+        constrains the output to the json grammar and the one that doesn't).
+        With n_seq above 1, the prompts are decoded together by a LlamaCppBatcher shared by the instances of the
+        model: the prompts of a batch and the ones sent concurrently by other threads (the files analyzed at the
+        same time) are sequences of the same context, and every forward pass generates the next token of all of them.
+        With n_seq at 1 the inference is serialized: the requests go one at a time through a lock, and a batch of
+        prompts is decoded back to back while holding it. All the instances of a model file must use the same n_seq.
+
+        Class Attributes:
+            loaded_models: The llama.cpp models already loaded, by (model path, context size).
+            batchers: The batchers decoding the prompts of the loaded models together, by (model path, context size).
+            lock: The lock serializing the requests to the models.
+
+        Attributes:
+            model_path: The path of the GGUF model file.
+            grammar: The GBNF grammar the completions must follow, if any.
+            temperature: The sampling temperature.
+            max_tokens: The maximum number of tokens to generate.
+            n_ctx: The context size of the model.
+            n_threads: The number of CPU threads used by llama.cpp, by default all of them.
+            n_batch: The number of prompt tokens evaluated in parallel in each forward pass.
+            n_seq: The maximum number of prompts decoded together, 1 decodes them one at a time.
+            compiled_grammar: The grammar compiled by llama.cpp, it is compiled the first time it is used.
+    """
+
+    loaded_models: ClassVar[dict] = {}
+    batchers: ClassVar[dict] = {}
+    lock: ClassVar[threading.Lock] = threading.Lock()
+
+    model_path: str
+    grammar: Optional[str] = None
+    temperature: float = 0
+    max_tokens: int = 256
+    n_ctx: int = 4096
+    n_threads: Optional[int] = None
+    n_batch: int = 512
+    n_seq: int = 1
+    compiled_grammar: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "llamacpp"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model_path": self.model_path, "grammar": self.grammar is not None,
+                "temperature": self.temperature, "max_tokens": self.max_tokens, "n_ctx": self.n_ctx,
+                "n_seq": self.n_seq}
+
+    @property
+    def client(self) -> Any:
+        """
+            Returns the llama.cpp model, loading it the first time it is used.
+            The caller must hold the lock.
+        """
+        if Llama is None:
+            raise ImportError("The 'llamacpp' backend needs llama-cpp-python, install it with 'pip install llama-cpp-python'")
+
+        key = (self.model_path, self.n_ctx)
+        if key not in LlamaCppModel.loaded_models:
+            LlamaCppModel.loaded_models[key] = Llama(model_path=self.model_path, n_ctx=self.n_ctx,
+                                                     n_threads=self.n_threads, n_batch=self.n_batch, verbose=False)
+        return LlamaCppModel.loaded_models[key]
+
+    @property
+    def batcher(self) -> LlamaCppBatcher:
+        """
+            Returns the batcher of the model, loading the model the first time it is used.
+        """
+        key = (self.model_path, self.n_ctx)
+        with LlamaCppModel.lock:
+            if key not in LlamaCppModel.batchers:
+                LlamaCppModel.batchers[key] = LlamaCppBatcher(self.client, LlamaCppModel.lock, self.n_seq)
+            return LlamaCppModel.batchers[key]
+
+    def complete(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+        """
+            Completes a prompt with the resident model. The caller must hold the lock.
+
+            Args:
+            ----------
+            prompt: str
+                The prompt to complete.
+            stop: List[str]
+                The strings that stop the generation, if any.
+
+            Returns:
+            ----------
+            str
+                The completion.
+        """
+        params = {"max_tokens": self.max_tokens, "temperature": self.temperature, "stop": stop or []}
+        if self.grammar is not None:
+            if self.compiled_grammar is None:
+                self.compiled_grammar = LlamaGrammar.from_string(self.grammar, verbose=False)
+            params["grammar"] = self.compiled_grammar
+
+        result = self.client(prompt=prompt, **params)
+        return result["choices"][0]["text"]
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        if self.n_seq > 1:
+            return self.batcher.submit(prompt, self.max_tokens, self.temperature, stop, self.grammar)
+        with LlamaCppModel.lock:
+            return self.complete(prompt, stop)
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        """
+            Completes a batch of prompts. With n_seq above 1 the prompts are submitted to the batcher at once,
+            so they are decoded together, otherwise they are completed while holding the model, so the batch is
+            not interleaved with the requests of other threads and the model stays warm between the prompts.
+
+            Args:
+            ----------
+            prompts: List[str]
+                The prompts to complete.
+            stop: List[str]
+                The strings that stop the generation, if any.
+
+            Returns:
+            ----------
+            LLMResult
+                The completions, in the same order as the prompts.
+        """
+        if self.n_seq > 1:
+            batcher = self.batcher
+            with ThreadPoolExecutor(max_workers=len(prompts) or 1) as executor:
+                completions = list(executor.map(
+                    lambda prompt: batcher.submit(prompt, self.max_tokens, self.temperature, stop, self.grammar), prompts))
+        else:
+            with LlamaCppModel.lock:
+                completions = [self.complete(prompt, stop) for prompt in prompts]
+        return LLMResult(generations=[[Generation(text=completion)] for completion in completions])
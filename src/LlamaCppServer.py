@@ -0,0 +1,112 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional
+import openai
+import requests
+from langchain.llms.base import LLM as BaseLLM
+from langchain.callbacks.manager import CallbackManagerForLLMRun
+from langchain.schema.output import Generation, LLMResult
+
+
+class LlamaCppServer(BaseLLM):
+
+    """
+        This class is a langchain model for a llama.cpp server (or any server exposing the same
+        '/completion' endpoint). When a GBNF grammar is given, the server constrains the decoding to it,
+        so for example the responses are always valid json.
+        A batch of prompts is sent concurrently, so a server started with several slots ('--parallel')
+        and continuous batching decodes them together in the same forward passes.
+        A busy server (429) or an unavailable one (5xx) raises the errors of the OpenAI client,
+        so the request scheduler retries them like the ones of the OpenAI API.
+
+        Attributes:
+            server_url: The url of the llama.cpp server.
+            grammar: The GBNF grammar the completions must follow, if any.
+            temperature: The sampling temperature.
+            max_tokens: The maximum number of tokens to generate.
+            timeout: The timeout in seconds of the requests to the server.
+            session: The keep-alive HTTP session used for the requests.
+    """
+
+    server_url: str = "http://localhost:8080"
+    grammar: Optional[str] = None
+    temperature: float = 0
+    max_tokens: int = 256
+    timeout: float = 600
+    session: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "llamacpp-server"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"server_url": self.server_url, "grammar": self.grammar is not None,
+                "temperature": self.temperature, "max_tokens": self.max_tokens}
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        """
+            Sends the prompt to the '/completion' endpoint of the server and returns the completion.
+
+            Args:
+            ----------
+            prompt: str
+                The prompt to complete.
+            stop: List[str]
+                The strings that stop the generation, if any.
+
+            Returns:
+            ----------
+            str
+                The completion.
+        """
+        payload = {
+            "prompt": prompt,
+            "n_predict": self.max_tokens,
+            "temperature": self.temperature,
+            "stop": stop or [],
+        }
+        if self.grammar is not None:
+            payload["grammar"] = self.grammar
+
+        response = (self.session or requests).post(f"{self.server_url.rstrip('/')}/completion",
+                                                   json=payload, timeout=self.timeout)
+        if response.status_code == 429:
+            raise openai.error.RateLimitError(response.text, http_body=response.text, http_status=response.status_code,
+                                              headers=dict(response.headers))
+        if response.status_code >= 500:
+            raise openai.error.ServiceUnavailableError(response.text, http_body=response.text,
+                                                       http_status=response.status_code, headers=dict(response.headers))
+        response.raise_for_status()
+        return response.json()["content"]
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        """
+            Sends a batch of prompts to the server concurrently.
+
+            Args:
+            ----------
+            prompts: List[str]
+                The prompts to complete.
+            stop: List[str]
+                The strings that stop the generation, if any.
+
+            Returns:
+            ----------
+            LLMResult
+                The completions, in the same order as the prompts.
+        """
+        with ThreadPoolExecutor(max_workers=len(prompts) or 1) as executor:
+            completions = list(executor.map(lambda prompt: self._call(prompt, stop), prompts))
+        return LLMResult(generations=[[Generation(text=completion)] for completion in completions])
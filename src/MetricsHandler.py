@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable
+from dotenv import load_dotenv
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema.output import LLMResult
+
+# some important enviroment variables
+load_dotenv()
+PROMPT_TOKEN_PRICE = float(os.getenv("PROMPT_TOKEN_PRICE", 0))
+COMPLETION_TOKEN_PRICE = float(os.getenv("COMPLETION_TOKEN_PRICE", 0))
+
+
+class MetricsHandler(BaseCallbackHandler):
+
+    """
+        This class is a langchain callback that records every call to the model: its template, model,
+        prompt and completion tokens, latency and cost, and the phase and file or directory it was made for.
+        It also counts the retries and errors of the requests and the hits and misses of the response cache.
+
+        The callbacks don't know what a call is for, so the callers describe it with 'scope', which sets
+        the fields of the calls made by the current thread. The token counts are taken from the usage reported
+        by the API, the backends that don't report it (llama.cpp) are estimated with the given token counter.
+
+        Attributes:
+            count_tokens: Counts the tokens of a text, for the estimates.
+            prompt_token_price: The price of 1000 prompt tokens.
+            completion_token_price: The price of 1000 completion tokens.
+            calls: The recorded calls.
+            events: The retries, errors and cache hits and misses, with the scope they happened in.
+            started: The start time and scope of the calls in flight, by run id.
+            local: The scope of the calls of every thread.
+            lock: The lock guarding the records.
+
+        Methods:
+            scope: Sets the fields of the calls made by the current thread.
+            current_scope: Returns the fields set for the current thread.
+            record_event: Records a retry, error or cache hit or miss.
+            aggregate: Aggregates the calls and events by a field.
+            to_dict: Returns all the metrics.
+            save: Saves the metrics as json.
+            summary: Returns a summary table of the metrics.
+    """
+
+    def __init__(self, count_tokens: Callable[[str], int] = None,
+                 prompt_token_price: float = PROMPT_TOKEN_PRICE,
+                 completion_token_price: float = COMPLETION_TOKEN_PRICE) -> None:
+        super().__init__()
+        self.count_tokens : Callable[[str], int] = count_tokens
+        self.prompt_token_price : float = prompt_token_price
+        self.completion_token_price : float = completion_token_price
+        self.calls : list[dict] = []
+        self.events : list[dict] = []
+        self.started : dict = {}
+        self.local : threading.local = threading.local()
+        self.lock : threading.Lock = threading.Lock()
+
+    @contextmanager
+    def scope(self, **fields):
+        """
+            Sets the fields (like 'phase', 'target' or 'template') of the calls made by the current thread
+            inside the with block, on top of the fields already set.
+
+            Args:
+            ----------
+            **fields:
+                The fields of the calls.
+
+            Returns:
+            ----------
+            None
+        """
+        previous = self.current_scope()
+        self.local.scope = {**previous, **fields}
+        try:
+            yield
+        finally:
+            self.local.scope = previous
+
+    def current_scope(self) -> dict:
+        """
+            Returns the fields set for the calls of the current thread.
+
+            Args:
+            ----------
+            None
+
+            Returns:
+            ----------
+            dict
+                The fields.
+        """
+        return getattr(self.local, "scope", {})
+
+    def record_event(self, event: str) -> None:
+        """
+            Records a 'retry', 'error', 'cache_hit' or 'cache_miss' in the scope of the current thread.
+
+            Args:
+            ----------
+            event: str
+                The event.
+
+            Returns:
+            ----------
+            None
+        """
+        with self.lock:
+            self.events.append({"event": event, **self.current_scope()})
+
+    def on_llm_start(self, serialized: dict, prompts: list, *, run_id, **kwargs: Any) -> None:
+        with self.lock:
+            self.started[run_id] = (time.monotonic(), self.current_scope(), prompts)
+
+    def on_llm_end(self, response: LLMResult, *, run_id, **kwargs: Any) -> None:
+        with self.lock:
+            started_at, scope, prompts = self.started.pop(run_id, (time.monotonic(), {}, []))
+        latency = time.monotonic() - started_at
+
+        llm_output = response.llm_output or {}
+        usage = llm_output.get("token_usage") or {}
+        estimated = "prompt_tokens" not in usage
+        if estimated and self.count_tokens is not None:
+            usage = {
+                "prompt_tokens": sum(self.count_tokens(prompt) for prompt in prompts),
+                "completion_tokens": sum(self.count_tokens(generation.text)
+                                         for generations in response.generations for generation in generations),
+            }
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+
+        call = {
+            **scope,
+            "model": llm_output.get("model_name", scope.get("model")),
+            "prompts": len(prompts),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "estimated_tokens": estimated,
+            "latency": round(latency, 3),
+            "cost": (prompt_tokens * self.prompt_token_price + completion_tokens * self.completion_token_price) / 1000,
+        }
+        with self.lock:
+            self.calls.append(call)
+
+    def on_llm_error(self, error: BaseException, *, run_id, **kwargs: Any) -> None:
+        with self.lock:
+            _, scope, _ = self.started.pop(run_id, (None, self.current_scope(), None))
+            self.events.append({"event": "error", "error": type(error).__name__, **scope})
+
+    def aggregate(self, field: str = None) -> dict:
+        """
+            Aggregates the calls and the events by one of their fields, for example by 'phase' or 'template'.
+            Without a field everything is aggregated together under 'total'.
+
+            Args:
+            ----------
+            field: str
+                The field to aggregate by, if any.
+
+            Returns:
+            ----------
+            dict
+                The totals of every value of the field.
+        """
+        totals = {}
+        empty = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "latency": 0.0, "cost": 0.0,
+                 "retry": 0, "error": 0, "cache_hit": 0, "cache_miss": 0}
+        with self.lock:
+            for call in self.calls:
+                total = totals.setdefault(str(call.get(field)) if field else "total", dict(empty))
+                total["calls"] += 1
+                for key in ("prompt_tokens", "completion_tokens", "latency", "cost"):
+                    total[key] += call[key]
+            for event in self.events:
+                total = totals.setdefault(str(event.get(field)) if field else "total", dict(empty))
+                total[event["event"]] += 1
+        return totals
+
+    def to_dict(self) -> dict:
+        """
+            Returns all the metrics: the calls, the events and their aggregates by phase,
+            template, model and target (file or directory).
+
+            Args:
+            ----------
+            None
+
+            Returns:
+            ----------
+            dict
+                The metrics.
+        """
+        with self.lock:
+            calls = list(self.calls)
+            events = list(self.events)
+        return {
+            "totals": self.aggregate().get("total", {}),
+            "by_phase": self.aggregate("phase"),
+            "by_template": self.aggregate("template"),
+            "by_model": self.aggregate("model"),
+            "by_target": self.aggregate("target"),
+            "calls": calls,
+            "events": events,
+        }
+
+    def save(self, path: str) -> None:
+        """
+            Saves the metrics as json.
+
+            Args:
+            ----------
+            path: str
+                The path of the json file.
+
+            Returns:
+            ----------
+            None
+        """
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    def summary(self) -> str:
+        """
+            Returns a summary table of the metrics by phase and by template.
+
+            Args:
+            ----------
+            None
+
+            Returns:
+            ----------
+            str
+                The summary table.
+        """
+        header = f"{'':<22}{'calls':>7}{'prompt tok':>12}{'compl. tok':>12}{'avg lat. s':>12}{'retries':>9}{'errors':>8}{'cost':>10}"
+        lines = [header, "-" * len(header)]
+        for title, field in (("phase", "phase"), ("template", "template")):
+            for value, total in sorted(self.aggregate(field).items()):
+                if not total["calls"] and not total["retry"] and not total["error"]:
+                    continue
+                average_latency = total["latency"] / total["calls"] if total["calls"] else 0
+                lines.append(f"{(title + ' ' + value)[:21]:<22}{total['calls']:>7}{total['prompt_tokens']:>12}"
+                             f"{total['completion_tokens']:>12}{average_latency:>12.2f}{total['retry']:>9}"
+                             f"{total['error']:>8}{total['cost']:>10.4f}")
+
+        totals = self.aggregate().get("total")
+        if totals is not None:
+            lines.append("-" * len(header))
+            lines.append(f"{'total':<22}{totals['calls']:>7}{totals['prompt_tokens']:>12}{totals['completion_tokens']:>12}"
+                         f"{'':>12}{totals['retry']:>9}{totals['error']:>8}{totals['cost']:>10.4f}")
+            lines.append(f"cache: {totals['cache_hit']} hits, {totals['cache_miss']} misses")
+        return "\n".join(lines)
@@ -0,0 +1,106 @@
+import os
+from ResponseValidator import ResponseValidator
+
+
+class PathIndex:
+
+    """
+        This class indexes the modules of a project by their full path, so an internal dependency is
+        resolved to the file it refers to with dictionary lookups instead of searching the file list.
+
+        A module is the path of a file relative to the project root without its extension, for example
+        'lib/sub_lib/module', and it resolves to the id of the file: its path without the '.py' extension for
+        python files, and with its extension for the rest, so 'lib/parser.c' and 'lib/parser.h' keep different ids.
+        Packages are also indexed by their folder, resolving to their '__init__' file.
+        Dependencies can be given in the slash or the dotted form, with or without the 'int/' prefix and
+        the file extension: 'int/lib/sub_lib/module', 'lib.sub_lib.module' and 'lib/sub_lib/module.py'
+        all resolve to 'int/lib/sub_lib/module'.
+
+        Attributes:
+            modules: The id of the file of every module path and package folder of the project.
+            paths: The path of every file by its id, relative to the project root.
+            names: The modules of the project by their last part, to resolve the dependencies given
+                   only by the name of a module when the name is unique.
+
+        Methods:
+            add: Adds a file to the index.
+            resolve: Returns the id of the module a dependency refers to.
+    """
+
+    def __init__(self, files: list[str] = None) -> None:
+        self.modules : dict[str, str] = {}
+        self.paths : dict[str, str] = {}
+        self.names : dict[str, list[str]] = {}
+        for path in files or []:
+            self.add(path)
+
+    def add(self, path: str) -> None:
+        """
+            Adds a file to the index.
+
+            Args:
+            ----------
+            path: str
+                The path of the file, relative to the project root.
+
+            Returns:
+            ----------
+            None
+        """
+        module = os.path.splitext(path)[0]
+        python = path.endswith(".py")
+        # like the ids of the report, only the python files lose their extension
+        file_id = module if python else path
+        self.paths[file_id] = path
+
+        folder, _, name = module.rpartition("/")
+        current = self.modules.get(module)
+        if current is None:
+            self.modules[module] = file_id
+            self.names.setdefault(name, []).append(module)
+        elif python and not self.paths[current].endswith(".py"):
+            # files with the same name and other extensions are the same module, the python file wins,
+            # like for the imports ('lib/schema.py' over 'lib/schema.json')
+            self.modules[module] = file_id
+        if name == "__init__" and folder:
+            # like python, the package wins over a module with the same name
+            self.modules[folder] = module
+
+    def resolve(self, dependency: str, folder: str = "") -> str:
+        """
+            Returns the id of the module a dependency refers to, as 'int/<id>', or None if it is not a module
+            of the project. The dependency is looked up from the given folder first (like python does for
+            scripts) and then from the project root, and the longest part of it that is a module is taken,
+            since 'lib/module/ClassName' refers to 'lib/module'. If that fails, a dependency whose last part
+            is the name of a single module of the project resolves to it.
+
+            Args:
+            ----------
+            dependency: str
+                The dependency, for example 'int/lib/module' or 'lib.module'.
+            folder: str
+                The folder of the file with the dependency, relative to the project root.
+
+            Returns:
+            ----------
+            str
+                The module, or None.
+        """
+        if dependency.startswith(("int/", "ext/")):
+            dependency = dependency[4:]
+        parts = ResponseValidator.normalize_dependency(dependency).split("/")
+        if parts == [""]:
+            return None
+
+        bases = [folder.split("/"), []] if folder else [[]]
+        for base in bases:
+            candidate = base + parts
+            for end in range(len(candidate), len(base), -1):
+                module = self.modules.get("/".join(candidate[:end]))
+                if module is not None:
+                    return f"int/{module}"
+
+        modules = self.names.get(parts[-1], [])
+        if len(modules) == 1:
+            return f"int/{self.modules[modules[0]]}"
+        return None
@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager
+
+
+class Profiler:
+
+    """
+        This class records where the time of a run goes, as spans: the phases of the report, the analysis
+        of every file and directory and every call to the model, split in the time waiting for the rate limits
+        and the request itself. The spans are saved in the Chrome trace format, which can be opened with
+        chrome://tracing, Perfetto or speedscope, one row per thread.
+
+        Optionally the CPU time of our own code is also captured with cProfile. Every thread is profiled while
+        it is inside its outermost span, with the CPU time of the thread as the clock, so the time waiting for the
+        network doesn't count and what is left is the local work (scanning, tokenizing, chunking, post-processing).
+
+        The profiler is disabled until 'enable' is called, then the spans cost almost nothing.
+
+        Attributes:
+            enabled: Whether the spans are recorded.
+            cpu: Whether the CPU time is captured with cProfile.
+            events: The recorded spans, as trace events.
+            profiles: The cProfile profiles of the threads.
+            thread_names: The names of the threads that recorded spans, by thread id.
+            origin: The start time of the trace.
+            local: The span depth and cProfile profile of every thread.
+            lock: The lock guarding the records.
+
+        Methods:
+            enable: Starts recording the spans, and the CPU time if asked.
+            span: Records the time spent in a block of code.
+            save: Saves the trace, and the CPU profile if it was captured.
+    """
+
+    def __init__(self) -> None:
+        self.enabled : bool = False
+        self.cpu : bool = False
+        self.events : list[dict] = []
+        self.profiles : list[cProfile.Profile] = []
+        self.thread_names : dict[int, str] = {}
+        self.origin : float = time.perf_counter()
+        self.local : threading.local = threading.local()
+        self.lock : threading.Lock = threading.Lock()
+
+    def enable(self, cpu: bool = False) -> None:
+        """
+            Starts recording the spans, and the CPU time of the threads if asked.
+
+            Args:
+            ----------
+            cpu: bool
+                Whether to capture the CPU time with cProfile.
+
+            Returns:
+            ----------
+            None
+        """
+        self.enabled = True
+        self.cpu = cpu
+        self.origin = time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str, category: str = "phase", **args):
+        """
+            Records the time spent in the with block as a span of the current thread.
+
+            Args:
+            ----------
+            name: str
+                The name of the span, for example the phase or the file analyzed.
+            category: str
+                The category of the span: 'phase', 'file', 'directory', 'llm', 'network', 'wait' or 'tokenization'.
+            **args:
+                Details shown with the span, like the template of a call.
+
+            Returns:
+            ----------
+            None
+        """
+        if not self.enabled:
+            yield
+            return
+
+        depth = getattr(self.local, "depth", 0)
+        self.local.depth = depth + 1
+        profile = None
+        if self.cpu and depth == 0:
+            profile = cProfile.Profile(time.thread_time)
+            profile.enable()
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            if profile is not None:
+                profile.disable()
+            self.local.depth = depth
+
+            thread = threading.current_thread()
+            event = {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": round((start - self.origin) * 1e6, 1),
+                "dur": round((end - start) * 1e6, 1),
+                "pid": os.getpid(),
+                "tid": thread.ident,
+            }
+            if args:
+                event["args"] = {key: str(value) for key, value in args.items()}
+            with self.lock:
+                self.events.append(event)
+                self.thread_names.setdefault(thread.ident, thread.name)
+                if profile is not None:
+                    self.profiles.append(profile)
+
+    def save(self, path: str) -> None:
+        """
+            Saves the trace as json, in the Chrome trace format. If the CPU time was captured, the profile
+            of all the threads is saved next to it with the '.prof' extension (it can be read with pstats or
+            snakeviz) and its top functions are printed.
+
+            Args:
+            ----------
+            path: str
+                The path of the trace.
+
+            Returns:
+            ----------
+            None
+        """
+        with self.lock:
+            events = list(self.events)
+            thread_names = dict(self.thread_names)
+            profiles = list(self.profiles)
+
+        metadata = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                    for tid, name in thread_names.items()]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": metadata + sorted(events, key=lambda event: event["ts"]),
+                       "displayTimeUnit": "ms"}, f)
+        print(f"Profile trace saved to {path}")
+
+        if profiles:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            profile_path = os.path.splitext(path)[0] + ".prof"
+            stats.dump_stats(profile_path)
+            print(f"CPU profile saved to {profile_path}, the functions with the most CPU time:")
+            stats.sort_stats(pstats.SortKey.TIME).print_stats(15)
+
+
+profiler = Profiler()
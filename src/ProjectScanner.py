@@ -0,0 +1,142 @@
+import os
+from GitIgnore import GitIgnore
+
+
+class ProjectScanner:
+
+    """
+        This class scans a project in a single pass with os.scandir, skipping the hidden entries and the ones
+        ignored by the .gitignore files of the project (like 'tree --gitignore'), and builds at once:
+
+            - the report tree, in the json format of 'tree -J': [root directory, {"type": "report", ...}]
+            - the text listing of the project, in the format of 'tree'
+            - the index of the files of the project, as paths relative to the root
+
+        The entries of every folder are sorted by name, folders and files together.
+
+        Attributes:
+            project_path: The path of the project.
+            report: The report tree.
+            listing: The text listing.
+            files: The paths of the files, relative to the project root.
+
+        Methods:
+            scan: Scans the project.
+            render_listing: Renders the report tree like the 'tree' command.
+            scan_directory: Scans a folder of the project.
+    """
+
+    def __init__(self, project_path: str) -> None:
+        self.project_path : str = project_path.rstrip("/")
+        self.report : list = None
+        self.listing : str = None
+        self.files : list[str] = []
+
+    def scan(self) -> None:
+        """
+            Scans the project, building the report tree, the text listing and the file index.
+
+            Args:
+            ----------
+            None
+
+            Returns:
+            ----------
+            None
+        """
+        self.files = []
+        root = {"type": "directory", "name": os.path.basename(self.project_path), "contents": []}
+        counts = {"directories": 1, "files": 0}
+
+        # the folders left to scan: (node, absolute path, path relative to the root, gitignores)
+        stack = [(root, self.project_path, "", [])]
+        while stack:
+            directory, path, relative_path, gitignores = stack.pop()
+
+            gitignore = GitIgnore.from_file(os.path.join(path, ".gitignore"), relative_path)
+            if gitignore is not None:
+                gitignores = gitignores + [gitignore]
+
+            for entry, child_relative_path, is_dir in self.scan_directory(path, relative_path, gitignores):
+                if is_dir:
+                    child = {"type": "directory", "name": entry.name, "contents": []}
+                    counts["directories"] += 1
+                    stack.append((child, entry.path, child_relative_path, gitignores))
+                elif entry.is_symlink():
+                    child = {"type": "link", "name": entry.name, "target": os.readlink(entry.path)}
+                    counts["files"] += 1
+                else:
+                    child = {"type": "file", "name": entry.name}
+                    counts["files"] += 1
+                    self.files.append(child_relative_path)
+                directory["contents"].append(child)
+
+        self.report = [root, {"type": "report", **counts}]
+        self.listing = (self.render_listing(root)
+                        + f"\n\n{counts['directories']} directories, {counts['files']} files\n")
+
+    def render_listing(self, root: dict) -> str:
+        """
+            Renders the report tree like the 'tree' command, the tree is already in memory
+            so this doesn't touch the file system.
+
+            Args:
+            ----------
+            root: dict
+                The root folder of the report tree.
+
+            Returns:
+            ----------
+            str
+                The text listing.
+        """
+        lines = [self.project_path]
+        # the entries left to render: (node, prefix of its children, is the last child of its folder)
+        stack = [(child, "", index == len(root["contents"]) - 1) for index, child in enumerate(root["contents"])]
+        stack.reverse()
+        while stack:
+            node, prefix, last = stack.pop()
+            name = node["name"] if node["type"] != "link" else f"{node['name']} -> {node['target']}"
+            lines.append(prefix + ("└── " if last else "├── ") + name)
+            if node["type"] == "directory":
+                child_prefix = prefix + ("    " if last else "│   ")
+                contents = node["contents"]
+                stack.extend((contents[index], child_prefix, index == len(contents) - 1)
+                             for index in range(len(contents) - 1, -1, -1))
+        return "\n".join(lines)
+
+    def scan_directory(self, path: str, relative_path: str, gitignores: list) -> list:
+        """
+            Returns the entries of a folder that are not hidden nor ignored, sorted by name.
+
+            Args:
+            ----------
+            path: str
+                The absolute path of the folder.
+            relative_path: str
+                The path of the folder relative to the project root.
+            gitignores: list
+                The matchers of the .gitignore files that apply to the folder.
+
+            Returns:
+            ----------
+            list
+                The (entry, path relative to the root, is a directory) tuples.
+        """
+        try:
+            with os.scandir(path) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+        except OSError:
+            return []
+
+        children = []
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            # the symlinks to folders are listed but not followed, like 'tree' does
+            is_dir = entry.is_dir(follow_symlinks=False)
+            child_relative_path = f"{relative_path}/{entry.name}" if relative_path else entry.name
+            if GitIgnore.is_ignored(gitignores, child_relative_path, is_dir):
+                continue
+            children.append((entry, child_relative_path, is_dir))
+        return children
@@ -1,12 +1,23 @@
 import json
 import os
+import subprocess
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 from LLMManager import LLM, default_llm
+from DependencyResolver import DependencyResolver
+from Checkpoint import Checkpoint
+from ProjectScanner import ProjectScanner
+from PathIndex import PathIndex
+from ReportWriter import ReportWriter
+from FileHandler import FileHandler
+from Profiler import profiler
+from langchain.text_splitter import Language
 from dotenv import load_dotenv
 
 load_dotenv()
 OUTPUTS_PATH = os.getenv("OUTPUTS_PATH")
 PROJECTS_PATH = os.getenv("PROJECTS_PATH")
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", 4))
 
 
 # def load_file_content(file_path: str) -> str:
@@ -26,26 +37,38 @@ PROJECTS_PATH = os.getenv("PROJECTS_PATH")
 
 
 class Report:
-    def __init__(self, project_path) -> None:
+    def __init__(self, project_path, max_workers: int = MAX_WORKERS) -> None:
         """
             Constructor of the Report class.
 
             Args:
             ------
                 project_path: str
+                max_workers: int
+                    The maximum number of files analyzed concurrently, 1 analyzes them one at a time.
 
             Returns:
             --------
                 None
         """
-        self.files = None
+        self.project_files = None
+        self.path_index: PathIndex = None
         self.project_path: str = project_path
+        self.max_workers: int = max_workers
+        self.checkpoint: Checkpoint = None
+        self.nodes: list = None
+        self.writer: ReportWriter = ReportWriter()
         self.report: dict = {}
-        self.find_all_files()
-        self.generate_initial_report()
+        self.files_report: str = None
+        with profiler.span("scan"):
+            self.generate_initial_report()
         self.ext_dependencies: dict = {}
         self.int_dependencies: dict = {}
-        self.LLM = default_llm(self.project_path)
+        with profiler.span("load model"):
+            self.LLM = default_llm(self.project_path, pool_size=self.max_workers)
+            self.LLM.prompt_handler.set_project_tree(self.report[0], self.files_report)
+        with profiler.span("dependency index"):
+            self.dependency_resolver = DependencyResolver(self.project_path, self.path_index)
 
     def load_file_content(self, file_path: str) -> str:
         """
@@ -63,30 +86,16 @@ class Report:
         fp_list.pop(0)
         file_path = "/".join(fp_list)
         print("Parsing file: ", file_path, "...")
-        with open(self.project_path + "/" + file_path, "r") as f:
+        # not every file is utf-8, the undecodable bytes are replaced instead of stopping the run
+        with open(self.project_path + "/" + file_path, "r", errors="replace") as f:
             return f.read()
 
-    def find_all_files(self):
-        """
-            Finds all the files in the project tree.
-
-            Args:
-            ------
-                None
-
-            Returns:
-            --------
-                None
-        """
-        files = []
-        for root, _, filenames in os.walk(self.project_path):
-            for filename in filenames:
-                files.append(filename)
-        self.files = files
-
     def generate_initial_report(self) -> None:
         """
-            Generates a json report of the project tree.
+            Generates a json report of the project tree, the text listing of the project and the index
+            of its files, scanning the project once. The hidden files and the files ignored by the
+            .gitignore files of the project are left out.
+            The report and the listing are also saved in the outputs folder.
 
             Args:
             ------
@@ -95,10 +104,17 @@ class Report:
             --------
                 None
         """
+        scanner = ProjectScanner(self.project_path)
+        scanner.scan()
 
-        os.system(f"tree {self.project_path} -J --gitignore | python3 -m json.tool > {OUTPUTS_PATH}filesreport.json")
-        os.system(f"tree {self.project_path} --gitignore > {OUTPUTS_PATH}filesreport.txt")
-        self.load_json_report(f"{OUTPUTS_PATH}filesreport.json")
+        self.report = scanner.report
+        self.files_report = scanner.listing
+        self.project_files = scanner.files
+        self.path_index = PathIndex(scanner.files)
+
+        self.writer.write(self.report, f"{OUTPUTS_PATH}filesreport.json")
+        with open(f"{OUTPUTS_PATH}filesreport.txt", "w") as f:
+            f.write(self.files_report)
 
     def dependencies_response_handler(self, deps: list) -> None:
         """
@@ -116,164 +132,336 @@ class Report:
             # if dep not in self.ext_dependencies and not dep.startswith("int/"):
             #     self.ext_dependencies.append(dep)
             if dep.startswith("int/"):  # internal dependency
-                if dep not in self.int_dependencies.keys():
-                    dep = dep.replace(".py", "")
-                    self.int_dependencies[dep] = 1
-                else:
-                    self.int_dependencies[dep] += 1
+                self.int_dependencies[dep] = self.int_dependencies.get(dep, 0) + 1
             elif dep.startswith("ext/"):
-                if dep not in self.ext_dependencies.keys():
-                    dep = dep.replace(".py", "")
-                    self.ext_dependencies[dep] = 1
-                else:
-                    self.ext_dependencies[dep] += 1
+                self.ext_dependencies[dep] = self.ext_dependencies.get(dep, 0) + 1
 
-    def add_internal_dependencies_to_report_helper(self, directory):
+    def build_node_table(self) -> list:
         """
-            Adds the internal dependencies to the report
+            Walks the report once, without recursion, building the node table: every node of the report tree
+            with its parent and its path, in tree order. The paths, ids and languages of the files are completed
+            on the way, and the files that must be analyzed by the model are collected.
+            The rest of the run works over this table instead of walking the tree again.
 
             Args:
             ------
-                directory: dict
+                None
 
             Returns:
             --------
-                None
+                list
+                    The file nodes to analyze, in tree order.
+        """
+        files = []
+        self.nodes = []
+        stack = [(self.report[0], None, self.report[0]["name"])]
+        while stack:
+            node, parent, path = stack.pop()
+            self.nodes.append((node, parent, path))
+            if node["type"] == "directory":
+                node.setdefault("contents", [])
+                stack.extend((child, node, f"{path}/{child['name']}") for child in reversed(node["contents"]))
+            elif node["type"] == "file":
+                language = self.file_language(path)
+                if language is None:
+                    continue
+                node["full_path"] = path
+                node["language"] = language.value
+                node["id"] = "int/" + path.split("/", 1)[1]
+                files.append(node)
+        return files
+
+    def file_language(self, file_path: str) -> Language:
         """
-        if directory["type"] == "directory":
-            for child in directory["contents"]:
-                self.add_internal_dependencies_to_report_helper(child)
-        elif directory["type"] == "file":
-            if not directory["name"].endswith(".py"):
-                return
-            # directory["times_called"] = self.int_dependencies[directory["full_path"]]
-            full_path_list = directory["full_path"].split("/")
-            full_path_list.pop(0)
-            full_path_list.insert(0, "int")
-            name = "/".join(full_path_list)
+            Finds the language of a file from its extension, or from its shebang if it has no extension.
+            Files in languages that can't be analyzed return None.
 
-            if name in self.int_dependencies.keys():
-                directory["times_called"] = self.int_dependencies[name]
-            elif name+".py" in self.int_dependencies.keys():
-                directory["times_called"] = self.int_dependencies[name+".py"]
-            elif name[:-3] in self.int_dependencies.keys():
-                directory["times_called"] = self.int_dependencies[name[:-3]]
+            Args:
+            ------
+                file_path: str
 
+            Returns:
+            --------
+                Language
+        """
+        filename = file_path.split("/")[-1]
+        first_line = None
+        if not os.path.splitext(filename)[1]:
+            try:
+                with open(self.project_path + "/" + "/".join(file_path.split("/")[1:]), "r") as f:
+                    first_line = f.readline()
+            except (OSError, UnicodeDecodeError):
+                return None
+        return FileHandler.from_filename_to_lang(filename, first_line)
+
+    def analyze_file(self, file: dict) -> dict:
+        """
+            Generates the response of the model for a file, it may run in a worker thread
+            so it must not modify the report.
+            The dependencies of python files are found statically from their imports, only for
+            other languages or when the file can't be parsed the dependencies given by the model are used.
 
+            Args:
+            ------
+                file: dict
 
-    def add_ext_dependencies_to_report(self) -> None:
+            Returns:
+            --------
+                dict
+        """
+        with profiler.span(file["full_path"], "file"):
+            code = self.load_file_content(file["full_path"])
+            dependencies = None
+            if file["language"] == Language.PYTHON.value:
+                dependencies = self.dependency_resolver.resolve(file["full_path"], code)
+            with self.LLM.metrics.scope(phase="files", target=file["full_path"]):
+                response = self.LLM.generate_response(file["full_path"], code, dependencies)
+
+            if dependencies is None:
+                response["dependencies"] = self.fix_model_dependencies(response["dependencies"], file)
+            else:
+                response["dependencies"] = dependencies
+            return response
+
+    def fix_model_dependencies(self, dependencies: list, file: dict) -> list:
         """
-            Adds the external dependencies to the report
+            Fixes the dependencies given by the model, resolving the internal dependencies to the modules
+            of the project with the path index, and marking as external the ones that are not in the project tree.
 
             Args:
             ------
-                None
+                dependencies: list
+                file: dict
+                    The file with the dependencies, the internal dependencies are looked up from its folder first.
 
             Returns:
             --------
-                None
+                list
         """
-        root_directory = self.project_path.split("/")[-1]
-        for dep in self.ext_dependencies:
-            self.report[0]["contents"].append({
-                "type": "External dependency",
-                "name": dep,
-                "times_called": self.ext_dependencies[dep],
-                "full_path": f"{root_directory}/{dep}",
-                "dependencies": [],
-                "explanation": ""
-            })
-
-    def complete_report_helper(self, directory: dict, root: str):
+        folder = "/".join(file["full_path"].split("/")[1:-1])
+        for i in range(len(dependencies)):
+            if not dependencies[i].startswith("int/"):
+                continue
+            module = self.path_index.resolve(dependencies[i], folder)
+            if module is None:
+                # print(f"WARNING: {dependencies[i]} not found in the project tree")
+                module = dependencies[i].replace("int/", "ext/", 1)
+            dependencies[i] = module
+        return list(dict.fromkeys(dependencies))
+
+    def analyze_files(self, since: str = None, until: str = None, resume: bool = False):
         """
-            This function is supposed to take the report and complete it with the response of the model.
+            Analyzes all the files and explains all the directories of the report, with up to max_workers
+            requests in flight. The report is scheduled as a graph: a directory is explained as soon as all its
+            files and subdirectories are done, so the directories are explained while other files are still
+            being analyzed. The ready directories go before the remaining files, so the deepest parts of the
+            tree are finished first.
+            The dependencies are counted in tree order, so the result doesn't depend on which request finishes first.
+            When a revision is given, the analyses of the previous report that didn't change since it are reused.
+            Every completed analysis is written to the checkpoint journal, so an interrupted run can be resumed.
 
             Args:
             ------
-                directory: dict
-                root: str
+                since: str
+                    The git revision the previous report was generated at, if any.
+                until: str
+                    The git revision to compare it with, by default the working tree.
+                resume: bool
+                    Whether to reuse the analyses in the checkpoint journal of an interrupted run.
 
             Returns:
             --------
                 None
         """
-        if directory["type"] == "directory":
-            if "contents" not in directory.keys():
-                directory["contents"] = []
-            for child in directory["contents"]:
-                self.complete_report_helper(child, f"{root}{directory['name']}/")
-        elif directory["type"] == "file":
-            if not directory["name"].endswith(".py"):
-                return
-            directory["full_path"] = f"{root}{directory['name']}"
-            file_id = directory["full_path"].split("/")
-            file_id[0] = "int"
-            file_id = "/".join(file_id)
-            directory["id"] = file_id
-            response = self.LLM.generate_response(directory["full_path"], self.load_file_content(directory["full_path"]))
-            # print("---------------response-----------------")
-            # print(response)
-            # response = {"dependencies": "dependencies", "explanation": "explanation"}
-            for i in range(len(response["dependencies"])):
-                # remove the .py extension
-                response["dependencies"][i] = response["dependencies"][i].replace(".py", "")
-                if response["dependencies"][i].split("/")[-1]+".py" not in self.files:
-                    # print(f"WARNING: {response['dependencies'][i]} not found in the project tree")
-                    response["dependencies"][i] = response["dependencies"][i].replace("int/", "ext/")
-
-            directory["dependencies"] = response["dependencies"]
-            directory["explanation"] = response["explanation"]
-            self.dependencies_response_handler(response["dependencies"])
-
-    def remove_py_extension(self):
+        files = self.build_node_table()
+        if since is not None:
+            self.reuse_previous_report(files, since, until)
+
+        directories = [(node, path) for node, _, path in self.nodes if node["type"] == "directory"]
+        directory_paths = {id(directory): path for directory, path in directories}
+
+        self.checkpoint = Checkpoint(self.report[0]["name"])
+        self.checkpoint.open(resume)
+        if resume:
+            self.replay_checkpoint(files, directories)
+
+        parents, pending, ready_directories = self.build_directory_graph()
+
+        remaining_files = iter([file for file in files if "explanation" not in file])
+        try:
+            self.run_analyses(remaining_files, ready_directories, parents, pending, directory_paths)
+        finally:
+            self.checkpoint.close()
+
+        for file in files:
+            self.dependencies_response_handler(file["dependencies"])
+
+    def run_analyses(self, remaining_files, ready_directories: list, parents: dict, pending: dict, directory_paths: dict):
         """
-            This function is supposed to take the report and complete it with the response of the model.
+            Runs the analyses of the files and the directories as they get ready, recording every
+            completed one in the checkpoint journal.
 
             Args:
             ------
-                None
+                remaining_files: iterator
+                    The files to analyze, in tree order.
+                ready_directories: list
+                parents: dict
+                pending: dict
+                directory_paths: dict
+                    The path of every directory, by node id.
 
             Returns:
             --------
                 None
         """
-        if self.report is None:
-            raise Exception("No report loaded")
-        self.remove_py_extension_helper(self.report[0])
-
-    def add_directory_information_helper(self, directory):
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                while len(running) < self.max_workers:
+                    if ready_directories:
+                        directory = ready_directories.pop()
+                        running[executor.submit(self.explain_directory, directory, directory_paths[id(directory)])] = directory
+                        continue
+                    file = next(remaining_files, None)
+                    if file is None:
+                        break
+                    running[executor.submit(self.analyze_file, file)] = file
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = running.pop(future)
+                    if node["type"] == "file":
+                        response = future.result()
+                        node["dependencies"] = response["dependencies"]
+                        node["explanation"] = response["explanation"]
+                        self.checkpoint.record({"type": "file", "id": node["id"], "dependencies": node["dependencies"],
+                                                "explanation": node["explanation"]})
+                    else:
+                        node["explanation"] = future.result()
+                        self.checkpoint.record({"type": "directory", "path": directory_paths[id(node)],
+                                                "explanation": node["explanation"]})
+
+                    parent = parents[id(node)]
+                    if parent is not None:
+                        pending[id(parent)] -= 1
+                        if pending[id(parent)] == 0:
+                            ready_directories.append(parent)
+
+    def replay_checkpoint(self, files: list, directories: list):
         """
-            This function is supposed to take the report and complete it with the response of the model.
+            Reuses the analyses recorded in the checkpoint journal by an interrupted run.
 
             Args:
             ------
-                directory: dict
+                files: list
+                directories: list
+                    The (directory, path) pairs of the report.
 
             Returns:
             --------
                 None
         """
-        if directory["type"] == "directory":
+        replayed = 0
+        for file in files:
+            record = self.checkpoint.records.get(("file", file["id"]))
+            if record is not None and "explanation" not in file:
+                file["dependencies"] = record["dependencies"]
+                file["explanation"] = record["explanation"]
+                replayed += 1
+        for directory, path in directories:
+            record = self.checkpoint.records.get(("directory", path))
+            if record is not None and "explanation" not in directory:
+                directory["explanation"] = record["explanation"]
+                replayed += 1
+
+        print(f"Resuming the previous run, {replayed} analyses taken from the checkpoint")
+
+    def build_directory_graph(self) -> tuple:
+        """
+            Finds, from the node table, the parent of every directory and file to analyze, and the number of
+            children each directory has to wait for. The directories without any are ready to be explained,
+            unless their explanation was reused.
 
-            current_directory_list: list = []
-            for i in directory["contents"]:
-                if i["type"] == "file":
-                    current_directory_list.append(i)
-                else:
-                    current_directory_list.append({
-                        "name": i["name"],
-                        "type": "directory"
-                    })
-                    self.add_directory_information_helper(i)
+            Args:
+            ------
+                None
 
-            response = self.LLM.generate_explaination_for_directory(current_directory_list)
-            # response = "generic description"
-            directory["explanation"] = response
+            Returns:
+            --------
+                tuple
+                    The parents and the pending children by node id, and the directories ready to be explained.
+        """
+        parents = {}
+        pending = {}
+        for node, parent, _ in self.nodes:
+            if node["type"] == "directory":
+                pending[id(node)] = 0
+            elif "id" not in node:
+                continue
+            parents[id(node)] = parent
+            if parent is not None and "explanation" not in node:
+                pending[id(parent)] += 1
+
+        # the deepest directories are the last ones in the table, they are taken first from the end of the list
+        ready_directories = [node for node, _, _ in self.nodes
+                             if node["type"] == "directory" and pending[id(node)] == 0 and "explanation" not in node]
+        return parents, pending, ready_directories
+
+    def reuse_previous_report(self, files: list, since: str, until: str = None):
+        """
+            Reuses the analyses of the previous final report for the files that didn't change between
+            two git revisions, and the explanations of the directories that have no changes inside.
+            The files added, modified, deleted or renamed, and the files the previous report doesn't have,
+            are left to be analyzed, and so are their parent directories up to the root.
+            If there is no previous report of the project, everything is analyzed.
 
-    def complete_report(self):
+            Args:
+            ------
+                files: list
+                    The file nodes to analyze.
+                since: str
+                    The git revision the previous report was generated at.
+                until: str
+                    The git revision to compare it with, by default the working tree.
 
+            Returns:
+            --------
+                None
         """
-            This function is supposed to take the report and complete it with the response of the model.
+        previous_report = self.load_previous_report()
+        if previous_report is None:
+            return
+
+        changed = self.changed_files(since, until)
+        previous_files, previous_directories = self.index_previous_report(previous_report)
+
+        root = self.report[0]["name"]
+        outdated = {f"{root}/{path}" for path in changed}
+        reused = 0
+        for file in files:
+            previous_file = previous_files.get(file["id"].removesuffix(".py"))
+            if file["full_path"] in outdated or previous_file is None or "explanation" not in previous_file:
+                outdated.add(file["full_path"])
+                continue
+            file["dependencies"] = previous_file["dependencies"]
+            file["explanation"] = previous_file["explanation"]
+            reused += 1
+
+        # every folder with something outdated inside must be explained again
+        outdated_directories = {"/".join(path.split("/")[:end]) for path in outdated for end in range(1, path.count("/") + 1)}
+        for node, _, path in self.nodes:
+            if node["type"] == "directory" and path not in outdated_directories and path in previous_directories:
+                node["explanation"] = previous_directories[path]
+
+        print(f"Reusing the analysis of {reused} of {len(files)} files, {len(changed)} paths changed since {since}")
+
+    def load_previous_report(self) -> list:
+        """
+            Loads the previous final report, if it exists and is a report of the same project.
 
             Args:
             ------
@@ -281,61 +469,189 @@ class Report:
 
             Returns:
             --------
-                None
+                list
         """
-        if self.report is None:
-            raise Exception("No report loaded")
+        try:
+            with open(f"{OUTPUTS_PATH}reports/finalreport.json", "r") as f:
+                previous_report = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            print("WARNING: there is no previous report to update, analyzing the whole project")
+            return None
+
+        if previous_report[0]["name"] != self.report[0]["name"]:
+            print("WARNING: the previous report is from another project, analyzing the whole project")
+            return None
+        return previous_report
+
+    def changed_files(self, since: str, until: str = None) -> set:
+        """
+            Returns the paths, relative to the project, of the files added, modified, deleted or renamed
+            between two git revisions. Renamed files count with both their old and new paths.
 
-        self.complete_report_helper(self.report[0], '')
-        self.add_directory_information_helper(self.report[0])
-        self.add_internal_dependencies_to_report_helper(self.report[0])
-        self.add_ext_dependencies_to_report()
-        self.remove_py_extension()
-        self.add_aditional_info()
-        self.save_report()
+            Args:
+            ------
+                since: str
+                until: str
+                    By default the working tree.
 
-        # with open(f"{OUTPUTS_PATH}/ext_dependencies.json", "w") as f:
-        #     json.dump(self.ext_dependencies, f, indent=4)
+            Returns:
+            --------
+                set
+        """
+        command = ["git", "-C", self.project_path, "diff", "--name-status", "-z", "-M", "--relative", since]
+        if until is not None:
+            command.append(until)
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise Exception(f"git diff failed: {result.stderr.strip()}")
+
+        changed = set()
+        fields = result.stdout.split("\0")
+        i = 0
+        while i < len(fields) - 1:
+            status = fields[i]
+            # renames and copies have both the old and the new path
+            paths = 2 if status[0] in "RC" else 1
+            changed.update(fields[i + 1:i + 1 + paths])
+            i += 1 + paths
+        return changed
+
+    def index_previous_report(self, previous_report: list) -> tuple:
+        """
+            Indexes the analyzed files of the previous report by their id, and the explanations of
+            its directories by their path.
 
-    def load_json_report(self, json_path):
+            Args:
+            ------
+                previous_report: list
+
+            Returns:
+            --------
+                tuple
+                    The previous files and the previous directory explanations.
+        """
+        previous_files = {}
+        previous_directories = {}
+        stack = [(previous_report[0], previous_report[0]["name"])]
+        while stack:
+            directory, path = stack.pop()
+            if "explanation" in directory:
+                previous_directories[path] = directory["explanation"]
+            for child in directory.get("children", directory.get("contents", [])):
+                if child["type"] == "directory":
+                    stack.append((child, f"{path}/{child['name']}"))
+                elif child["type"] == "file" and "id" in child:
+                    previous_files[child["id"]] = child
+        return previous_files, previous_directories
+
+    def finalize_report(self) -> None:
         """
-            Loads the json report into the report attribute.
+            Post-processes the analyzed report in a single pass over the node table: the directories get
+            their 'contents' renamed to 'children', and the analyzed files get how many times they are called
+            and the '.py' extension removed from their name, path and id. Then the external dependencies are
+            added to the root of the report.
 
             Args:
             ------
-                json_path: str
+                None
 
             Returns:
             --------
                 None
         """
-        with open(json_path, "r") as f:
-            self.report = json.load(f)
-        self.report[0]["name"] = self.project_path.split("/")[-1]
+        for node, _, _ in self.nodes:
+            if node["type"] == "directory":
+                node["children"] = node.pop("contents")
+            elif "id" in node:
+                # only the python files lose their extension, the rest keep it so 'parser.c' and 'parser.h'
+                # don't get the same id, like the dependencies resolved by the path index
+                module = node["id"].removesuffix(".py")
+                if module in self.int_dependencies:
+                    node["times_called"] = self.int_dependencies[module]
+                node["name"] = node["name"].removesuffix(".py")
+                node["full_path"] = node["full_path"].removesuffix(".py")
+                node["id"] = module
+
+        root_directory = self.report[0]["name"]
+        for dep in self.ext_dependencies:
+            self.report[0]["children"].append({
+                "type": "External dependency",
+                "name": dep,
+                "times_called": self.ext_dependencies[dep],
+                "full_path": f"{root_directory}/{dep}",
+                "dependencies": [],
+                "explanation": ""
+            })
 
-    def remove_py_extension_helper(self, directory: dict):
+    def explain_directory(self, directory: dict, path: str = None) -> str:
         """
-            Removes the .py extension from the files in the report.
+            Generates the explanation of a directory from the explanations of its files and subdirectories,
+            it runs in a worker thread once all of them are done, so it must not modify the report.
+            The subdirectories are summarized by their own explanation, their contents are not sent again.
 
             Args:
             ------
                 directory: dict
+                path: str
+                    The path of the directory, for the metrics and the profile.
+
+            Returns:
+            --------
+                str
+        """
+        current_directory_list: list = []
+        for i in directory["contents"]:
+            current_directory_list.append({
+                "name": i["name"],
+                "type": i["type"],
+                "explanation": i.get("explanation", "")
+            })
+
+        path = path or directory["name"]
+        with profiler.span(path, "directory"), self.LLM.metrics.scope(phase="directories", target=path):
+            return self.LLM.generate_explaination_for_directory(current_directory_list)
+
+    def complete_report(self, since: str = None, until: str = None, resume: bool = False):
+
+        """
+            This function is supposed to take the report and complete it with the response of the model.
+            When a git revision is given, the report is updated incrementally from the previous final report,
+            only the files that changed since that revision and their parent directories are analyzed again.
+
+            Args:
+            ------
+                since: str
+                    The git revision the previous report was generated at, if any.
+                until: str
+                    The git revision to compare it with, by default the working tree.
+                resume: bool
+                    Whether to resume an interrupted run from its checkpoint journal.
 
             Returns:
             --------
                 None
         """
-        if directory["type"] == "directory":
-            directory["children"] = directory["contents"]
-            del directory["contents"]
-            for child in directory["children"]:
-                self.remove_py_extension_helper(child)
-        elif directory["type"] == "file":
-            if not directory["name"].endswith(".py"):
-                return
-            directory["name"] = directory["name"].replace(".py", "")
-            directory["full_path"] = directory["full_path"].replace(".py", "")
-            directory["id"] = directory["id"].replace(".py", "")
+        if self.report is None:
+            raise Exception("No report loaded")
+
+        with profiler.span("analysis"):
+            self.analyze_files(since, until, resume)
+        with profiler.span("post-processing"):
+            self.finalize_report()
+        with profiler.span("cohesion and coupling"):
+            self.add_aditional_info()
+        with profiler.span("save"):
+            self.save_report()
+            self.checkpoint.remove()
+            self.LLM.cache.save_index()
+            self.LLM.metrics.save(f"{OUTPUTS_PATH}metrics.json")
+        print(self.LLM.cache.summary())
+
+        if profiler.enabled:
+            profiler.save(f"{OUTPUTS_PATH}profile.json")
+
+        # with open(f"{OUTPUTS_PATH}/ext_dependencies.json", "w") as f:
+        #     json.dump(self.ext_dependencies, f, indent=4)
 
     def add_aditional_info(self):
         """
@@ -349,14 +665,16 @@ class Report:
             --------
                 None
         """
-        response = self.LLM.generate_cohesion_coupling_analysis(self.report)
+        with self.LLM.metrics.scope(phase="coupling", target=self.report[0]["name"]):
+            response = self.LLM.generate_cohesion_coupling_analysis(self.report)
         self.report[1]["coupling"] = response["coupling"]
         self.report[1]["cohesion"] = response["cohesion"]
         self.report[1]["explanation"] = response["explanation"]
 
     def save_report(self):
         """
-            Saves the report in the outputs folder.
+            Saves the report in the outputs folder, as a timestamped snapshot and as the final report
+            read by the front end.
 
             Args:
             ------
@@ -367,14 +685,11 @@ class Report:
                 None
         """
         print("Saving report...")
-        with open(
-                f"{OUTPUTS_PATH}reports/filesreport_{self.project_path.split('/')[-1]}_{datetime.now().strftime('%m_%d_%H_%M')}.json",
-                "w") as f:
-            json.dump(self.report, f, indent=4)
-
-        with open(f"{OUTPUTS_PATH}reports/finalreport.json", "w") as f:
-            json.dump(self.report, f, indent=4)
-
+        self.writer.save(
+            self.report,
+            f"{OUTPUTS_PATH}reports/filesreport_{self.project_path.split('/')[-1]}_{datetime.now().strftime('%m_%d_%H_%M')}.json",
+            f"{OUTPUTS_PATH}reports/finalreport.json"
+        )
 
 if __name__ == "__main__":
     report = Report(f"{PROJECTS_PATH}Arquitectura")
@@ -0,0 +1,208 @@
+import os
+import json
+import gzip
+import shutil
+from dotenv import load_dotenv
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# some important enviroment variables
+load_dotenv()
+REPORT_COMPRESSION = os.getenv("REPORT_COMPRESSION", "none").lower()
+
+
+class ReportWriter:
+
+    """
+        This class writes the reports as compact json, streaming them to disk in small chunks instead of
+        building the whole json string in memory. The json is produced iteratively, so reports of very deep
+        project trees don't hit the recursion limit either.
+
+        A report is written once to its timestamped snapshot, and 'finalreport.json' is published as a hardlink
+        to it, replaced atomically so the front end never reads a half written report. When the snapshots are
+        compressed (gzip, or brotli if it's installed), 'finalreport.json' is written uncompressed on its own,
+        since the front end reads it as plain json.
+
+        Class Attributes:
+            compressions: The supported compressions and the extension they add to the snapshots.
+            chunk_size: The size in characters of the chunks written to disk.
+
+        Attributes:
+            compression: The compression of the snapshots.
+
+        Methods:
+            iterencode: Yields the compact json of a value in small pieces.
+            write: Writes a value as compact json to a file, atomically.
+            save: Writes the snapshot of a report and publishes it as the final report.
+            publish: Replaces a file atomically with a hardlink to another one.
+    """
+
+    compressions = {"none": "", "gzip": ".gz", "brotli": ".br"}
+    chunk_size = 64 * 1024
+
+    def __init__(self, compression: str = REPORT_COMPRESSION) -> None:
+        if compression not in ReportWriter.compressions:
+            raise ValueError(f"Unknown compression '{compression}', the supported ones are {tuple(ReportWriter.compressions)}")
+        if compression == "brotli" and brotli is None:
+            raise ImportError("The 'brotli' compression needs brotli, install it with 'pip install brotli'")
+        self.compression : str = compression
+
+    @staticmethod
+    def iterencode(value):
+        """
+            Yields the compact json of a value in small pieces. The containers are walked with a stack
+            instead of recursively, the lists of scalars (like the dependencies) are encoded at once.
+
+            Args:
+            ----------
+            value: Any
+                The json serializable value.
+
+            Returns:
+            ----------
+            Iterator[str]
+                The pieces of the json.
+        """
+        # the stack holds (is a raw piece of json, item) pairs, in reverse order
+        stack = [(False, value)]
+        while stack:
+            raw, item = stack.pop()
+            if raw:
+                yield item
+            elif isinstance(item, dict) and item:
+                pieces = [(True, "}")]
+                for index, (key, child) in enumerate(reversed(item.items())):
+                    pieces.append((False, child))
+                    pieces.append((True, ("," if index < len(item) - 1 else "") + json.dumps(str(key)) + ":"))
+                yield "{"
+                stack.extend(pieces)
+            elif isinstance(item, list) and any(isinstance(child, (dict, list)) for child in item):
+                pieces = [(True, "]")]
+                for index, child in enumerate(reversed(item)):
+                    pieces.append((False, child))
+                    if index < len(item) - 1:
+                        pieces.append((True, ","))
+                yield "["
+                stack.extend(pieces)
+            else:
+                yield json.dumps(item, separators=(",", ":"))
+
+    def write(self, value, path: str, compression: str = "none") -> None:
+        """
+            Writes a value as compact json to a file. The json is written to a temporary file first and then
+            renamed, so the file is replaced atomically.
+
+            Args:
+            ----------
+            value: Any
+                The json serializable value.
+            path: str
+                The path of the file.
+            compression: str
+                The compression of the file.
+
+            Returns:
+            ----------
+            None
+        """
+        tmp_path = f"{path}.tmp"
+        if compression == "gzip":
+            f = gzip.open(tmp_path, "wt", encoding="utf-8")
+        else:
+            f = open(tmp_path, "w" if compression == "none" else "wb")
+        compressor = brotli.Compressor() if compression == "brotli" else None
+
+        with f:
+            chunk = []
+            chunk_lenght = 0
+            for piece in self.iterencode(value):
+                chunk.append(piece)
+                chunk_lenght += len(piece)
+                if chunk_lenght >= ReportWriter.chunk_size:
+                    self.write_chunk(f, "".join(chunk), compressor)
+                    chunk = []
+                    chunk_lenght = 0
+            self.write_chunk(f, "".join(chunk), compressor)
+            if compressor is not None:
+                f.write(compressor.finish())
+
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def write_chunk(f, chunk: str, compressor=None) -> None:
+        """
+            Writes a chunk of json to a file, through the compressor if there is one.
+
+            Args:
+            ----------
+            f: file
+                The open file.
+            chunk: str
+                The chunk of json.
+            compressor: brotli.Compressor
+                The brotli compressor, if the file is compressed with brotli.
+
+            Returns:
+            ----------
+            None
+        """
+        if compressor is None:
+            f.write(chunk)
+        else:
+            f.write(compressor.process(chunk.encode("utf-8")))
+
+    def save(self, report, snapshot_path: str, final_path: str) -> str:
+        """
+            Writes the snapshot of a report and publishes it as the final report. Uncompressed, the report
+            is written once and the final report is a hardlink to the snapshot.
+
+            Args:
+            ----------
+            report: Any
+                The report.
+            snapshot_path: str
+                The path of the snapshot, the extension of the compression is added to it.
+            final_path: str
+                The path of the final report.
+
+            Returns:
+            ----------
+            str
+                The path of the snapshot.
+        """
+        snapshot_path += ReportWriter.compressions[self.compression]
+        self.write(report, snapshot_path, self.compression)
+        if self.compression == "none":
+            self.publish(snapshot_path, final_path)
+        else:
+            self.write(report, final_path)
+        return snapshot_path
+
+    @staticmethod
+    def publish(source_path: str, path: str) -> None:
+        """
+            Replaces a file atomically with a hardlink to another one, if the file system doesn't
+            support hardlinks the file is copied instead.
+
+            Args:
+            ----------
+            source_path: str
+                The path of the file to publish.
+            path: str
+                The path where it is published.
+
+            Returns:
+            ----------
+            None
+        """
+        tmp_path = f"{path}.tmp"
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            os.link(source_path, tmp_path)
+        except OSError:
+            shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, path)
@@ -0,0 +1,241 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# some important enviroment variables
+load_dotenv()
+OUTPUTS_PATH = os.getenv("OUTPUTS_PATH")
+CACHE_PATH = os.getenv("CACHE_PATH", f"{OUTPUTS_PATH}cache/")
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", 256 * 1024 * 1024))
+
+
+class ResponseCache:
+
+    """
+        This class is a persistent, content-addressed cache for the analyses produced by the LLM.
+        Every entry is stored as its own json file named after its key, and an index file keeps
+        the entries in least recently used order so the cache can be bounded in size.
+        The cache can be shared by several threads analyzing files concurrently.
+
+        The entries are written atomically, and the index is only saved at the end of a run, so
+        when the cache is loaded the entry files missing from the index (written by an interrupted
+        run) are added back to it as the most recently used ones.
+
+        Attributes:
+            cache_path: The folder where the entries and the index are stored.
+            max_size: The maximum size in bytes of all the entries together.
+            index: The entries of the cache (key -> size in bytes), from least to most recently used.
+            size: The current size in bytes of all the entries together.
+            stats: The hits, misses, writes and evictions since the cache was loaded.
+            lock: The lock guarding the index, the size and the stats.
+
+        Methods:
+            get: Returns the cached value for a key, if any.
+            set: Stores a value for a key, evicting the least recently used entries if needed.
+            evict: Removes the least recently used entries until the cache fits in max_size.
+            load_index: Loads the index of the cache from disk.
+            save_index: Saves the index of the cache to disk.
+            summary: Returns a human readable summary of the cache stats.
+    """
+
+    index_filename = "index.json"
+
+    def __init__(self, cache_path: str = CACHE_PATH, max_size: int = CACHE_MAX_SIZE) -> None:
+        self.cache_path : str = cache_path
+        self.max_size : int = max_size
+        self.index : OrderedDict[str, int] = OrderedDict()
+        self.size : int = 0
+        self.stats : dict[str, int] = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self.lock : threading.Lock = threading.Lock()
+
+        os.makedirs(self.cache_path, exist_ok=True)
+        self.load_index()
+
+    def entry_path(self, key: str) -> str:
+        """
+            Returns the path of the file which stores the entry for the given key.
+
+            Args:
+            ----------
+            key: str
+                The key of the entry.
+
+            Returns:
+            ----------
+            str
+                The path of the entry file.
+        """
+        return os.path.join(self.cache_path, f"{key}.json")
+
+    def get(self, key: str) -> dict:
+        """
+            Returns the cached value for the given key, if the key is not in the
+            cache (or its file is gone) returns None.
+
+            Args:
+            ----------
+            key: str
+                The key of the entry.
+
+            Returns:
+            ----------
+            dict
+                The cached value, or None.
+        """
+        with self.lock:
+            if key not in self.index:
+                self.stats["misses"] += 1
+                return None
+
+            try:
+                with open(self.entry_path(key), "r") as f:
+                    value = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                self.size -= self.index.pop(key)
+                self.stats["misses"] += 1
+                return None
+
+            self.index.move_to_end(key)
+            self.stats["hits"] += 1
+            return value
+
+    def set(self, key: str, value: dict) -> None:
+        """
+            Stores the value for the given key, then evicts the least recently used
+            entries if the cache grew bigger than max_size.
+
+            Args:
+            ----------
+            key: str
+                The key of the entry.
+            value: dict
+                The json serializable value to store.
+
+            Returns:
+            ----------
+            None
+        """
+        content = json.dumps(value)
+        with self.lock:
+            # written to a temporary file first, so an interrupted run never leaves a half written entry
+            entry_path = self.entry_path(key)
+            with open(f"{entry_path}.tmp", "w") as f:
+                f.write(content)
+            os.replace(f"{entry_path}.tmp", entry_path)
+
+            if key in self.index:
+                self.size -= self.index[key]
+            self.index[key] = len(content)
+            self.index.move_to_end(key)
+            self.size += self.index[key]
+            self.stats["writes"] += 1
+
+            self.evict()
+
+    def evict(self) -> None:
+        """
+            Removes the least recently used entries until the cache fits in max_size.
+            The caller must hold the lock (or be the only user of the cache).
+
+            Args:
+            ----------
+            None
+
+            Returns:
+            ----------
+            None
+        """
+        while self.size > self.max_size and self.index:
+            key, size = self.index.popitem(last=False)
+            self.size -= size
+            self.stats["evictions"] += 1
+            try:
+                os.remove(self.entry_path(key))
+            except FileNotFoundError:
+                pass
+
+    def load_index(self) -> None:
+        """
+            Loads the index of the cache from disk, entries whose file no longer exists are dropped.
+            The entry files that are not in the index, because the run that wrote them was interrupted
+            before saving it, are added as the most recently used entries, in the order they were written.
+
+            Args:
+            ----------
+            None
+
+            Returns:
+            ----------
+            None
+        """
+        index_path = os.path.join(self.cache_path, self.index_filename)
+        entries = []
+        try:
+            with open(index_path, "r") as f:
+                entries = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            pass
+
+        for key, size in entries:
+            if os.path.exists(self.entry_path(key)):
+                self.index[key] = size
+                self.size += size
+
+        unindexed = []
+        with os.scandir(self.cache_path) as files:
+            for entry in files:
+                if entry.name.endswith(".tmp"):
+                    # left behind by an interrupted write
+                    os.remove(entry.path)
+                    continue
+                key = entry.name[:-len(".json")]
+                if entry.name.endswith(".json") and entry.name != self.index_filename and key not in self.index:
+                    stat = entry.stat()
+                    unindexed.append((stat.st_mtime, key, stat.st_size))
+
+        for _, key, size in sorted(unindexed):
+            self.index[key] = size
+            self.size += size
+
+        self.evict()
+
+    def save_index(self) -> None:
+        """
+            Saves the index of the cache to disk, the index is written to a temporary file first
+            so an interrupted run never leaves a corrupted index behind.
+
+            Args:
+            ----------
+            None
+
+            Returns:
+            ----------
+            None
+        """
+        index_path = os.path.join(self.cache_path, self.index_filename)
+        with self.lock:
+            entries = list(self.index.items())
+        with open(f"{index_path}.tmp", "w") as f:
+            json.dump(entries, f)
+        os.replace(f"{index_path}.tmp", index_path)
+
+    def summary(self) -> str:
+        """
+            Returns a human readable summary of the cache stats.
+
+            Args:
+            ----------
+            None
+
+            Returns:
+            ----------
+            str
+                The summary of the cache stats.
+        """
+        lookups = self.stats["hits"] + self.stats["misses"]
+        hit_rate = 100 * self.stats["hits"] / lookups if lookups else 0
+        return (f"Cache: {self.stats['hits']} hits, {self.stats['misses']} misses ({hit_rate:.1f}% hit rate), "
+                f"{self.stats['writes']} writes, {self.stats['evictions']} evictions, "
+                f"{len(self.index)} entries ({self.size / 1024:.1f} KB)")
@@ -0,0 +1,214 @@
+import re
+import json
+
+
+class ResponseValidator:
+
+    """
+        This class validates and repairs the json responses of the model locally, so most
+        responses don't need to be sent back to the model to be fixed.
+
+        The responses of the file analyses must follow the schema:
+
+            {"dependencies": [str, ...], "explanation": str}
+
+        Class Attributes:
+            schema: The fields of a valid response and their types.
+            file_extension: The regex of a file extension at the end of a dependency.
+
+        Methods:
+            parse: Parses a json response, repairing it if needed.
+            repair: Repairs the most common errors of json responses.
+            validate: Checks a parsed response against the schema.
+            normalize_dependency: Normalizes the separators and extension of a dependency.
+            check: Parses, validates and normalizes a response.
+    """
+
+    schema = {"dependencies": list, "explanation": str}
+    file_extension = re.compile(r"\.(py|pyw|pyi|js|jsx|ts|tsx|go|java|rb|rs|c|h|cpp|hpp|cs|php|kt|scala|swift)$")
+
+    @staticmethod
+    def parse(response: str) -> dict:
+        """
+            Parses a json response, if it's not valid json it is repaired first.
+            If the response can't be repaired returns None.
+
+            Args:
+            ----------
+            response: str
+                The response of the model.
+
+            Returns:
+            ----------
+            dict
+                The parsed response, or None.
+        """
+        try:
+            return json.loads(response)
+        except json.JSONDecodeError:
+            pass
+
+        try:
+            return json.loads(ResponseValidator.repair(response))
+        except json.JSONDecodeError:
+            return None
+
+    @staticmethod
+    def repair(response: str) -> str:
+        """
+            Repairs the most common errors of the json responses: text or code fences around
+            the json, trailing commas, and truncated responses (unterminated strings, missing
+            closing brackets and braces).
+
+            Args:
+            ----------
+            response: str
+                The response of the model.
+
+            Returns:
+            ----------
+            str
+                The repaired response.
+        """
+        start = response.find("{")
+        if start == -1:
+            return response
+        end = response.rfind("}")
+        response = response[start:end + 1] if end > start else response[start:]
+
+        # walk the json keeping track of the open strings, brackets and braces. Every open container is
+        # [closer, state, start of its last member], the state of an object is what it expects next:
+        # a 'key', the 'colon' after a key or the 'value' after a colon
+        out = []
+        containers = []
+        in_string = False
+        is_key = False
+        escaped = False
+        comma = None
+        comma_at = None
+        colon_at = None
+        for char in response:
+            if in_string:
+                out.append(char)
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+                    if is_key:
+                        containers[-1][1] = "colon"
+                continue
+
+            if comma is not None:
+                if char.isspace():
+                    comma += char
+                    continue
+                # the trailing commas before closing brackets and braces are removed
+                if char not in "}]":
+                    comma_at = len(out)
+                    out.append(comma)
+                comma = None
+
+            if char == ",":
+                comma = char
+                if containers and containers[-1][0] == "}":
+                    containers[-1][1] = "key"
+                continue
+
+            member_start = comma_at if comma_at is not None else len(out)
+            comma_at = None
+            out.append(char)
+            if char == '"':
+                in_string = True
+                is_key = bool(containers) and containers[-1][0] == "}" and containers[-1][1] == "key"
+                if is_key:
+                    containers[-1][2] = member_start
+            elif char == ":" and containers and containers[-1][0] == "}":
+                containers[-1][1] = "value"
+                colon_at = len(out)
+            elif char in "{[":
+                containers.append(["}" if char == "{" else "]", "key", len(out)])
+            elif char in "}]" and containers:
+                containers.pop()
+
+        # a truncated response may end in the middle of a key value pair, which is dropped,
+        # but a truncated value string is kept and closed
+        if containers and containers[-1][0] == "}":
+            closer, state, member_start = containers[-1]
+            dangling_value = state == "value" and not "".join(out[colon_at:]).strip()
+            if (in_string and is_key) or state == "colon" or dangling_value:
+                del out[member_start:]
+                in_string = False
+        if in_string:
+            out.append('"')
+
+        return "".join(out).rstrip() + "".join(reversed([closer for closer, _, _ in containers]))
+
+    @staticmethod
+    def validate(response: dict) -> bool:
+        """
+            Checks that the parsed response follows the schema.
+
+            Args:
+            ----------
+            response: dict
+                The parsed response.
+
+            Returns:
+            ----------
+            bool
+                Whether the response is valid.
+        """
+        if not isinstance(response, dict):
+            return False
+        for field, field_type in ResponseValidator.schema.items():
+            if not isinstance(response.get(field), field_type):
+                return False
+        return all(isinstance(dependency, str) for dependency in response["dependencies"])
+
+    @staticmethod
+    def normalize_dependency(dependency: str) -> str:
+        """
+            Normalizes a dependency to the '(int or ext)/lib/sub_lib' form: the file extension is
+            removed and the '#' and '.' separators are replaced by '/'.
+            For example 'ext#matplotlib.pyplot' becomes 'ext/matplotlib/pyplot' and
+            'int/lib/module.py' becomes 'int/lib/module'.
+
+            Args:
+            ----------
+            dependency: str
+                The dependency to normalize.
+
+            Returns:
+            ----------
+            str
+                The normalized dependency.
+        """
+        dependency = ResponseValidator.file_extension.sub("", dependency.strip())
+        return re.sub(r"[#.]", "/", dependency).strip("/")
+
+    @staticmethod
+    def check(response: str) -> dict:
+        """
+            Parses, validates and normalizes a response of a file analysis.
+            If the response can't be repaired or doesn't follow the schema returns None.
+
+            Args:
+            ----------
+            response: str
+                The response of the model.
+
+            Returns:
+            ----------
+            dict
+                The checked response, or None.
+        """
+        response_json = ResponseValidator.parse(response)
+        if not ResponseValidator.validate(response_json):
+            return None
+
+        response_json["dependencies"] = list(dict.fromkeys(
+            ResponseValidator.normalize_dependency(dependency) for dependency in response_json["dependencies"]
+        ))
+        return response_json
@@ -0,0 +1,281 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+
+from FakeOpenAIServer import FakeOpenAIServer
+
+SRC_PATH = os.path.dirname(os.path.abspath(__file__))
+TESTING_PROJECTS_PATH = os.path.join(SRC_PATH, "..", "testing_projects")
+DEFAULT_PROJECTS = ["Arquitectura", "simpleModuleWithScreenRawMaticas"]
+DEFAULT_SYNTHETIC_SIZES = [1000, 10000, 50000]
+
+
+def generate_synthetic_project(project_path: str, files: int, seed: int = 0) -> None:
+    """
+        Generates a python project with the given number of files, in packages of 50 modules grouped
+        in folders of 50 packages. Every module imports a few others, so the dependencies are resolved too.
+        The project is the same for the same size and seed, and it is only generated once.
+
+        Args:
+        ----------
+        project_path: str
+            The path of the project.
+        files: int
+            The number of files of the project.
+        seed: int
+            The seed of the imports.
+
+        Returns:
+        ----------
+        None
+    """
+    marker_path = os.path.join(project_path, ".generated")
+    if os.path.exists(marker_path):
+        return
+
+    generator = random.Random(seed)
+    modules = [f"group_{index // 2500}/package_{index // 50 % 50}/module_{index}" for index in range(files)]
+    for index, module in enumerate(modules):
+        imports = "\n".join(f"from {other.replace('/', '.')} import Model{other.rsplit('_', 1)[1]}"
+                            for other in generator.sample(modules, min(3, files)) if other != module)
+        os.makedirs(os.path.join(project_path, os.path.dirname(module)), exist_ok=True)
+        with open(os.path.join(project_path, f"{module}.py"), "w") as f:
+            f.write(f'''import os
+import json
+{imports}
+
+
+class Model{index}:
+    """
+        A synthetic model of the benchmark project.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.data = {{}}
+
+    def load(self) -> dict:
+        with open(os.path.join(self.path, "model_{index}.json")) as f:
+            self.data = json.load(f)
+        return self.data
+
+    def total(self) -> int:
+        return sum(value for value in self.data.values() if isinstance(value, int))
+
+
+def build_model_{index}(path: str) -> Model{index}:
+    model = Model{index}(path)
+    model.load()
+    return model
+''')
+
+    with open(marker_path, "w") as f:
+        f.write(str(files))
+
+
+def run_one(project_path: str, max_workers: int, result_path: str) -> None:
+    """
+        Runs the whole report of a project and writes its wall time, calls, tokens and peak RSS as json.
+        It runs in its own process, started by 'run_project', so the peak RSS is only of this project
+        and the environment (like OPENAI_API_BASE) is read by the modules when they are imported.
+
+        Args:
+        ----------
+        project_path: str
+            The path of the project.
+        max_workers: int
+            The maximum number of files analyzed concurrently.
+        result_path: str
+            The path of the json with the results.
+
+        Returns:
+        ----------
+        None
+    """
+    from Report import Report
+
+    start = time.perf_counter()
+    report = Report(project_path, max_workers=max_workers)
+    scanned = time.perf_counter()
+    report.complete_report()
+    end = time.perf_counter()
+
+    totals = report.LLM.metrics.to_dict()["totals"]
+    result = {
+        "files": len(report.project_files),
+        "directories": report.report[1]["directories"],
+        "wall_time": round(end - start, 3),
+        "scan_time": round(scanned - start, 3),
+        "calls": totals.get("calls", 0),
+        "prompt_tokens": totals.get("prompt_tokens", 0),
+        "completion_tokens": totals.get("completion_tokens", 0),
+        "retries": totals.get("retry", 0),
+        "errors": totals.get("error", 0),
+        # kilobytes on linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    with open(result_path, "w") as f:
+        json.dump(result, f)
+
+
+def run_project(name: str, project_path: str, args: argparse.Namespace, server: FakeOpenAIServer) -> dict:
+    """
+        Runs the report of a project in a new process against the fake server, with empty outputs
+        and cache folders so every run starts cold.
+
+        Args:
+        ----------
+        name: str
+            The name of the project in the results.
+        project_path: str
+            The path of the project.
+        args: argparse.Namespace
+            The arguments of the benchmark.
+        server: FakeOpenAIServer
+            The running fake server.
+
+        Returns:
+        ----------
+        dict
+            The results of the run.
+    """
+    outputs_path = tempfile.mkdtemp(prefix=f"outputs_{name}_", dir=args.work_dir)
+    os.makedirs(os.path.join(outputs_path, "reports"))
+    result_path = os.path.join(outputs_path, "benchmark_result.json")
+
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_BASE": server.url(),
+        "OPEN_AI_API_KEY": env.get("OPEN_AI_API_KEY") or "fake-key",
+        "DEFAULT_LLM": env.get("DEFAULT_LLM") or "gpt-3.5-turbo-16k",
+        "LLM_BACKEND": "openai",
+        "OUTPUTS_PATH": outputs_path + "/",
+        "CACHE_PATH": os.path.join(outputs_path, "cache") + "/",
+        "CHECKPOINT_PATH": os.path.join(outputs_path, "checkpoints") + "/",
+        "REQUESTS_PER_MINUTE": str(args.requests_per_minute),
+        "TOKENS_PER_MINUTE": str(args.tokens_per_minute),
+    })
+
+    server.reset_stats()
+    print(f"Benchmarking {name}...")
+    process = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run-one", os.path.abspath(project_path),
+         "--workers", str(args.workers), "--result", result_path],
+        env=env, cwd=SRC_PATH,
+        stdout=None if args.verbose else subprocess.DEVNULL,
+    )
+    if process.returncode != 0:
+        return {"project": name, "failed": process.returncode}
+
+    with open(result_path, "r") as f:
+        result = json.load(f)
+    result = {"project": name, **result,
+              "files_per_second": round(result["files"] / result["wall_time"], 2) if result["wall_time"] else 0,
+              "injected_rate_limits": server.stats["rate_limited"], "injected_errors": server.stats["errors"]}
+    return result
+
+
+def print_results(results: list[dict]) -> None:
+    """
+        Prints the results of the benchmark as a table.
+
+        Args:
+        ----------
+        results: list[dict]
+            The results of the runs.
+
+        Returns:
+        ----------
+        None
+    """
+    header = (f"{'project':<34}{'files':>7}{'wall s':>9}{'files/s':>9}{'calls':>8}{'prompt tok':>12}"
+              f"{'compl. tok':>12}{'retries':>9}{'peak RSS MB':>13}")
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        if "failed" in result:
+            print(f"{result['project'][:33]:<34}failed with exit code {result['failed']}")
+            continue
+        print(f"{result['project'][:33]:<34}{result['files']:>7}{result['wall_time']:>9.2f}{result['files_per_second']:>9.2f}"
+              f"{result['calls']:>8}{result['prompt_tokens']:>12}{result['completion_tokens']:>12}"
+              f"{result['retries']:>9}{result['peak_rss_mb']:>13.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the report of projects against a local fake OpenAI server")
+    parser.add_argument("--projects", nargs="*", default=DEFAULT_PROJECTS,
+                        help="the projects to benchmark, by name in testing_projects or by path")
+    parser.add_argument("--synthetic", nargs="*", type=int, default=DEFAULT_SYNTHETIC_SIZES,
+                        help="the number of files of the synthetic projects to benchmark")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("MAX_WORKERS", 4)),
+                        help="the maximum number of files analyzed concurrently")
+    parser.add_argument("--latency", type=float, default=0.05, help="the median latency of the responses in seconds")
+    parser.add_argument("--latency-spread", type=float, default=0.5,
+                        help="the sigma of the log-normal latency, 0 makes it constant")
+    parser.add_argument("--rate-limit-rate", type=float, default=0, help="the share of requests answered with a 429")
+    parser.add_argument("--error-rate", type=float, default=0, help="the share of requests answered with a 503")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="the seconds to wait asked by the 429s")
+    parser.add_argument("--completion-tokens", type=int, default=200, help="the approximate tokens of every response")
+    parser.add_argument("--responses", help="a json file with a list of canned responses, every prompt gets the one picked by its hash")
+    parser.add_argument("--requests-per-minute", type=int, default=1000000,
+                        help="the requests per minute budget, by default high enough to not limit the run")
+    parser.add_argument("--tokens-per-minute", type=int, default=1000000000,
+                        help="the tokens per minute budget, by default high enough to not limit the run")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the fake server and the synthetic projects")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "snoo-benchmark"),
+                        help="the folder of the synthetic projects and the outputs of the runs")
+    parser.add_argument("--output", help="the json file where the results are saved, by default in the work dir")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the runs")
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        run_one(args.run_one, args.workers, args.result)
+        return
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    responses = None
+    if args.responses:
+        with open(args.responses, "r") as f:
+            responses = [response if isinstance(response, str) else json.dumps(response) for response in json.load(f)]
+
+    server = FakeOpenAIServer(latency=args.latency, latency_spread=args.latency_spread,
+                              rate_limit_rate=args.rate_limit_rate, error_rate=args.error_rate,
+                              retry_after=args.retry_after, responses=responses,
+                              completion_tokens=args.completion_tokens, seed=args.seed)
+    server.start()
+
+    projects = []
+    for project in args.projects:
+        path = project if os.path.isdir(project) else os.path.join(TESTING_PROJECTS_PATH, project)
+        projects.append((os.path.basename(os.path.normpath(path)), path))
+    for files in args.synthetic:
+        path = os.path.join(args.work_dir, f"synthetic_{files}")
+        print(f"Generating a synthetic project of {files} files...")
+        generate_synthetic_project(path, files, args.seed)
+        projects.append((f"synthetic_{files}", path))
+
+    results = []
+    try:
+        for name, path in projects:
+            results.append(run_project(name, path, args, server))
+    finally:
+        server.stop()
+
+    print_results(results)
+    output_path = args.output or os.path.join(args.work_dir, f"benchmark_{time.strftime('%Y_%m_%d_%H_%M')}.json")
+    with open(output_path, "w") as f:
+        json.dump({"settings": {key: value for key, value in vars(args).items() if key not in ("run_one", "result")},
+                   "results": results}, f, indent=4)
+    print(f"Results saved to {output_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,10 +2,19 @@ import os
 import json
 import tiktoken
 from hashlib import sha256
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
 
 load_dotenv()
 OUTPUTS_PATH = os.getenv("OUTPUTS_PATH")
+TREE_CONTEXT_MAX_TOKENS = int(os.getenv("TREE_CONTEXT_MAX_TOKENS", 1000))
+DIRECTORY_CONTEXT_MAX_TOKENS = int(os.getenv("DIRECTORY_CONTEXT_MAX_TOKENS", 2000))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 4096))
+
+# bump this whenever the templates change, so the cached responses produced
+# with the previous templates are not reused
+PROMPT_VERSION = "4"
 
 
 class PromptHandler:
@@ -14,26 +23,48 @@ class PromptHandler:
 
         Class Attributes:
             outputs_path (str): The outputs path.
+            encodings (dict): The tiktoken encoding of every model used, by model name.
+            template_token_lenghts (dict): The token lenght of the templates, by (template number, encoding name, template hash),
+                                           shared by all the prompt handlers so a template is only tokenized once per encoding.
+            token_counts (OrderedDict): The token counts of the last TOKEN_CACHE_SIZE texts, by (encoding name, sha256 of the text).
+            token_counts_lock (threading.Lock): The lock guarding the token counts.
 
         Attributes:
             model_name (str): The model name.
             encoding (tiktoken.Encoding): The encoding for the model.
-            prompts (dict): The prompts for the LLM.
-            longest_prompt_lenght (int): The longest prompt lenght for all the prompts.
+            prompts (dict): The prompts for the LLM, 'json_output' tells whether the template asks for a json response.
+            longest_prompt_lenght (int): The longest prompt lenght for all the prompts, without the tree context.
+            tree_context_max_tokens (int): The maximum token lenght of the tree context of a file.
+            directory_context_max_tokens (int): The maximum token lenght of the contents of a directory sent to be explained.
+            root_name (str): The name of the root folder of the project tree.
+            path_index (dict): The children of every folder of the project tree, by the path of the folder.
+            module_paths (dict): The path of every file and folder of the project tree, by its path without the '.py' extension of python files.
 
         Methods:
 
             - load_initial_filesreport: Loads the initial files report.
+            - set_project_tree: Builds the path index of the project tree.
+            - get_tree_context: Returns the part of the project tree relevant to a file.
+            - get_folder_listing: Returns the names of the files and folders next to a file.
+            - render_tree: Renders some paths of the project tree like the 'tree' command.
+            - compact_directory: Returns the contents of a directory as a compact json within a token budget.
+            - truncate: Truncates a text to a number of tokens.
             - set_largest_prompt_token_lenght: Sets the largest prompt token lenght for all the templates.
             - set_model: Sets the model name and encoding for the prompt handler.
             - get_raw_template: Returns the raw prompt for the given template.
             - get_prompt: Returns the prompt for the given template, if the template has input variables, they must be passed as kwargs.
             - get_prompt_token_lenght: Returns the prompt token lenght for the given prompt.
+            - count_tokens: Counts the tokens of a text, the counts of the last TOKEN_CACHE_SIZE texts are kept by hash.
+            - get_cache_key: Returns the content-addressed cache key for running a template over some code.
             - set_token_lenght: Sets the token lenght for all the templates using the current model encoding.
             - white_spaced_template: Returns the template with all the input variables replaced by an empty string.
     """
 
     projects_path = ''
+    encodings = {}
+    template_token_lenghts = {}
+    token_counts = OrderedDict()
+    token_counts_lock = threading.Lock()
 
     def __init__(self, model_name: str):
         self.initial_files_report: str = None
@@ -41,8 +72,8 @@ class PromptHandler:
 
         self.prompts = {0: {"template": """Identify which dependencies the file uses and do a brief explanation of what the file contains.
                                            Context we have this tree files:
-                                            {}
-                                """.format(self.initial_files_report) +
+                                            {tree}
+                                """ +
                                 """                          
                                 You must return a json with this fields:
                                     "dependencies": [list of dependencies names, external libraries as 'ext/library' and internal
@@ -86,14 +117,15 @@ class PromptHandler:
                                  Think on your response, if for example you have 'from yada.yada.yodo import yuda' don't write
                                  'yada.yada.yodo' as dependency, write 'yada/yada/yodo', 'yada.yada.yodo' is wrong. 
                                  YOUR JSON RESPONSE GOES HERE:""",
-                            "input_variables": ["code", ],
-                            "prompt_token_lenght": -1
+                            "input_variables": ["code", "tree", ],
+                            "prompt_token_lenght": -1,
+                            "json_output": True
                             },
                         1: {"template": """Given this new fragment of code of a bigger file, identify which dependencies the file uses and do
                                            a brief explanation of what the file contains. 
                                            Context we have this tree files:
-                                           {}
-                                """.format(self.initial_files_report) +
+                                           {tree}
+                                """ +
                                 """
                                 You must return a json with this fields:
                                     "dependencies": [list of dependencies names, external libraries as 'ext/library' and internal
@@ -135,8 +167,9 @@ class PromptHandler:
                                     {code}
                                             
                                     YOUR JSON RESPONSE GOES HERE:""",
-                            "input_variables": ["code", ],
-                            "prompt_token_lenght": -1
+                            "input_variables": ["code", "tree", ],
+                            "prompt_token_lenght": -1,
+                            "json_output": True
                             },
                         2: {"template": """Now that you have identified the dependencies and the explanation of the file in different
                                            json chunks, you must unify the dependencies and explanations in a single json file.
@@ -162,7 +195,8 @@ class PromptHandler:
                                             
                                            YOUR JSON RESPONSE GOES HERE: """,
                             "input_variables": ["json_reports", ],
-                            "prompt_token_lenght": -1
+                            "prompt_token_lenght": -1,
+                            "json_output": True
                             },
                         3: {"template": """Given this python analysis file of a project, identify the level of coupling in the project and
                                            the level of cohesion in the project. You must explain your answer, the reason why you think
@@ -178,7 +212,8 @@ class PromptHandler:
 
                                             JSON GOES HERE: """,
                             "input_variables": ["json_reports", ],
-                            "prompt_token_lenght": -1
+                            "prompt_token_lenght": -1,
+                            "json_output": True
                             }, 
                          4: {"template": """You've been given a json with the fields 'dependencies' and 'explanation', your
                                             work is to correct the json response if needed and return it, you only have to change
@@ -214,7 +249,7 @@ class PromptHandler:
 
 
                                             The file tree is:
-                                            {}""".format(self.initial_files_report) + """
+                                            {tree}""" + """
 
                                             Think on your response, if for example you have 'from yada.yada.yodo import yuda' don't write
                                             'yada.yada.yodo' as dependency, write 'yada/yada/yodo', 'yada.yada.yodo' is wrong. 
@@ -226,11 +261,12 @@ class PromptHandler:
                                             to the correct form, delete the '.file_extension' part. 
 
                                             JSON GOES HERE: \n {json_reports}""",
-                                            "input_variables": ["json_reports", ],
-                                            "prompt_token_lenght": -1
+                                            "input_variables": ["json_reports", "tree", ],
+                                            "prompt_token_lenght": -1,
+                                            "json_output": True
                          },
-                         5: {"template": """You've been given a json file with fields 'dependencies' and 'explanation' for a folder in a project,
-                                            your task is to retrieve an explanation this is what the 'explanation' should look like:
+                         5: {"template": """You've been given a json list with the name, the type and a short 'explanation' of every file and
+                                            folder inside a folder in a project, your task is to retrieve an explanation this is what the 'explanation' should look like:
                              
                                             "explanation": 'short folder explanation condensing the logic, purpose and explanations of all the 
                                             files inside the folder, including other folders inside the json. Infer behavior from file names and
@@ -243,11 +279,17 @@ class PromptHandler:
                                             'explanation':
                                             """,    
                              "input_variables": ["json_reports", ],
-                             "prompt_token_lenght": -1
+                             "prompt_token_lenght": -1,
+                             "json_output": False
                          }
                         }
 
         self.longest_prompt_lenght = -1
+        self.tree_context_max_tokens: int = TREE_CONTEXT_MAX_TOKENS
+        self.directory_context_max_tokens: int = DIRECTORY_CONTEXT_MAX_TOKENS
+        self.root_name: str = None
+        self.path_index: dict[str, list[str]] = None
+        self.module_paths: dict[str, str] = None
         self.set_model(model_name=model_name)
         self.set_largest_prompt_token_lenght()
 
@@ -302,14 +344,20 @@ class PromptHandler:
                 None
         """
         self.model_name = model_name
-        self.encoding = tiktoken.encoding_for_model(self.model_name)
+        if model_name not in PromptHandler.encodings:
+            try:
+                PromptHandler.encodings[model_name] = tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                # models unknown to tiktoken (like local models) are estimated with the encoding of the OpenAI chat models
+                PromptHandler.encodings[model_name] = tiktoken.get_encoding("cl100k_base")
+        self.encoding = PromptHandler.encodings[model_name]
         self.set_token_lenght()
 
     def set_token_lenght(self) -> None:
         """
             Sets the token lenght for all the templates using the current model encoding.
             For that the function assumes that the inputs needed for the templates are
-            empty strings.
+            empty strings. A template is only tokenized the first time it is seen with an encoding.
 
             Args:
             ---------
@@ -322,7 +370,10 @@ class PromptHandler:
 
         for template in self.prompts:
             white_spaced_template = self.white_spaced_template(template=template)
-            self.prompts[template]["prompt_token_lenght"] = len(self.encoding.encode(white_spaced_template))
+            key = (template, self.encoding.name, sha256(white_spaced_template.encode("utf-8")).hexdigest())
+            if key not in PromptHandler.template_token_lenghts:
+                PromptHandler.template_token_lenghts[key] = len(self.encoding.encode(white_spaced_template))
+            self.prompts[template]["prompt_token_lenght"] = PromptHandler.template_token_lenghts[key]
 
     def get_raw_template(self, template: int = 0) -> dict:
         """
@@ -369,13 +420,66 @@ class PromptHandler:
             ---------
                 int: The prompt token lenght.
         """
-        return len(self.encoding.encode(prompt))
+        return PromptHandler.count_tokens(self.encoding, prompt)
+
+    @staticmethod
+    def count_tokens(encoding: tiktoken.Encoding, text: str) -> int:
+        """
+            Counts the tokens of a text with the given encoding. The same texts (like the tree
+            context of the files of a folder) are counted many times in a run, so the counts of
+            the last TOKEN_CACHE_SIZE texts are kept in memory for the run, keyed by the sha256
+            of the text so the texts themselves (whole files) are not kept alive.
+
+            Args:
+            ---------
+                encoding (tiktoken.Encoding): The encoding.
+                text (str): The text.
+
+            Returns:
+            ---------
+                int: The number of tokens.
+        """
+        key = (encoding.name, sha256(text.encode("utf-8")).digest())
+        with PromptHandler.token_counts_lock:
+            count = PromptHandler.token_counts.get(key)
+            if count is not None:
+                PromptHandler.token_counts.move_to_end(key)
+                return count
+
+        count = len(encoding.encode(text))
+        with PromptHandler.token_counts_lock:
+            PromptHandler.token_counts[key] = count
+            if len(PromptHandler.token_counts) > TOKEN_CACHE_SIZE:
+                PromptHandler.token_counts.popitem(last=False)
+        return count
+
+    def get_cache_key(self, code: str, template: int = 0, context: str = "") -> str:
+        """
+            Returns the content-addressed cache key for running the given template over the given code.
+            The key is the sha256 of the code, the context sent with it, the template number, the model name
+            and the prompt version, so changing any of them produces a different key.
+
+            Args:
+            ---------
+                code (str): The code sent to the template.
+                template (int): The template number.
+                context (str): The other inputs of the template, like the tree context of the file.
+
+            Returns:
+            ---------
+                str: The hex digest of the key.
+        """
+        key = sha256()
+        for part in (code, context, str(template), self.model_name, PROMPT_VERSION):
+            key.update(part.encode("utf-8"))
+            key.update(b"\0")
+        return key.hexdigest()
 
 
     def load_initial_filesreport(self) -> None:
         """
             Loads the initial files report. This filesreport.txt is the initial files report.
-            The 'filesreport.txt' contains the tree output of the 'tree' command runned over
+            The 'filesreport.txt' contains the listing of the project tree (like the 'tree' command) over
             the folder of interest.
 
             Args:
@@ -386,6 +490,8 @@ class PromptHandler:
             ---------
                 None
         """
+        if not os.path.exists(f"{OUTPUTS_PATH}filesreport.txt"):
+            return
         with open(f"{OUTPUTS_PATH}filesreport.txt", "r") as f:
             self.initial_files_report = f.read()
 
@@ -405,4 +511,212 @@ class PromptHandler:
         template = self.get_raw_template(template=template)
         dict_vars = {var: "" for var in template["input_variables"]}
 
-        return template["template"].format(**dict_vars)
\ No newline at end of file
+        return template["template"].format(**dict_vars)
+
+    def set_project_tree(self, project_tree: dict, files_report: str = None) -> None:
+        """
+            Builds the path index of the project tree, so the tree context of a file can be found
+            without going through the whole tree. Paths start with the name of the root folder,
+            and the folders are listed among the children with a trailing '/'.
+
+            Args:
+            ---------
+                project_tree (dict): The root folder of the json report of the project tree.
+                files_report (str): The text listing of the project tree, replaces the initial files report if given.
+
+            Returns:
+            ---------
+                None
+        """
+        if files_report is not None:
+            self.initial_files_report = files_report
+        self.root_name = project_tree["name"]
+        self.path_index = {}
+        self.module_paths = {}
+
+        folders = [(project_tree, self.root_name)]
+        while folders:
+            folder, path = folders.pop()
+            children = []
+            for child in folder.get("contents", []):
+                child_path = f"{path}/{child['name']}"
+                if child["type"] == "directory":
+                    children.append(child["name"] + "/")
+                    folders.append((child, child_path))
+                    self.module_paths[child_path] = child_path
+                else:
+                    children.append(child["name"])
+                    self.module_paths[child_path.removesuffix(".py")] = child_path
+            self.path_index[path] = children
+
+    def get_folder_listing(self, file_full_path: str) -> str:
+        """
+            Returns the names of the files and folders next to a file, sorted and one per line.
+            If the project tree was not set, returns an empty string.
+
+            Args:
+            ---------
+                file_full_path (str): The path of the file, starting with the name of the root folder.
+
+            Returns:
+            ---------
+                str: The listing of the folder of the file.
+        """
+        if self.path_index is None:
+            return ""
+        return "\n".join(sorted(self.path_index.get(file_full_path.rpartition("/")[0], [])))
+
+    def get_tree_context(self, file_full_path: str, dependencies: list = None) -> str:
+        """
+            Returns the part of the project tree relevant to a file instead of the whole tree: the siblings
+            of the file, the targets of its internal dependencies, and the folders of its package up to the root,
+            in that order of priority until the tree context reaches tree_context_max_tokens.
+            If the project tree was not set, returns the initial files report.
+
+            Args:
+            ---------
+                file_full_path (str): The path of the file, starting with the name of the root folder.
+                dependencies (list): The dependencies of the file, as 'int/<path>' or 'ext/<package>', if known.
+
+            Returns:
+            ---------
+                str: The tree context of the file.
+        """
+        if self.path_index is None:
+            return self.initial_files_report
+
+        parts = file_full_path.split("/")
+        folders = ["/".join(parts[:end]) for end in range(1, len(parts))]
+
+        candidates = [f"{folders[-1]}/{child.rstrip('/')}" for child in self.path_index.get(folders[-1], [])]
+        for dependency in dependencies or []:
+            if dependency.startswith("int/") and f"{self.root_name}/{dependency[4:]}" in self.module_paths:
+                candidates.append(self.module_paths[f"{self.root_name}/{dependency[4:]}"])
+        for folder in reversed(folders[:-1]):
+            candidates.extend(f"{folder}/{child.rstrip('/')}" for child in self.path_index.get(folder, []))
+
+        selected = {self.root_name}
+        tokens = self.get_prompt_token_lenght(self.root_name)
+        for candidate in candidates:
+            # a path is shown with all its folders, so they are added too
+            candidate_parts = candidate.split("/")
+            new_paths = [path for path in ("/".join(candidate_parts[:end]) for end in range(2, len(candidate_parts) + 1))
+                         if path not in selected]
+            new_tokens = sum(self.get_prompt_token_lenght("    " * path.count("/") + path.split("/")[-1])
+                             for path in new_paths)
+            if tokens + new_tokens > self.tree_context_max_tokens:
+                break
+            selected.update(new_paths)
+            tokens += new_tokens
+
+        return self.render_tree(selected)
+
+    def compact_directory(self, contents: list, max_tokens: int = None) -> str:
+        """
+            Returns the contents of a directory as a compact json list, with only the name, the type and
+            the explanation of every file and subdirectory. The explanations share the token budget: the
+            short ones are kept whole and the budget left is split evenly among the long ones, which are truncated.
+            If even the names don't fit, the last children are left out and counted in a final entry.
+
+            Args:
+            ---------
+                contents (list): The children of the directory, as dicts with 'name', 'type' and 'explanation'.
+                max_tokens (int): The token budget, by default directory_context_max_tokens.
+
+            Returns:
+            ---------
+                str: The compact json of the contents.
+        """
+        if max_tokens is None:
+            max_tokens = self.directory_context_max_tokens
+
+        entries = [{"name": child["name"], "type": child["type"]} for child in contents]
+        # the tokens of the entries without explanations, plus a few for the explanation key
+        budget = max_tokens - sum(self.get_prompt_token_lenght(json.dumps(entry)) + 4 for entry in entries)
+
+        while budget < 0 and entries:
+            entry = entries.pop()
+            budget += self.get_prompt_token_lenght(json.dumps(entry)) + 4
+        omitted = len(contents) - len(entries)
+
+        explanations = [str(child.get("explanation", "")) for child in contents[:len(entries)]]
+        lenghts = [self.get_prompt_token_lenght(explanation) for explanation in explanations]
+
+        # the shortest explanations are given their whole lenght first
+        for position, index in enumerate(sorted(range(len(entries)), key=lambda i: lenghts[i])):
+            share = budget // (len(entries) - position)
+            entries[index]["explanation"] = self.truncate(explanations[index], share)
+            budget -= min(lenghts[index], share)
+
+        if omitted:
+            entries.append({"name": f"... and {omitted} more", "type": "omitted"})
+        return json.dumps(entries)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """
+            Truncates a text to the given number of tokens, marking the cut with '...'.
+
+            Args:
+            ---------
+                text (str): The text.
+                max_tokens (int): The maximum number of tokens.
+
+            Returns:
+            ---------
+                str: The truncated text.
+        """
+        tokens = self.encoding.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[:max(max_tokens - 1, 0)]).rstrip() + "..."
+
+    def render_tree(self, paths: set) -> str:
+        """
+            Renders the given paths of the project tree like the 'tree' command does,
+            folders with children that are not shown end with a '...' line.
+
+            Args:
+            ---------
+                paths (set): The paths to render, including all their folders.
+
+            Returns:
+            ---------
+                str: The rendered tree.
+        """
+        lines = [self.root_name]
+        pending = self.shown_children(self.root_name, "", paths)
+        while pending:
+            line, path, prefix = pending.pop()
+            lines.append(line)
+            if path in self.path_index:
+                pending.extend(self.shown_children(path, prefix, paths))
+
+        return "\n".join(lines)
+
+    def shown_children(self, folder: str, prefix: str, paths: set) -> list:
+        """
+            Returns the lines of the children of a folder that are shown in the tree context,
+            in reverse order so they can be popped in order.
+
+            Args:
+            ---------
+                folder (str): The path of the folder.
+                prefix (str): The prefix of the lines of the children.
+                paths (set): The paths shown in the tree context.
+
+            Returns:
+            ---------
+                list: The (line, path, prefix of its own children) of each shown child.
+        """
+        children = [child.rstrip("/") for child in self.path_index[folder]]
+        shown = [child for child in children if f"{folder}/{child}" in paths]
+        if len(shown) < len(children):
+            shown.append("...")
+
+        lines = []
+        for i, child in enumerate(shown):
+            last = i == len(shown) - 1
+            lines.append((prefix + ("└── " if last else "├── ") + child,
+                          f"{folder}/{child}",
+                          prefix + ("    " if last else "│   ")))
+        return lines[::-1]
@@ -1,7 +1,7 @@
-import shutil
+import argparse
 
 from Report import Report
-import sys
+from Profiler import profiler
 import os
 from dotenv import load_dotenv
 import http.server
@@ -21,20 +21,31 @@ def main():
     BLUE = '\033[94m'
     END = '\033[0m'
 
-    # check if tree is installed
-    if not shutil.which("tree"):
-        print(RED + "Please install tree" + END)
+    parser = argparse.ArgumentParser(description="Generates the report of a python project")
+    parser.add_argument("project_name", help="the path of the project to analyze")
+    parser.add_argument("--since", help="update the previous report, analyzing only the files changed since this git revision")
+    parser.add_argument("--until", help="the git revision to compare with --since, by default the working tree")
+    parser.add_argument("--resume", action="store_true", help="resume an interrupted run from its checkpoint journal")
+    parser.add_argument("--profile", action="store_true",
+                        help="time the phases and the model calls, saving a Chrome trace to outputs/profile.json")
+    parser.add_argument("--profile-cpu", action="store_true",
+                        help="like --profile, also capturing the CPU time of the local work with cProfile in outputs/profile.prof")
+    args = parser.parse_args()
+
+    if args.until is not None and args.since is None:
+        print(RED + "--until needs --since" + END)
         return
 
-    if len(sys.argv) < 2:
-        print(RED + "Usage: python3 snoo.py <project_name>" + END)
-        return
-
-    project_name = sys.argv[1]
+    project_name = args.project_name
     print(BLUE + "Generating report for project", project_name + END)
 
+    if args.profile or args.profile_cpu:
+        profiler.enable(cpu=args.profile_cpu)
+
     report = Report(project_name)
-    report.complete_report()
+    report.complete_report(since=args.since, until=args.until, resume=args.resume)
+    print(BLUE + "Model usage (the details are in the outputs folder, metrics.json):" + END)
+    print(report.LLM.metrics.summary())
     PORT = 8004
 
     try:
@@ -0,0 +1,29 @@
+import os
+import sys
+import pytest
+
+# the modules of src import each other by name, like when snoo.py is run from src
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+
+class FakeEncoding:
+    """
+        A stand in for a tiktoken encoding, a token every 4 characters, so the tests don't download encodings.
+    """
+
+    name = "fake"
+
+    def encode(self, text, **kwargs):
+        return [ord(char) for char in text[::4]]
+
+    def decode(self, tokens):
+        return "".join(chr(token) * 4 for token in tokens)
+
+
+@pytest.fixture
+def prompt_handler(monkeypatch):
+    from prompt_handler import PromptHandler
+
+    monkeypatch.setitem(PromptHandler.encodings, "gpt-3.5-turbo-16k", FakeEncoding())
+    monkeypatch.setattr(PromptHandler, "load_initial_filesreport", lambda self: None)
+    return PromptHandler(model_name="gpt-3.5-turbo-16k")
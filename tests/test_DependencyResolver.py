@@ -0,0 +1,50 @@
+from DependencyResolver import DependencyResolver
+from PathIndex import PathIndex
+
+
+FILES = ["pkg/__init__.py", "pkg/a.py", "pkg/b.py", "pkg/sub/__init__.py", "pkg/sub/c.py", "main.py", "config.json"]
+
+
+def resolve(file_full_path, code):
+    return DependencyResolver("project", PathIndex(FILES)).resolve(file_full_path, code)
+
+
+def test_relative_import_of_an_attribute_resolves_to_the_package():
+    assert resolve("project/pkg/a.py", "from . import helper") == ["int/pkg/__init__"]
+
+
+def test_relative_import_of_a_submodule():
+    assert resolve("project/pkg/a.py", "from . import b") == ["int/pkg/b"]
+
+
+def test_relative_import_from_the_parent_package():
+    assert resolve("project/pkg/sub/c.py", "from .. import x") == ["int/pkg/__init__"]
+    assert resolve("project/pkg/sub/c.py", "from .. import a") == ["int/pkg/a"]
+
+
+def test_relative_import_outside_the_project_has_no_dependency():
+    assert resolve("project/main.py", "from . import x") == []
+    assert resolve("project/pkg/a.py", "from ... import x") == []
+
+
+def test_absolute_imports():
+    assert resolve("project/main.py", "import numpy\nfrom pkg.sub import c\nfrom pkg import thing") == [
+        "ext/numpy", "int/pkg/sub/c", "int/pkg/__init__"]
+
+
+def test_only_python_files_are_modules():
+    assert resolve("project/main.py", "import config") == ["ext/config"]
+
+
+def test_a_python_module_is_not_shadowed_by_files_with_the_same_name():
+    for files in (["lib/schema.json", "lib/schema.py", "main.py"], ["lib/schema.py", "lib/schema.js", "main.py"]):
+        resolver = DependencyResolver("project", PathIndex(files))
+        assert resolver.resolve("project/main.py", "from lib.schema import Schema") == ["int/lib/schema"]
+        assert resolver.resolve("project/main.py", "import schema") == ["ext/schema"]
+
+
+def test_files_of_other_languages_keep_their_extension_in_the_ids():
+    index = PathIndex(["lib/parser.c", "lib/parser.h", "lib/lexer.c", "main.py"])
+    assert index.resolve("int/lib/lexer.c") == "int/lib/lexer.c"
+    assert index.resolve("lexer") == "int/lib/lexer.c"
+    assert index.resolve("main.py") == "int/main"
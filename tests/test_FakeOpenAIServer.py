@@ -0,0 +1,32 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from FakeOpenAIServer import FakeOpenAIServer
+
+PROMPTS = [f"Explain the file module_{index}.py" for index in range(200)]
+
+
+def statuses(order, seed=0):
+    server = FakeOpenAIServer(latency=0, rate_limit_rate=0.2, error_rate=0.1, seed=seed)
+
+    def send(prompt):
+        # every prompt is retried once, like the scheduler does after an error
+        return prompt, [server.answer("/v1/completions", {"prompt": prompt})[0] for _ in range(2)]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        return dict(executor.map(send, order))
+
+
+def test_errors_do_not_depend_on_the_arrival_order():
+    shuffled = list(PROMPTS)
+    random.Random(1).shuffle(shuffled)
+
+    first = statuses(PROMPTS)
+    assert statuses(shuffled) == first
+    assert {429, 503, 200} <= {status for attempts in first.values() for status in attempts}
+    # a retry of a prompt is a new draw
+    assert any(attempts[0] != attempts[1] for attempts in first.values())
+
+
+def test_the_seed_changes_the_errors():
+    assert statuses(PROMPTS, seed=1) != statuses(PROMPTS, seed=0)
@@ -0,0 +1,159 @@
+import json
+
+import openai
+import pytest
+
+import LLMManager
+from LLMManager import LLM, RequestScheduler
+from MetricsHandler import MetricsHandler
+from ResponseCache import ResponseCache
+from FileHandler import FileHandler
+
+
+def project_tree(*root_files):
+    return {"type": "directory", "name": "project", "contents": [
+        {"type": "directory", "name": "lib", "contents": [
+            {"type": "file", "name": "module.py"}, {"type": "file", "name": "parser.c"}]},
+        *({"type": "file", "name": name} for name in root_files),
+    ]}
+
+
+def make_llm(tmp_path, prompt_handler):
+    llm = object.__new__(LLM)
+    llm.prompt_handler = prompt_handler
+    llm.cache = ResponseCache(f"{tmp_path}/", max_size=10**6)
+    llm.metrics = MetricsHandler()
+    llm.file_handler = FileHandler()
+    llm.context_window_size = 16000
+    llm.options = {"max_tokens": 100}
+    llm.calls = 0
+
+    def run_chain(llm_chain, template, text, **inputs):
+        llm.calls += 1
+        return json.dumps({"dependencies": [], "explanation": "explained"})
+
+    llm.load_chain = lambda template, requires_memory=False: None
+    llm.run_chain = run_chain
+    return llm
+
+
+def test_new_files_elsewhere_keep_the_cached_analyses(tmp_path, prompt_handler):
+    llm = make_llm(tmp_path, prompt_handler)
+    prompt_handler.set_project_tree(project_tree("main.py"))
+    llm.generate_response("project/lib/module.py", "import os\n", dependencies=["ext/os"])
+    llm.generate_response("project/lib/parser.c", "int main() {}\n")
+    assert llm.calls == 2
+
+    prompt_handler.set_project_tree(project_tree("main.py", "newfile.txt"))
+    llm.generate_response("project/lib/module.py", "import os\n", dependencies=["ext/os"])
+    llm.generate_response("project/lib/parser.c", "int main() {}\n")
+    assert llm.calls == 2
+
+
+def test_a_new_sibling_redoes_the_analyses_with_model_dependencies(tmp_path, prompt_handler):
+    llm = make_llm(tmp_path, prompt_handler)
+    prompt_handler.set_project_tree(project_tree())
+    llm.generate_response("project/lib/parser.c", "int main() {}\n")
+
+    tree = project_tree()
+    tree["contents"][0]["contents"].append({"type": "file", "name": "parser.h"})
+    prompt_handler.set_project_tree(tree)
+    llm.generate_response("project/lib/parser.c", "int main() {}\n")
+    assert llm.calls == 2
+
+
+def test_a_chain_is_built_with_the_model_loaded_for_it(prompt_handler, monkeypatch):
+    llm = LLM("project", {"model_name": "gpt-3.5-turbo-16k", "temperature": 0, "max_tokens": 100, "verbose": False},
+              backend="llamacpp-server", structured_output=True)
+    load_model = llm.load_model
+
+    def load_model_and_swap(json_output=False):
+        model = load_model(json_output)
+        # a concurrent call of a template without json output loads the model without the grammar
+        load_model(not json_output)
+        return model
+
+    monkeypatch.setattr(llm, "load_model", load_model_and_swap)
+    assert llm.load_chain(template=0).llm.grammar == llm.grammar
+    assert llm.load_chain(template=5).llm.grammar is None
+
+
+class FakeClock:
+    """
+        A clock that only moves when something sleeps, so the waits of the scheduler are checked without waiting.
+    """
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 6))
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(LLMManager, "time", clock)
+    return clock
+
+
+def test_the_buckets_hold_a_burst_and_then_spread_the_requests(clock):
+    # buckets of 10 seconds: 10 requests and 100 tokens
+    scheduler = RequestScheduler(requests_per_minute=60, tokens_per_minute=600)
+    for _ in range(10):
+        scheduler.acquire(10)
+    assert clock.sleeps == []
+
+    scheduler.acquire(10)
+    scheduler.acquire(10)
+    assert clock.sleeps == [1.0, 1.0]
+
+
+def test_the_tokens_budget_delays_big_requests(clock):
+    scheduler = RequestScheduler(requests_per_minute=60, tokens_per_minute=600)
+    scheduler.acquire(100)
+    # 50 tokens refill in 5 seconds, a request bigger than the bucket only waits for a full bucket
+    scheduler.acquire(50)
+    scheduler.acquire(1000)
+    assert clock.sleeps == [5.0, 10.0]
+
+
+def test_a_rate_limit_pauses_the_requests_for_the_retry_after(clock):
+    retries = []
+    scheduler = RequestScheduler(requests_per_minute=6000, tokens_per_minute=10**6, on_retry=lambda: retries.append(1))
+    answers = iter([openai.error.RateLimitError("slow down", headers={"retry-after": "2.5"}), "done"])
+
+    def request():
+        answer = next(answers)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    assert scheduler.run(request, 10) == "done"
+    assert retries == [1]
+    assert clock.sleeps == [2.5]
+
+    # the other callers wait for the pause too
+    scheduler.paused_until = clock.now + 1
+    scheduler.acquire(10)
+    assert clock.sleeps == [2.5, 1.0]
+
+
+def test_transient_errors_back_off_exponentially_until_the_last_retry(clock):
+    scheduler = RequestScheduler(requests_per_minute=6000, tokens_per_minute=10**6, max_retries=2)
+
+    def request():
+        raise openai.error.ServiceUnavailableError("overloaded")
+
+    with pytest.raises(openai.error.ServiceUnavailableError):
+        scheduler.run(request, 10)
+    assert clock.sleeps == [1, 2]
+
+
+def test_the_retry_after_headers():
+    assert RequestScheduler.retry_after(openai.error.RateLimitError(headers={"retry-after-ms": "1500"}), 0) == 1.5
+    assert RequestScheduler.retry_after(openai.error.RateLimitError(headers={"retry-after": "soon"}), 3) == 8
@@ -0,0 +1,134 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+llama_cpp = pytest.importorskip("llama_cpp")
+gguf = pytest.importorskip("gguf")
+
+from LlamaCppModel import LlamaCppModel
+
+
+@pytest.fixture(scope="module")
+def model_path(tmp_path_factory):
+    """
+        A tiny llama model with random weights, its completions are gibberish but they are deterministic.
+    """
+    path = str(tmp_path_factory.mktemp("models") / "tiny.gguf")
+    generator = np.random.default_rng(0)
+    n_embd, n_ff, n_head, n_layer = 64, 128, 4, 2
+    pieces = ["▁"] + [chr(code) for code in range(ord("a"), ord("z") + 1)] + list('{}":,[] ')
+    tokens = ["<unk>", "<s>", "</s>"] + [f"<0x{byte:02X}>" for byte in range(256)] + pieces
+
+    writer = gguf.GGUFWriter(path, "llama")
+    writer.add_context_length(2048)
+    writer.add_embedding_length(n_embd)
+    writer.add_block_count(n_layer)
+    writer.add_feed_forward_length(n_ff)
+    writer.add_head_count(n_head)
+    writer.add_head_count_kv(n_head)
+    writer.add_rope_dimension_count(n_embd // n_head)
+    writer.add_layer_norm_rms_eps(1e-5)
+    writer.add_tokenizer_model("llama")
+    writer.add_token_list(tokens)
+    writer.add_token_scores([0.0] * 3 + [-1000.0] * 256 + [-1.0] * len(pieces))
+    writer.add_token_types([2, 3, 3] + [6] * 256 + [1] * len(pieces))
+    writer.add_bos_token_id(1)
+    writer.add_eos_token_id(2)
+    writer.add_unk_token_id(0)
+
+    def weights(*shape):
+        return (generator.standard_normal(shape) * 0.2).astype(np.float32)
+
+    writer.add_tensor("token_embd.weight", weights(len(tokens), n_embd))
+    writer.add_tensor("output_norm.weight", np.ones(n_embd, np.float32))
+    writer.add_tensor("output.weight", weights(len(tokens), n_embd))
+    for layer in range(n_layer):
+        writer.add_tensor(f"blk.{layer}.attn_norm.weight", np.ones(n_embd, np.float32))
+        for name in ("q", "k", "v", "output"):
+            writer.add_tensor(f"blk.{layer}.attn_{name}.weight", weights(n_embd, n_embd))
+        writer.add_tensor(f"blk.{layer}.ffn_norm.weight", np.ones(n_embd, np.float32))
+        writer.add_tensor(f"blk.{layer}.ffn_gate.weight", weights(n_ff, n_embd))
+        writer.add_tensor(f"blk.{layer}.ffn_up.weight", weights(n_ff, n_embd))
+        writer.add_tensor(f"blk.{layer}.ffn_down.weight", weights(n_embd, n_ff))
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_tensors_to_file()
+    writer.close()
+
+    yield path
+    LlamaCppModel.loaded_models.clear()
+    LlamaCppModel.batchers.clear()
+
+
+PROMPTS = ["def main():", "import os", "{\"a\": 1,", "x", "class Model:\n    pass", "print('hello world')"]
+
+
+def greedy_completion(client, prompt, max_tokens):
+    # one prompt at a time, with the generation loop of llama-cpp-python
+    client.reset()
+    generated = []
+    for token in client.generate(client.tokenize(prompt.encode("utf-8"), special=True), temp=0):
+        if llama_cpp.llama_token_is_eog(client._model.model, token) or len(generated) == max_tokens:
+            break
+        generated.append(token)
+    return client.detokenize(generated).decode("utf-8", errors="ignore")
+
+
+def test_the_prompts_decoded_together_complete_like_one_at_a_time(model_path):
+    serial = LlamaCppModel(model_path=model_path, max_tokens=30, n_ctx=512, n_seq=1)
+    expected = [greedy_completion(serial.client, prompt, 30) for prompt in PROMPTS]
+
+    # the batcher gets its own model, the one used above is not shared with it
+    LlamaCppModel.loaded_models.clear()
+    batched = LlamaCppModel(model_path=model_path, max_tokens=30, n_ctx=512, n_seq=4)
+    assert [generation[0].text for generation in batched.generate(PROMPTS).generations] == expected
+
+    completions = {}
+
+    def complete(prompt):
+        completions[prompt] = batched(prompt)
+
+    threads = [threading.Thread(target=complete, args=(prompt,)) for prompt in PROMPTS]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [completions[prompt] for prompt in PROMPTS] == expected
+
+
+def test_the_prompts_that_dont_fit_together_wait_for_room_in_the_context(model_path):
+    batched = LlamaCppModel(model_path=model_path, max_tokens=200, n_ctx=512, n_seq=4)
+    assert len(batched.generate(PROMPTS).generations) == len(PROMPTS)
+    assert batched.batcher.reserved == 0 and not batched.batcher.active
+
+
+def test_every_sequence_follows_the_grammar(model_path):
+    with open(os.path.join(os.path.dirname(__file__), "..", "config", "json.gbnf"), "r") as f:
+        grammar = f.read()
+    batched = LlamaCppModel(model_path=model_path, max_tokens=40, n_ctx=512, n_seq=4, grammar=grammar)
+    completions = [generation[0].text for generation in batched.generate(PROMPTS).generations]
+    assert all(completion.lstrip().startswith("{") for completion in completions)
+
+
+def test_the_context_freed_between_sequences_is_reused(model_path):
+    # sequences of many sizes finishing at different times leave holes in the context
+    generator = np.random.default_rng(1)
+    prompts = ["".join(generator.choice(list("abcdefgh {}\n"), size=size)) for size in generator.integers(5, 400, 24)]
+    batched = LlamaCppModel(model_path=model_path, max_tokens=80, n_ctx=1024, n_seq=4)
+    errors = []
+
+    def complete(chunk):
+        for prompt in chunk:
+            try:
+                batched(prompt)
+            except Exception as error:
+                errors.append(error)
+
+    threads = [threading.Thread(target=complete, args=(prompts[index::6],)) for index in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
@@ -0,0 +1,54 @@
+import openai
+import pytest
+
+import LLMManager
+from LLMManager import LLM
+from LlamaCppServer import LlamaCppServer
+from FakeOpenAIServer import FakeOpenAIServer
+from ResponseValidator import ResponseValidator
+
+GRAMMAR = 'root ::= "{" [^}]* "}"'
+
+
+@pytest.fixture
+def server():
+    fake = FakeOpenAIServer(latency=0)
+    fake.start()
+    yield fake
+    fake.stop()
+
+
+def test_the_grammar_is_sent_and_the_completion_parsed(server):
+    model = LlamaCppServer(server_url=server.llamacpp_url(), grammar=GRAMMAR, max_tokens=64)
+
+    response = model("Explain the file")
+
+    assert server.last_request["grammar"] == GRAMMAR
+    assert server.last_request["n_predict"] == 64
+    assert ResponseValidator.check(response) is not None
+
+
+def test_json_output_builds_the_model_with_the_grammar(server, monkeypatch):
+    monkeypatch.setattr(LLMManager, "LLAMACPP_SERVER_URL", server.llamacpp_url())
+    llm = object.__new__(LLM)
+    llm.backend = "llamacpp-server"
+    llm.grammar = GRAMMAR
+    llm.options = {"temperature": 0, "max_tokens": 64, "callback_manager": None}
+
+    llm.build_model(json_output=True)("Explain the file")
+    assert server.last_request["grammar"] == GRAMMAR
+
+    response = llm.build_model(json_output=False)("Explain the file")
+    assert "grammar" not in server.last_request
+    # without the grammar the stub answers with text around the json, which is repaired locally
+    assert ResponseValidator.check(response) is not None
+
+
+def test_a_busy_server_raises_a_retryable_error(server):
+    server.rate_limit_rate = 1
+    model = LlamaCppServer(server_url=server.llamacpp_url())
+
+    with pytest.raises(openai.error.RateLimitError) as error:
+        model("Explain the file")
+    assert isinstance(error.value, LLMManager.RequestScheduler.retryable_errors)
+    assert LLMManager.RequestScheduler.retry_after(error.value, 0) == server.retry_after
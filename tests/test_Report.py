@@ -0,0 +1,156 @@
+import subprocess
+import threading
+
+from Checkpoint import Checkpoint
+from Report import Report
+
+
+def make_report(project_path="project"):
+    report = object.__new__(Report)
+    report.project_path = project_path
+    report.ext_dependencies = {}
+    report.int_dependencies = {}
+    return report
+
+
+def test_only_python_files_lose_their_extension():
+    report = make_report()
+    files = [{"type": "file", "name": name, "full_path": f"project/{name}", "id": f"int/{name}"}
+             for name in ("parser.c", "parser.h", "main.py")]
+    report.report = [{"type": "directory", "name": "project", "contents": files}, {"type": "report"}]
+    report.nodes = [(report.report[0], None, "project")] + [(file, report.report[0], file["full_path"]) for file in files]
+    report.int_dependencies = {"int/parser.h": 2, "int/main": 1}
+
+    report.finalize_report()
+    assert [file["id"] for file in report.report[0]["children"]] == ["int/parser.c", "int/parser.h", "int/main"]
+    assert [file.get("times_called") for file in files] == [None, 2, 1]
+    assert files[2]["name"] == "main" and files[2]["full_path"] == "project/main"
+
+
+def test_files_that_are_not_utf8_are_read(tmp_path):
+    (tmp_path / "legacy.c").write_bytes("/* año */\nint main() {}\n".encode("latin-1"))
+    code = make_report(str(tmp_path)).load_file_content(f"{tmp_path.name}/legacy.c")
+    assert code.endswith("int main() {}\n")
+
+
+def small_tree():
+    return [{"type": "directory", "name": "project", "contents": [
+        {"type": "file", "name": "a.py"},
+        {"type": "directory", "name": "pkg", "contents": [
+            {"type": "file", "name": "b.py"},
+            {"type": "directory", "name": "sub", "contents": [{"type": "file", "name": "c.py"}]},
+        ]},
+        {"type": "directory", "name": "empty", "contents": []},
+    ]}, {"type": "report", "directories": 4, "files": 3}]
+
+
+def run_small_tree(tmp_path, max_workers):
+    report = make_report()
+    report.report = small_tree()
+    report.max_workers = max_workers
+    calls = []
+    done = set()
+    lock = threading.Lock()
+
+    def analyze_file(file):
+        with lock:
+            calls.append(file["full_path"])
+            done.add(file["full_path"])
+        return {"dependencies": [], "explanation": f"explains {file['name']}"}
+
+    def explain_directory(directory, path):
+        with lock:
+            # a directory is only explained once everything inside it is done
+            children = [f"{path}/{child['name']}" for child in directory["contents"]]
+            assert all(child in done for child in children)
+            calls.append(path)
+            done.add(path)
+        return f"explains {path}"
+
+    report.analyze_file = analyze_file
+    report.explain_directory = explain_directory
+    files = report.build_node_table()
+    directories = [(node, path) for node, _, path in report.nodes if node["type"] == "directory"]
+    parents, pending, ready_directories = report.build_directory_graph()
+    report.checkpoint = Checkpoint("project", f"{tmp_path}/")
+    report.checkpoint.open()
+    report.run_analyses(iter(files), ready_directories, parents, pending,
+                        {id(directory): path for directory, path in directories})
+    report.checkpoint.close()
+    return report, calls
+
+
+def test_the_analyses_run_from_the_leaves_to_the_root(tmp_path):
+    _, calls = run_small_tree(tmp_path, max_workers=1)
+    assert calls == ["project/empty", "project/a.py", "project/pkg/b.py", "project/pkg/sub/c.py",
+                     "project/pkg/sub", "project/pkg", "project"]
+
+
+def test_the_concurrent_analyses_are_all_recorded(tmp_path):
+    report, calls = run_small_tree(tmp_path, max_workers=3)
+    assert calls[-1] == "project" and len(calls) == 7
+
+    checkpoint = Checkpoint("project", f"{tmp_path}/")
+    checkpoint.load()
+    assert set(checkpoint.records) == {("file", "int/a.py"), ("file", "int/pkg/b.py"), ("file", "int/pkg/sub/c.py"),
+                                       ("directory", "project"), ("directory", "project/pkg"),
+                                       ("directory", "project/pkg/sub"), ("directory", "project/empty")}
+    assert report.report[0]["explanation"] == "explains project"
+
+
+def git(repository, *args):
+    subprocess.run(["git", "-C", str(repository), "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+                   check=True, capture_output=True)
+
+
+def make_repository(tmp_path):
+    project = tmp_path / "project"
+    (project / "pkg").mkdir(parents=True)
+    (project / "a.py").write_text("import os\n")
+    (project / "pkg" / "b.py").write_text("import sys\n")
+    (project / "pkg" / "old.py").write_text("".join(f"def function_{i}():\n    return {i}\n" for i in range(20)))
+    (tmp_path / "outside.txt").write_text("not in the project\n")
+    git(tmp_path, "init", "-q")
+    git(tmp_path, "add", "-A")
+    git(tmp_path, "commit", "-q", "-m", "first")
+
+    (project / "a.py").write_text("import json\n")
+    git(tmp_path, "mv", "project/pkg/old.py", "project/pkg/new.py")
+    (project / "my file.py").write_text("print()\n")
+    (tmp_path / "outside.txt").write_text("changed\n")
+    git(tmp_path, "add", "-A")
+    return project
+
+
+def test_the_changed_files_include_both_paths_of_a_rename(tmp_path):
+    project = make_repository(tmp_path)
+    expected = {"a.py", "pkg/old.py", "pkg/new.py", "my file.py"}
+    # against the working tree, and between two commits
+    assert make_report(str(project)).changed_files("HEAD") == expected
+    git(tmp_path, "commit", "-q", "-m", "second")
+    assert make_report(str(project)).changed_files("HEAD~1", "HEAD") == expected
+
+
+def test_the_previous_analyses_of_the_unchanged_files_are_reused(tmp_path):
+    project = make_repository(tmp_path)
+    previous = [{"type": "directory", "name": "project", "explanation": "old root", "children": [
+        {"type": "file", "name": "a", "id": "int/a", "dependencies": ["ext/os"], "explanation": "old a"},
+        {"type": "directory", "name": "pkg", "explanation": "old pkg", "children": [
+            {"type": "file", "name": "b", "id": "int/pkg/b", "dependencies": ["ext/sys"], "explanation": "old b"},
+            {"type": "file", "name": "old", "id": "int/pkg/old", "dependencies": [], "explanation": "old old"},
+        ]},
+    ]}]
+    report = make_report(str(project))
+    report.report = [{"type": "directory", "name": "project", "contents": [
+        {"type": "file", "name": "a.py"}, {"type": "file", "name": "my file.py"},
+        {"type": "directory", "name": "pkg", "contents": [{"type": "file", "name": "b.py"}, {"type": "file", "name": "new.py"}]},
+    ]}, {"type": "report"}]
+    report.load_previous_report = lambda: previous
+    files = report.build_node_table()
+
+    report.reuse_previous_report(files, "HEAD")
+    assert {file["id"]: file.get("explanation") for file in files} == {
+        "int/a.py": None, "int/my file.py": None, "int/pkg/b.py": "old b", "int/pkg/new.py": None}
+    assert files[2]["dependencies"] == ["ext/sys"]
+    # the folders with changes inside are explained again
+    assert "explanation" not in report.report[0] and "explanation" not in report.report[0]["contents"][2]
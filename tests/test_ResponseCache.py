@@ -0,0 +1,26 @@
+from ResponseCache import ResponseCache
+
+
+def test_entries_of_an_interrupted_run_are_indexed_again(tmp_path):
+    cache_path = f"{tmp_path}/"
+    cache = ResponseCache(cache_path, max_size=10**6)
+    cache.set("a", {"explanation": "a"})
+    cache.set("b", {"explanation": "b"})
+    # the run is interrupted before saving the index, in the middle of writing an entry
+    (tmp_path / "c.json.tmp").write_text('{"expla')
+
+    cache = ResponseCache(cache_path, max_size=10**6)
+    assert list(cache.index) == ["a", "b"]
+    assert cache.get("b") == {"explanation": "b"}
+    assert not (tmp_path / "c.json.tmp").exists()
+
+
+def test_recovered_entries_count_towards_the_max_size(tmp_path):
+    cache_path = f"{tmp_path}/"
+    cache = ResponseCache(cache_path, max_size=10**6)
+    cache.set("a", {"explanation": "a" * 100})
+    cache.set("b", {"explanation": "b" * 100})
+
+    cache = ResponseCache(cache_path, max_size=150)
+    assert list(cache.index) == ["b"]
+    assert not (tmp_path / "a.json").exists()
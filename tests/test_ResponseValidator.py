@@ -0,0 +1,29 @@
+from ResponseValidator import ResponseValidator
+
+
+def test_truncated_array_keeps_the_last_element():
+    assert ResponseValidator.parse('{"dependencies": ["ext/a", "ext/b') == {"dependencies": ["ext/a", "ext/b"]}
+
+
+def test_truncated_value_string_is_closed():
+    assert ResponseValidator.parse('{"dependencies": [], "explanation": "It does') == {
+        "dependencies": [], "explanation": "It does"}
+
+
+def test_dangling_key_is_dropped():
+    assert ResponseValidator.parse('{"dependencies": [], "expla') == {"dependencies": []}
+    assert ResponseValidator.parse('{"dependencies": [], "explanation"') == {"dependencies": []}
+    assert ResponseValidator.parse('{"dependencies": [], "explanation": ') == {"dependencies": []}
+    assert ResponseValidator.parse('{"dependencies": ["ext/a"],') == {"dependencies": ["ext/a"]}
+
+
+def test_trailing_commas_are_removed_outside_strings_only():
+    assert ResponseValidator.parse('{"dependencies": ["ext/a",], "explanation": "a, ] b",}') == {
+        "dependencies": ["ext/a"], "explanation": "a, ] b"}
+    assert ResponseValidator.parse('{"dependencies": [], "explanation": "a, ] b') == {
+        "dependencies": [], "explanation": "a, ] b"}
+
+
+def test_text_around_the_json_is_removed():
+    assert ResponseValidator.check('```json\n{"dependencies": ["int/lib.module.py"], "explanation": "x"}\n```') == {
+        "dependencies": ["int/lib/module"], "explanation": "x"}